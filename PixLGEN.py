@@ -1,12 +1,50 @@
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-import tkinterdnd2 as tkdnd
-from PIL import Image, ImageTk
-import requests
+from tkinter import ttk, filedialog, messagebox, simpledialog
+from PIL import Image
 from io import BytesIO
+import importlib
+import importlib.util
 import numpy as np
-from sklearn.cluster import KMeans
 import os
+import sys
+import threading
+from dataclasses import replace
+
+from disk_cache import get_disk_cache
+from dithering import DITHERERS
+from downsampling import DOWNSAMPLERS
+from export import DEFAULT_COMPRESS_LEVEL, save_indexed, save_palette_files
+from fetch import FetchError, get_fetcher
+from palette_lut import load_palette
+from palette_sweep import SWEEP_COUNTS, sweep_palettes
+from preview import PreviewRenderer
+from loader import load_to_canvas
+from pipeline import SETTING_RANGES, ConversionSettings, PixelArtPipeline
+from presets import CANVAS_PRESETS, preset_targets, render_presets, target_path
+from profiling import TRACE_ENV_VAR, Tracer, span, tracing
+from quantizers import QUANTIZERS
+from stage_cache import StageCache
+from tasks import TaskRunner
+
+
+# Live preview: draft at most once per frame, refine after this much idle time
+LIVE_FRAME_MS = 16
+LIVE_REFINE_DELAY_MS = 400
+# Restart the background palette sweep once settings have been still this long
+SWEEP_DELAY_MS = 1000
+
+# Imported lazily where they're used, and pre-warmed once the window is up
+PREWARM_MODULES = ("sklearn.cluster", "requests")
+PREWARM_DELAY_MS = 500
+# Set by benchmarks/bench_startup.py to close the window once it is shown
+STARTUP_BENCH_ENV_VAR = "PIXLGEN_EXIT_AFTER_STARTUP"
+REQUIRED_PACKAGES = (("tkinterdnd2", "tkinterdnd2"), ("PIL", "Pillow"), ("numpy", "numpy"),
+                     ("sklearn", "scikit-learn"), ("requests", "requests"))
+
+
+class URLLoadError(Exception):
+    """Downloading an image failed (as opposed to decoding it)"""
+
 
 class PixelArtConverter:
     def __init__(self, root):
@@ -16,14 +54,41 @@ class PixelArtConverter:
         
         # Variables
         self.original_image = None
+        # File path or downloaded bytes of the loaded image, for re-decoding
+        self.image_source = None
         self.pixel_art_image = None
+        self.pixel_art_native = None
+        self.pixel_art_key = None
         self.palette_colors = []
         
+        # Cached stage outputs so re-converting only redoes changed stages;
+        # canvases and palette fits also persist on disk across sessions
+        self.disk_cache = get_disk_cache()
+        self.stage_cache = StageCache(backing=self.disk_cache)
+        
+        # Loads, conversions and the palette sweep run off the Tk thread
+        self.tasks = TaskRunner(self.root, max_workers=3)
+        self.progress_value = tk.DoubleVar(value=0.0)
+        
         # Settings variables
         self.pixel_size = tk.IntVar(value=8)
         self.color_count = tk.IntVar(value=16)
         self.brightness = tk.DoubleVar(value=1.0)
         self.contrast = tk.DoubleVar(value=1.0)
+        self.quantizer = tk.StringVar(value=QUANTIZERS['kmeans'][0])
+        self.dither = tk.StringVar(value=DITHERERS['none'][0])
+        self.downsample_mode = tk.StringVar(value=DOWNSAMPLERS['nearest'][0])
+        self.live_preview = tk.BooleanVar(value=False)
+        self.show_timings = tk.BooleanVar(value=False)
+        self.palette_sweep = tk.BooleanVar(value=False)
+        self.trace_path = os.environ.get(TRACE_ENV_VAR)
+        self.lock_palette = tk.BooleanVar(value=False)
+        self.locked_palette = None
+        self.draft_job = None
+        self.refine_job = None
+        self.sweep_job = None
+        self.pixel_art_settings = None
+        self.pixel_art_source = None
         
         # New canvas settings
         self.canvas_width = tk.IntVar(value=96)
@@ -32,6 +97,7 @@ class PixelArtConverter:
         self.transparent_background = tk.BooleanVar(value=False)
         
         self.setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
     def setup_ui(self):
         # Main frame
@@ -68,13 +134,15 @@ class PixelArtConverter:
         
         # Width setting
         ttk.Label(canvas_frame, text="Width:").grid(row=0, column=0, sticky="w")
-        width_spinbox = ttk.Spinbox(canvas_frame, from_=16, to=512, width=8,
+        width_spinbox = ttk.Spinbox(canvas_frame, from_=SETTING_RANGES['canvas_width'][0],
+                                   to=SETTING_RANGES['canvas_width'][1], width=8,
                                    textvariable=self.canvas_width)
         width_spinbox.grid(row=0, column=1, padx=(5, 10))
         
         # Height setting
         ttk.Label(canvas_frame, text="Height:").grid(row=0, column=2, sticky="w")
-        height_spinbox = ttk.Spinbox(canvas_frame, from_=16, to=512, width=8,
+        height_spinbox = ttk.Spinbox(canvas_frame, from_=SETTING_RANGES['canvas_height'][0],
+                                    to=SETTING_RANGES['canvas_height'][1], width=8,
                                     textvariable=self.canvas_height)
         height_spinbox.grid(row=0, column=3, padx=5)
         
@@ -92,8 +160,7 @@ class PixelArtConverter:
         preset_frame = ttk.Frame(canvas_frame)
         preset_frame.grid(row=2, column=0, columnspan=4, pady=5)
         
-        presets = [("32×32", 32, 32), ("64×64", 64, 64), ("96×96", 96, 96), 
-                  ("128×128", 128, 128), ("256×256", 256, 256)]
+        presets = [(f"{w}×{h}", w, h) for w, h in CANVAS_PRESETS]
         
         for i, (name, w, h) in enumerate(presets):
             btn = ttk.Button(preset_frame, text=name, width=8,
@@ -103,7 +170,8 @@ class PixelArtConverter:
         # Pixel size setting
         ttk.Label(settings_frame, text="Pixel Size:").grid(row=1, column=0, 
                                                            sticky="w", pady=2)
-        pixel_scale = ttk.Scale(settings_frame, from_=2, to=20, 
+        pixel_scale = ttk.Scale(settings_frame, from_=SETTING_RANGES['pixel_size'][0],
+                               to=SETTING_RANGES['pixel_size'][1],
                                variable=self.pixel_size, orient="horizontal")
         pixel_scale.grid(row=2, column=0, sticky="ew", pady=2)
         ttk.Label(settings_frame, textvariable=self.pixel_size).grid(row=2, column=1, 
@@ -112,7 +180,7 @@ class PixelArtConverter:
         # Color count setting
         ttk.Label(settings_frame, text="Colors:").grid(row=3, column=0, 
                                                       sticky="w", pady=(10, 2))
-        color_scale = ttk.Scale(settings_frame, from_=4, to=64, 
+        color_scale = ttk.Scale(settings_frame, from_=SWEEP_COUNTS[0], to=SWEEP_COUNTS[-1], 
                                variable=self.color_count, orient="horizontal")
         color_scale.grid(row=4, column=0, sticky="ew", pady=2)
         ttk.Label(settings_frame, textvariable=self.color_count).grid(row=4, column=1, 
@@ -121,7 +189,8 @@ class PixelArtConverter:
         # Brightness setting
         ttk.Label(settings_frame, text="Brightness:").grid(row=5, column=0, 
                                                            sticky="w", pady=(10, 2))
-        brightness_scale = ttk.Scale(settings_frame, from_=0.3, to=2.0, 
+        brightness_scale = ttk.Scale(settings_frame, from_=SETTING_RANGES['brightness'][0],
+                                    to=SETTING_RANGES['brightness'][1],
                                     variable=self.brightness, orient="horizontal")
         brightness_scale.grid(row=6, column=0, sticky="ew", pady=2)
         brightness_label = ttk.Label(settings_frame, text="1.0")
@@ -135,7 +204,8 @@ class PixelArtConverter:
         # Contrast setting
         ttk.Label(settings_frame, text="Contrast:").grid(row=7, column=0, 
                                                          sticky="w", pady=(10, 2))
-        contrast_scale = ttk.Scale(settings_frame, from_=0.3, to=2.0, 
+        contrast_scale = ttk.Scale(settings_frame, from_=SETTING_RANGES['contrast'][0],
+                                  to=SETTING_RANGES['contrast'][1],
                                   variable=self.contrast, orient="horizontal")
         contrast_scale.grid(row=8, column=0, sticky="ew", pady=2)
         contrast_label = ttk.Label(settings_frame, text="1.0")
@@ -146,15 +216,67 @@ class PixelArtConverter:
             contrast_label.config(text=f"{self.contrast.get():.1f}")
         self.contrast.trace('w', update_contrast_label)
         
+        # Quantizer engine
+        ttk.Label(settings_frame, text="Quantizer:").grid(row=9, column=0, 
+                                                          sticky="w", pady=(10, 2))
+        quantizer_combo = ttk.Combobox(settings_frame, textvariable=self.quantizer,
+                                       values=[label for label, _ in QUANTIZERS.values()],
+                                       state="readonly")
+        quantizer_combo.grid(row=10, column=0, columnspan=2, sticky="ew", pady=2)
+        
+        # Dithering when mapping to the palette
+        ttk.Label(settings_frame, text="Dithering:").grid(row=11, column=0, 
+                                                          sticky="w", pady=(10, 2))
+        dither_combo = ttk.Combobox(settings_frame, textvariable=self.dither,
+                                    values=[label for label, _ in DITHERERS.values()],
+                                    state="readonly")
+        dither_combo.grid(row=12, column=0, columnspan=2, sticky="ew", pady=2)
+        
+        # How each pixel_size block becomes one pixel
+        ttk.Label(settings_frame, text="Pixelation:").grid(row=13, column=0, 
+                                                           sticky="w", pady=(10, 2))
+        downsample_combo = ttk.Combobox(settings_frame, textvariable=self.downsample_mode,
+                                        values=[label for label, _ in DOWNSAMPLERS.values()],
+                                        state="readonly")
+        downsample_combo.grid(row=14, column=0, columnspan=2, sticky="ew", pady=2)
+        
+        # Live preview re-renders while the sliders move
+        live_check = ttk.Checkbutton(settings_frame, text="Live preview",
+                                     variable=self.live_preview)
+        live_check.grid(row=15, column=0, sticky="w", pady=(10, 0))
+        timings_check = ttk.Checkbutton(settings_frame, text="Show timings",
+                                        variable=self.show_timings)
+        timings_check.grid(row=15, column=1, sticky="w", pady=(10, 0))
+        
+        # Fit every colour count in the background so the slider is instant
+        sweep_check = ttk.Checkbutton(settings_frame, text="Precompute colour counts",
+                                      variable=self.palette_sweep,
+                                      command=self.schedule_sweep)
+        sweep_check.grid(row=16, column=0, columnspan=2, sticky="w")
+        for var in (self.pixel_size, self.color_count, self.brightness, self.contrast,
+                    self.quantizer, self.dither, self.downsample_mode):
+            var.trace('w', self.on_setting_changed)
+        
         # Convert button
         convert_btn = ttk.Button(settings_frame, text="Convert to Pixel Art", 
                                 command=self.convert_to_pixel_art)
-        convert_btn.grid(row=9, column=0, columnspan=2, pady=(20, 10), sticky="ew")
+        convert_btn.grid(row=17, column=0, columnspan=2, pady=(20, 10), sticky="ew")
         
         # Reset button
         reset_btn = ttk.Button(settings_frame, text="Reset Settings", 
                               command=self.reset_settings)
-        reset_btn.grid(row=10, column=0, columnspan=2, pady=2, sticky="ew")
+        reset_btn.grid(row=18, column=0, columnspan=2, pady=2, sticky="ew")
+        
+        # Progress of background work
+        progress_bar = ttk.Progressbar(settings_frame, mode="determinate", maximum=1.0,
+                                       variable=self.progress_value)
+        progress_bar.grid(row=19, column=0, sticky="ew", pady=(10, 2))
+        self.cancel_btn = ttk.Button(settings_frame, text="Cancel", width=8,
+                                     command=self.cancel_tasks, state="disabled")
+        self.cancel_btn.grid(row=19, column=1, padx=(5, 0), pady=(10, 2))
+        self.status_label = ttk.Label(settings_frame, text="Ready", font=("Arial", 9),
+                                      wraplength=220)
+        self.status_label.grid(row=20, column=0, columnspan=2, sticky="w")
         
         settings_frame.columnconfigure(0, weight=1)
         
@@ -183,11 +305,15 @@ class PixelArtConverter:
         pixel_frame = ttk.Frame(notebook)
         notebook.add(pixel_frame, text="Pixel Art")
         
-        # Create checkered background for pixel art canvas to show transparency
         self.pixel_canvas = tk.Canvas(pixel_frame, bg="white", 
                                      width=400, height=400)
         self.pixel_canvas.grid(row=0, column=0, sticky="nsew")
         
+        # Cached previews, checkerboard behind transparent images
+        self.original_preview = PreviewRenderer(self.original_canvas,
+                                                Image.Resampling.LANCZOS)
+        self.pixel_preview = PreviewRenderer(self.pixel_canvas, Image.Resampling.NEAREST)
+        
         # Drag and drop area
         self.drop_label = ttk.Label(original_frame,
                                     text="Drag an image here\nor click to browse",
@@ -205,18 +331,6 @@ class PixelArtConverter:
         pixel_frame.columnconfigure(0, weight=1)
         pixel_frame.rowconfigure(0, weight=1)
         
-    def create_checkered_background(self, canvas, width, height, square_size=10):
-        """Create a checkered background to show transparency"""
-        canvas.delete("checkerboard")
-        for x in range(0, width, square_size):
-            for y in range(0, height, square_size):
-                if (x // square_size + y // square_size) % 2:
-                    color = "#E0E0E0"
-                else:
-                    color = "#F0F0F0"
-                canvas.create_rectangle(x, y, x + square_size, y + square_size,
-                                      fill=color, outline="", tags="checkerboard")
-        
     def create_control_panel(self, parent):
         control_frame = ttk.LabelFrame(parent, text="Controls", padding="10")
         control_frame.grid(row=1, column=2, sticky="nsew", padx=(10, 0))
@@ -247,9 +361,18 @@ class PixelArtConverter:
         ttk.Label(control_frame, text="Download:").grid(row=4, column=0, 
                                                         sticky="w", pady=(10, 2))
         
-        download_btn = ttk.Button(control_frame, text="Download Pixel Art", 
+        download_frame = ttk.Frame(control_frame)
+        download_frame.grid(row=5, column=0, sticky="ew", pady=2)
+        download_btn = ttk.Button(download_frame, text="Download Pixel Art", 
                                  command=self.download_pixel_art)
-        download_btn.grid(row=5, column=0, sticky="ew", pady=2)
+        download_btn.grid(row=0, column=0, sticky="ew")
+        indexed_btn = ttk.Button(download_frame, text="Export Indexed...",
+                                 command=self.export_indexed)
+        indexed_btn.grid(row=0, column=1, sticky="ew", padx=(5, 0))
+        presets_btn = ttk.Button(download_frame, text="Export All Presets...",
+                                 command=self.export_presets)
+        presets_btn.grid(row=1, column=0, columnspan=2, sticky="ew", pady=(2, 0))
+        download_frame.columnconfigure(0, weight=1)
         
         palette_btn = ttk.Button(control_frame, text="Download Palette", 
                                 command=self.download_palette)
@@ -262,6 +385,17 @@ class PixelArtConverter:
         self.palette_frame = ttk.Frame(control_frame)
         self.palette_frame.grid(row=8, column=0, sticky="ew", pady=5)
         
+        # Fixed palette: keep the current one or load one from a file
+        lock_frame = ttk.Frame(control_frame)
+        lock_frame.grid(row=9, column=0, sticky="ew", pady=2)
+        lock_check = ttk.Checkbutton(lock_frame, text="Lock palette",
+                                     variable=self.lock_palette,
+                                     command=self.on_lock_palette)
+        lock_check.grid(row=0, column=0, sticky="w")
+        load_palette_btn = ttk.Button(lock_frame, text="Load Palette...",
+                                      command=self.load_palette_file)
+        load_palette_btn.grid(row=0, column=1, padx=(10, 0))
+        
         # Instructions
         instructions = """
         Instructions:
@@ -280,7 +414,7 @@ class PixelArtConverter:
         
         instruction_label = ttk.Label(control_frame, text=instructions, 
                                      justify="left", font=("Arial", 9))
-        instruction_label.grid(row=9, column=0, sticky="ew", pady=(20, 0))
+        instruction_label.grid(row=10, column=0, sticky="ew", pady=(20, 0))
         
         control_frame.columnconfigure(0, weight=1)
         
@@ -304,115 +438,158 @@ class PixelArtConverter:
             self.load_image(file_path)
             
     def load_from_url(self):
-        """Load image from URL"""
+        """Load image from URL in the background"""
         url = self.url_entry.get().strip()
         if not url:
             messagebox.showwarning("Warning", "Please enter a URL")
             return
             
-        try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            self.load_image(BytesIO(response.content))
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to load image from URL:\n{str(e)}")
+        settings = self.read_settings("Failed to load image from URL")
+        if settings is None:
+            return
+        downloaded = {}
+        
+        def work(token, progress):
+            progress(0.0, "Downloading image")
+            
+            def on_chunk(received, total):
+                # Raises TaskCancelled, which aborts the download
+                fraction = 0.2 * received / total if total else 0.0
+                progress(fraction, f"Downloading image ({received / 2**20:.1f} MB)")
+                
+            try:
+                with span('download'):
+                    body = get_fetcher().fetch(url, progress=on_chunk)
+            except FetchError as e:
+                raise URLLoadError(str(e)) from e
+            downloaded['body'] = body
+            return self.decode_to_canvas(BytesIO(body), settings, progress)
+            
+        tracer = Tracer()
+        self.start_task("load", self.run_traced(tracer, work),
+                        lambda result: self.on_image_loaded(result, tracer,
+                                                            downloaded.get('body')),
+                        self.show_load_error, "Downloading image...", supersedes=("convert",))
             
+    def get_quantizer_name(self):
+        """Registry name of the quantizer picked in the settings panel"""
+        label = self.quantizer.get()
+        for name, (quantizer_label, _) in QUANTIZERS.items():
+            if quantizer_label == label:
+                return name
+        return 'kmeans'
+        
+    def get_dither_name(self):
+        """Registry name of the dither mode picked in the settings panel"""
+        label = self.dither.get()
+        for name, (dither_label, _) in DITHERERS.items():
+            if dither_label == label:
+                return name
+        return 'none'
+        
+    def get_downsample_name(self):
+        """Registry name of the downsample mode picked in the settings panel"""
+        label = self.downsample_mode.get()
+        for name, (downsample_label, _) in DOWNSAMPLERS.items():
+            if downsample_label == label:
+                return name
+        return 'nearest'
+        
+    def get_settings(self):
+        """Snapshot the settings panel into a ConversionSettings"""
+        return ConversionSettings(
+            pixel_size=self.pixel_size.get(),
+            color_count=self.color_count.get(),
+            brightness=self.brightness.get(),
+            contrast=self.contrast.get(),
+            canvas_width=self.canvas_width.get(),
+            canvas_height=self.canvas_height.get(),
+            proportional_resize=self.proportional_resize.get(),
+            transparent_background=self.transparent_background.get(),
+            quantizer=self.get_quantizer_name(),
+            dither=self.get_dither_name(),
+            downsample_mode=self.get_downsample_name(),
+        )
+        
+    def read_settings(self, failure, quiet=False):
+        """get_settings for a user action, or None (after an error dialog
+        unless quiet) when a spinbox or slider holds a half-typed value"""
+        try:
+            return self.get_settings()
+        except tk.TclError as e:
+            if not quiet:
+                messagebox.showerror("Error", f"{failure}:\n{str(e)}")
+            return None
+        
     def resize_image_to_canvas(self, image):
         """Resize image to fit canvas size with optional proportional scaling"""
-        canvas_w = self.canvas_width.get()
-        canvas_h = self.canvas_height.get()
-        
-        if self.proportional_resize.get():
-            # Proportional resize - fit image within canvas bounds
-            image.thumbnail((canvas_w, canvas_h), Image.Resampling.LANCZOS)
-            
-            # Create new image with canvas size and transparent/white background
-            if self.transparent_background.get():
-                new_image = Image.new('RGBA', (canvas_w, canvas_h), (0, 0, 0, 0))
-                # Center the resized image
-                x = (canvas_w - image.width) // 2
-                y = (canvas_h - image.height) // 2
-                if image.mode != 'RGBA':
-                    image = image.convert('RGBA')
-                new_image.paste(image, (x, y), image)
-            else:
-                new_image = Image.new('RGB', (canvas_w, canvas_h), (255, 255, 255))
-                # Center the resized image
-                x = (canvas_w - image.width) // 2
-                y = (canvas_h - image.height) // 2
-                if image.mode == 'RGBA':
-                    new_image.paste(image, (x, y), image)
-                else:
-                    new_image.paste(image, (x, y))
-            
-            return new_image
-        else:
-            # Non-proportional resize - stretch to exact canvas size
-            if self.transparent_background.get() and image.mode != 'RGBA':
-                image = image.convert('RGBA')
-            elif not self.transparent_background.get() and image.mode != 'RGB':
-                image = image.convert('RGB')
-                
-            return image.resize((canvas_w, canvas_h), Image.Resampling.LANCZOS)
+        return PixelArtPipeline(self.get_settings()).resize_to_canvas(image)
             
+    def decode_to_canvas(self, source, settings, progress):
+        """Decode source and resize it to the canvas; runs on a worker thread"""
+        progress(0.2, "Decoding image")
+        return load_to_canvas(source, settings, cache=self.disk_cache)
+        
     def load_image(self, source):
-        """Load image from file path or BytesIO object"""
-        try:
-            if isinstance(source, BytesIO):
-                img = Image.open(source)
-            else:
-                # Check if it's a WebP file and try alternative loading
-                if isinstance(source, str) and source.lower().endswith('.webp'):
-                    try:
-                        img = Image.open(source)
-                    except Exception as webp_error:
-                        # Try using webp library as fallback
-                        try:
-                            import webp
-                            # Convert WebP to PIL Image using webp library
-                            webp_data = webp.load_image(source)
-                            img = Image.fromarray(webp_data)
-                        except ImportError:
-                            raise Exception("WebP support not available. Try: pip install --upgrade Pillow")
-                        except Exception as fallback_error:
-                            raise Exception(f"WebP loading failed. Original error: {webp_error}")
-                else:
-                    img = Image.open(source)
-                    
-            # Resize image to canvas size
-            self.original_image = self.resize_image_to_canvas(img)
-                
-            self.display_original_image()
+        """Load image from file path or BytesIO object in the background"""
+        settings = self.read_settings("Failed to load image")
+        if settings is None:
+            return
+        
+        def work(token, progress):
+            return self.decode_to_canvas(source, settings, progress)
             
-            # Show format info
-            img_format = getattr(img, 'format', 'Unknown')
-            original_size = img.size
-            new_size = self.original_image.size
-            messagebox.showinfo("Success", 
-                f"Image loaded and resized!\n"
-                f"Format: {img_format}\n"
-                f"Original: {original_size[0]} × {original_size[1]}\n"
-                f"Canvas: {new_size[0]} × {new_size[1]}")
+        tracer = Tracer()
+        self.start_task("load", self.run_traced(tracer, work),
+                        lambda result: self.on_image_loaded(result, tracer, source),
+                        self.show_load_error, "Loading image...", supersedes=("convert",))
+        
+    def on_image_loaded(self, result, tracer=None, source=None):
+        """Show a freshly decoded image (Tk thread)"""
+        canvas_image, decoded, report = result
+        self.original_image = canvas_image
+        self.image_source = source
+        with tracing(tracer):
+            self.display_original_image()
+        # No decoded image means the canvas came from the disk cache
+        cached = " (from disk cache)" if decoded is None else ""
+        self.report_timings(tracer, f"Image loaded{cached}: {report.summary()}")
+        self.schedule_sweep()
+        
+        # Show format info
+        original_size = report.source_size
+        new_size = self.original_image.size
+        messagebox.showinfo("Success", 
+            f"Image loaded and resized!\n"
+            f"Format: {report.format}\n"
+            f"Original: {original_size[0]} × {original_size[1]}\n"
+            f"Canvas: {new_size[0]} × {new_size[1]}\n"
+            f"Decode: {report.decode_seconds * 1000:.0f} ms, "
+            f"decoded buffer {report.buffer_bytes / 2**20:.1f} MB")
             
-        except Exception as e:
-            error_msg = str(e)
-            if "cannot identify image file" in error_msg.lower():
-                messagebox.showerror("Error", 
-                    f"Unsupported image format or corrupted file.\n\n"
-                    f"Supported formats: JPEG, PNG, GIF, BMP, TIFF, WebP\n"
-                    f"For WebP support, try:\n"
-                    f"pip install --upgrade Pillow\n\n"
-                    f"Error: {error_msg}")
-            elif "webp" in error_msg.lower():
-                messagebox.showerror("WebP Error", 
-                    f"WebP support issue.\n\n"
-                    f"Solutions:\n"
-                    f"1. pip install --upgrade Pillow\n"
-                    f"2. Convert WebP to PNG online first\n"
-                    f"3. Install system WebP libraries\n\n"
-                    f"Error: {error_msg}")
-            else:
-                messagebox.showerror("Error", f"Failed to load image:\n{error_msg}")
+    def show_load_error(self, e):
+        """Report a failed image load (Tk thread)"""
+        self.set_status("Load failed")
+        error_msg = str(e)
+        if isinstance(e, URLLoadError):
+            messagebox.showerror("Error", f"Failed to load image from URL:\n{error_msg}")
+        elif "cannot identify image file" in error_msg.lower():
+            messagebox.showerror("Error", 
+                f"Unsupported image format or corrupted file.\n\n"
+                f"Supported formats: JPEG, PNG, GIF, BMP, TIFF, WebP\n"
+                f"For WebP support, try:\n"
+                f"pip install --upgrade Pillow\n\n"
+                f"Error: {error_msg}")
+        elif "webp" in error_msg.lower():
+            messagebox.showerror("WebP Error", 
+                f"WebP support issue.\n\n"
+                f"Solutions:\n"
+                f"1. pip install --upgrade Pillow\n"
+                f"2. Convert WebP to PNG online first\n"
+                f"3. Install system WebP libraries\n\n"
+                f"Error: {error_msg}")
+        else:
+            messagebox.showerror("Error", f"Failed to load image:\n{error_msg}")
             
     def display_original_image(self):
         """Display the original image on canvas"""
@@ -421,156 +598,223 @@ class PixelArtConverter:
             
         # Hide the click to browse label
         self.drop_label.place_forget()
-            
-        # Resize image to fit canvas while maintaining aspect ratio
-        canvas_width = self.original_canvas.winfo_width()
-        canvas_height = self.original_canvas.winfo_height()
+        self.original_preview.show(self.original_image)
         
-        if canvas_width <= 1 or canvas_height <= 1:
-            # Canvas not yet rendered, use default size
-            canvas_width, canvas_height = 400, 400
-            
-        # Create checkered background if image has transparency
-        if self.original_image.mode == 'RGBA':
-            self.create_checkered_background(self.original_canvas, canvas_width, canvas_height)
+    def convert_to_pixel_art(self, live=False):
+        """Convert the loaded image to pixel art in the background"""
+        if not self.original_image:
+            if not live:
+                messagebox.showwarning("Warning", "Please load an image first")
+            return
             
-        img_copy = self.original_image.copy()
-        img_copy.thumbnail((canvas_width, canvas_height), Image.Resampling.LANCZOS)
+        settings = self.read_settings("Failed to convert image", quiet=live)
+        if settings is None:
+            return
         
-        # Convert to PhotoImage and display
-        self.original_photo = ImageTk.PhotoImage(img_copy)
-        self.original_canvas.delete("image")
+        # Re-converting the same image: warm-start the fit from the last palette
+        init_palette = None
+        if self.pixel_art_source is self.original_image and len(self.palette_colors):
+            init_palette = self.palette_colors
+            
+        pipeline = PixelArtPipeline(settings, cache=self.stage_cache,
+                                    palette=self.get_fixed_palette(),
+                                    init_palette=init_palette)
+        image = self.original_image
         
-        x = (canvas_width - img_copy.width) // 2
-        y = (canvas_height - img_copy.height) // 2
-        self.original_canvas.create_image(x, y, anchor="nw", image=self.original_photo, tags="image")
+        def work(token, progress):
+            return pipeline.convert(image, progress)
+            
+        def on_error(e):
+            self.set_status("Conversion failed")
+            if not live:
+                messagebox.showerror("Error", f"Failed to convert image:\n{str(e)}")
+                
+        tracer = Tracer()
+        self.start_task("convert", self.run_traced(tracer, work),
+                        lambda result: self.on_converted(result, settings, tracer=tracer),
+                        on_error, "Refining preview..." if live else "Converting...")
+        
+    def on_converted(self, result, settings, draft=False, tracer=None):
+        """Show a finished conversion (Tk thread)"""
+        self.pixel_art_image = result.image
+        self.pixel_art_native = result.native
+        self.pixel_art_key = result.cache_key
+        self.palette_colors = result.palette
+        self.pixel_art_settings = settings
+        self.pixel_art_source = self.original_image
+        
+        with tracing(tracer):
+            self.display_pixel_art()
+            with span('palette_swatches'):
+                self.display_palette()
+        if not draft:
+            self.report_timings(tracer, "Pixel art conversion complete!")
+        elif self.show_timings.get():
+            self.report_timings(tracer, "Preview")
+            
+    def on_setting_changed(self, *args):
+        """Slider moved: draw a quick draft now and refine once it settles"""
+        self.schedule_sweep()
+        if not self.live_preview.get() or not self.original_image:
+            return
+            
+        if self.refine_job is not None:
+            self.root.after_cancel(self.refine_job)
+        self.refine_job = self.root.after(LIVE_REFINE_DELAY_MS, self.refine_preview)
         
-    def convert_to_pixel_art(self):
-        """Convert the loaded image to pixel art"""
+        # Coalesce slider events to at most one draft per frame
+        if self.draft_job is None:
+            self.draft_job = self.root.after(LIVE_FRAME_MS, self.render_draft)
+            
+    def render_draft(self):
+        """Cheap approximate conversion for live preview"""
+        self.draft_job = None
         if not self.original_image:
-            messagebox.showwarning("Warning", "Please load an image first")
             return
             
         try:
-            # Work with the image
-            img = self.original_image.copy()
-            has_transparency = img.mode == 'RGBA'
-            
-            if has_transparency:
-                # Handle transparency
-                img_array = np.array(img)
-                rgb_array = img_array[:,:,:3]
-                alpha_array = img_array[:,:,3]
-                
-                # Apply brightness and contrast to RGB channels only
-                rgb_array = rgb_array.astype(np.float32)
-                rgb_array *= self.brightness.get()
-                rgb_array = (rgb_array - 128) * self.contrast.get() + 128
-                rgb_array = np.clip(rgb_array, 0, 255)
-                
-                # Combine back with alpha
-                img_array = np.dstack([rgb_array.astype(np.uint8), alpha_array])
-                img = Image.fromarray(img_array, 'RGBA')
-            else:
-                # Handle RGB images
-                img_array = np.array(img, dtype=np.float32)
-                img_array *= self.brightness.get()
-                img_array = (img_array - 128) * self.contrast.get() + 128
-                img_array = np.clip(img_array, 0, 255)
-                img = Image.fromarray(img_array.astype(np.uint8))
-            
-            # Resize image to create pixel effect
-            pixel_size = self.pixel_size.get()
-            small_img = img.resize(
-                (img.width // pixel_size, img.height // pixel_size),
-                Image.Resampling.NEAREST
-            )
+            settings = self.get_settings()
+        except tk.TclError:
+            # A spinbox or slider holds a half-typed value
+            return
+        pipeline = PixelArtPipeline(settings, cache=self.stage_cache,
+                                    palette=self.get_fixed_palette())
+        image = self.original_image
+        
+        # If only the pixel size, pixelation or dithering changed, the current
+        # palette is still right
+        palette = None
+        previous = self.pixel_art_settings
+        if previous is not None and replace(previous, pixel_size=settings.pixel_size,
+                                            downsample_mode=settings.downsample_mode,
+                                            dither=settings.dither) == settings:
+            palette = self.palette_colors
             
-            # Reduce colors using K-means clustering
-            if has_transparency:
-                # For RGBA images, only cluster non-transparent pixels
-                img_array = np.array(small_img)
-                mask = img_array[:,:,3] > 0  # Non-transparent pixels
-                
-                if np.any(mask):
-                    rgb_data = img_array[mask][:,:3]  # Get RGB values of non-transparent pixels
-                    
-                    kmeans = KMeans(n_clusters=min(self.color_count.get(), len(rgb_data)), 
-                                  random_state=42, n_init=10)
-                    kmeans.fit(rgb_data)
-                    
-                    # Replace colors with cluster centers
-                    new_colors = kmeans.cluster_centers_.astype(int)
-                    labels = kmeans.labels_
-                    new_rgb_data = new_colors[labels]
-                    
-                    # Apply new colors to non-transparent pixels
-                    new_img_array = img_array.copy()
-                    new_img_array[mask] = np.column_stack([new_rgb_data, img_array[mask][:,3]])
-                    
-                    self.pixel_art_image = Image.fromarray(new_img_array.astype(np.uint8), 'RGBA')
-                    self.palette_colors = new_colors
-                else:
-                    # All pixels are transparent
-                    self.pixel_art_image = small_img
-                    self.palette_colors = []
-            else:
-                # For RGB images, process normally
-                img_array = np.array(small_img)
-                img_data = img_array.reshape(-1, 3)
-                
-                kmeans = KMeans(n_clusters=self.color_count.get(), random_state=42, n_init=10)
-                kmeans.fit(img_data)
-                
-                new_colors = kmeans.cluster_centers_.astype(int)
-                labels = kmeans.labels_
-                
-                new_img_data = new_colors[labels]
-                new_img_array = new_img_data.reshape(img_array.shape)
-                
-                self.pixel_art_image = Image.fromarray(new_img_array.astype(np.uint8))
-                self.palette_colors = new_colors
+        def work(token, progress):
+            return pipeline.draft(image, palette)
             
-            # Scale back up to canvas size
-            self.pixel_art_image = self.pixel_art_image.resize(
-                (self.canvas_width.get(), self.canvas_height.get()), 
-                Image.Resampling.NEAREST
-            )
+        tracer = Tracer()
+        self.start_task("convert", self.run_traced(tracer, work),
+                        lambda result: self.on_converted(result, settings, draft=True,
+                                                         tracer=tracer),
+                        lambda e: self.set_status("Preview failed"), "Previewing...")
+        
+    def refine_preview(self):
+        """Full-quality conversion once the sliders have been idle"""
+        self.refine_job = None
+        if self.draft_job is not None:
+            self.root.after_cancel(self.draft_job)
+            self.draft_job = None
+        try:
+            self.convert_to_pixel_art(live=True)
+        except tk.TclError:
+            # A spinbox or slider holds a half-typed value
+            pass
+        
+    def schedule_sweep(self, *args):
+        """Settings changed: stop the palette sweep and restart it once they settle"""
+        self.tasks.cancel("sweep")
+        if self.sweep_job is not None:
+            self.root.after_cancel(self.sweep_job)
+        self.sweep_job = self.root.after(SWEEP_DELAY_MS, self.start_sweep)
+        
+    def start_sweep(self):
+        """Fit the palette at every slider colour count, nearest first.
+        
+        Counts that are already cached are skipped, so restarting after the
+        colour count or dithering changed costs next to nothing.
+        """
+        self.sweep_job = None
+        if not self.palette_sweep.get() or not self.original_image \
+                or self.get_fixed_palette() is not None:
+            return
+        try:
+            settings = self.get_settings()
+        except tk.TclError:
+            # A spinbox or slider holds a half-typed value
+            return
+        pipeline = PixelArtPipeline(settings, cache=self.stage_cache)
+        image = self.original_image
+        
+        def work(token, progress):
+            return sweep_palettes(pipeline, image, SWEEP_COUNTS, progress)
             
-            self.display_pixel_art()
-            self.display_palette()
+        def on_done(fitted):
+            if fitted and not self.tasks.busy(ignore=("sweep",)):
+                self.set_status(f"Palettes ready for {len(SWEEP_COUNTS)} colour counts")
+                
+        # No progress callback: the sweep runs quietly behind other tasks
+        self.tasks.submit("sweep", work, on_done,
+                          lambda e: self.set_status(f"Palette sweep failed: {e}"))
+        
+    def start_task(self, channel, work, on_done, on_error, status, supersedes=()):
+        """Run work in the background, driving the progress bar and Cancel button"""
+        def finish(callback):
+            def wrapped(value):
+                self.update_task_widgets()
+                callback(value)
+            return wrapped
+            
+        self.tasks.submit(channel, work, finish(on_done), finish(on_error),
+                          self.on_task_progress, supersedes=supersedes)
+        self.progress_value.set(0.0)
+        self.set_status(status)
+        self.update_task_widgets()
+        
+    @staticmethod
+    def run_traced(tracer, work):
+        """Wrap task work so the spans it records go to tracer"""
+        def traced_work(token, progress):
+            with tracing(tracer):
+                return work(token, progress)
+        return traced_work
+        
+    def report_timings(self, tracer, status):
+        """Show status, with per-stage timings when enabled, and log the trace"""
+        if tracer is None:
+            self.set_status(status)
+            return
+        if self.trace_path:
+            try:
+                tracer.export_jsonl(self.trace_path, append=True)
+            except OSError:
+                pass
+        if self.show_timings.get() and tracer.events:
+            self.set_status(f"{status} ({tracer.summary()})")
+        else:
+            self.set_status(status)
             
-            messagebox.showinfo("Success", "Pixel art conversion complete!")
+    def on_task_progress(self, fraction, message):
+        self.progress_value.set(fraction)
+        if message:
+            self.set_status(message)
             
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to convert image:\n{str(e)}")
+    def update_task_widgets(self):
+        """Enable Cancel only while something runs (besides the palette sweep)"""
+        busy = self.tasks.busy(ignore=("sweep",))
+        self.cancel_btn.config(state="normal" if busy else "disabled")
+        if not busy:
+            self.progress_value.set(0.0)
             
+    def cancel_tasks(self):
+        """Cancel any load or conversion in flight"""
+        self.tasks.cancel()
+        self.update_task_widgets()
+        self.set_status("Cancelled")
+        
+    def set_status(self, text):
+        self.status_label.config(text=text)
+        
+    def on_close(self):
+        self.tasks.shutdown()
+        self.root.destroy()
+        
     def display_pixel_art(self):
         """Display the pixel art on canvas"""
         if not self.pixel_art_image:
             return
             
-        # Resize image to fit canvas
-        canvas_width = self.pixel_canvas.winfo_width()
-        canvas_height = self.pixel_canvas.winfo_height()
-        
-        if canvas_width <= 1 or canvas_height <= 1:
-            canvas_width, canvas_height = 400, 400
-            
-        # Create checkered background if image has transparency
-        if self.pixel_art_image.mode == 'RGBA':
-            self.create_checkered_background(self.pixel_canvas, canvas_width, canvas_height)
-        
-        img_copy = self.pixel_art_image.copy()
-        img_copy.thumbnail((canvas_width, canvas_height), Image.Resampling.NEAREST)
-        
-        # Convert to PhotoImage and display
-        self.pixel_photo = ImageTk.PhotoImage(img_copy)
-        self.pixel_canvas.delete("image")
-        
-        x = (canvas_width - img_copy.width) // 2
-        y = (canvas_height - img_copy.height) // 2
-        self.pixel_canvas.create_image(x, y, anchor="nw", image=self.pixel_photo, tags="image")
+        self.pixel_preview.show(self.pixel_art_image)
         
     def display_palette(self):
         """Display the color palette"""
@@ -650,6 +894,84 @@ class PixelArtConverter:
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to save image:\n{str(e)}")
                 
+    def export_indexed(self):
+        """Save the pixel art as an indexed PNG/GIF at its native resolution"""
+        if self.pixel_art_native is None:
+            messagebox.showwarning("Warning", "No pixel art to export")
+            return
+            
+        file_path = filedialog.asksaveasfilename(
+            title="Export Indexed Pixel Art",
+            defaultextension=".png",
+            filetypes=[
+                ("Indexed PNG", "*.png"),
+                ("GIF files", "*.gif")
+            ]
+        )
+        if not file_path:
+            return
+            
+        scale = simpledialog.askinteger(
+            "Scale", "Enlarge each pixel by (1 = one image pixel per art pixel):",
+            parent=self.root, initialvalue=1, minvalue=1,
+            maxvalue=self.pixel_art_settings.pixel_size * 8)
+        if scale is None:
+            return
+            
+        try:
+            with span('save_indexed'):
+                save_indexed(self.pixel_art_native, self.palette_colors, file_path,
+                             scale=scale, compress_level=DEFAULT_COMPRESS_LEVEL)
+            size_kb = os.path.getsize(file_path) / 1024
+            messagebox.showinfo("Success", f"Indexed pixel art saved to:\n{file_path}\n"
+                                           f"({size_kb:.1f} KB)")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to export image:\n{str(e)}")
+            
+    def export_presets(self):
+        """Save the image at every canvas preset, decoded once with one shared palette"""
+        if self.image_source is None:
+            messagebox.showwarning("Warning", "Please load an image first")
+            return
+            
+        file_path = filedialog.asksaveasfilename(
+            title="Export All Presets (a size suffix is added to the name)",
+            defaultextension=".png",
+            filetypes=[("PNG files", "*.png")]
+        )
+        if not file_path:
+            return
+            
+        settings = self.read_settings("Failed to export presets")
+        if settings is None:
+            return
+        targets = preset_targets([settings.pixel_size])
+        source = self.image_source
+        palette = self.get_fixed_palette()
+        
+        def work(token, progress):
+            results = render_presets(BytesIO(source) if isinstance(source, bytes) else source,
+                                     settings, targets, palette=palette, progress=progress)
+            paths = []
+            for target, result in results:
+                path = target_path(file_path, target)
+                with span('save'):
+                    result.image.save(path)
+                paths.append(path)
+            return paths
+            
+        def on_done(paths):
+            self.report_timings(tracer, f"Exported {len(paths)} presets")
+            messagebox.showinfo("Success", "Pixel art saved to:\n" + "\n".join(paths))
+            
+        def on_error(e):
+            self.set_status("Export failed")
+            messagebox.showerror("Error", f"Failed to export presets:\n{str(e)}")
+            
+        tracer = Tracer()
+        self.start_task("export", self.run_traced(tracer, work), on_done, on_error,
+                        "Exporting presets...")
+        
     def download_palette(self):
         """Download the color palette as an image"""
         if len(self.palette_colors) == 0:
@@ -693,39 +1015,116 @@ class PixelArtConverter:
             
             if file_path:
                 palette_img.save(file_path)
-                messagebox.showinfo("Success", f"Palette saved to:\n{file_path}")
+                # The palette itself, for GIMP/Aseprite (.gpl), Photoshop (.act)
+                # and Lospec-style hex lists
+                written = save_palette_files(file_path, self.palette_colors)
+                names = ", ".join(os.path.basename(path) for path in written)
+                messagebox.showinfo("Success", f"Palette saved to:\n{file_path}\n"
+                                               f"with {names}")
                 
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save palette:\n{str(e)}")
             
+    def get_fixed_palette(self):
+        """Palette to apply instead of fitting one, if the palette is locked"""
+        if self.lock_palette.get():
+            return self.locked_palette
+        return None
+        
+    def on_lock_palette(self):
+        """Lock palette toggled: capture the current palette or release it"""
+        if not self.lock_palette.get():
+            self.locked_palette = None
+        elif len(self.palette_colors) == 0:
+            self.lock_palette.set(False)
+            messagebox.showwarning("Warning", "Convert an image or load a palette first")
+        else:
+            self.locked_palette = np.array(self.palette_colors, dtype=int)
+        self.schedule_sweep()
+            
+    def load_palette_file(self):
+        """Load a palette file and lock conversions to it"""
+        file_path = filedialog.askopenfilename(
+            title="Load Palette",
+            filetypes=[
+                ("Palette files", "*.json *.gpl *.act *.hex *.txt"),
+                ("All files", "*.*")
+            ]
+        )
+        if not file_path:
+            return
+            
+        try:
+            self.locked_palette = load_palette(file_path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load palette:\n{str(e)}")
+            return
+        self.lock_palette.set(True)
+        self.schedule_sweep()
+        self.palette_colors = self.locked_palette
+        self.display_palette()
+        self.set_status(f"Palette locked to {len(self.locked_palette)} colours")
+        
     def reset_settings(self):
         """Reset all settings to default values"""
         self.pixel_size.set(8)
         self.color_count.set(16)
         self.brightness.set(1.0)
         self.contrast.set(1.0)
+        self.quantizer.set(QUANTIZERS['kmeans'][0])
+        self.dither.set(DITHERERS['none'][0])
+        self.downsample_mode.set(DOWNSAMPLERS['nearest'][0])
         self.canvas_width.set(96)
         self.canvas_height.set(96)
         self.proportional_resize.set(True)
         self.transparent_background.set(False)
 
+def prewarm_imports(modules=PREWARM_MODULES):
+    """Import heavy modules on a background thread so first use is instant"""
+    def run():
+        for name in modules:
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                pass
+    threading.Thread(target=run, name="pixlgen-prewarm", daemon=True).start()
+    
+    
+def missing_packages():
+    """pip names of required packages that aren't installed, without importing them"""
+    return [pip_name for module, pip_name in REQUIRED_PACKAGES
+            if importlib.util.find_spec(module) is None]
+    
+    
 def main():
+    # Command line sub-commands run headless
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        import batch
+        return batch.main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "palette":
+        import shared_palette
+        return shared_palette.main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        import server
+        return server.main(sys.argv[2:])
+        
     # Check for required packages
-    try:
-        import tkinterdnd2
-        import PIL
-        import numpy
-        import sklearn
-        import requests
-    except ImportError as e:
-        print(f"Missing required package: {e}")
+    missing = missing_packages()
+    if missing:
+        print(f"Missing required package: {', '.join(missing)}")
         print("Please install required packages:")
         print("pip install tkinterdnd2 Pillow numpy scikit-learn requests")
         return
         
+    import tkinterdnd2 as tkdnd
     root = tkdnd.Tk()
     app = PixelArtConverter(root)
+    # KMeans and requests aren't needed until the first Convert or URL load
+    root.after(PREWARM_DELAY_MS, prewarm_imports)
+    if os.environ.get(STARTUP_BENCH_ENV_VAR):
+        # Startup benchmark: quit as soon as the window has been drawn
+        root.after_idle(root.destroy)
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
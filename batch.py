@@ -0,0 +1,630 @@
+"""Batch conversion of whole directories, globs and CSV manifests.
+
+Usage:
+    python PixLGEN.py batch INPUT [INPUT ...] -o OUTPUT_DIR [settings]
+
+Each INPUT may be a directory, a glob pattern, an http(s) URL or a .csv
+manifest. A manifest needs an ``input`` column (a path or URL) and may have an ``output`` column plus any
+ConversionSettings field (pixel_size, color_count, ...) to override the
+command line settings for that row.
+
+Jobs run on a process pool with a bounded number of in-flight jobs.
+Finished jobs are appended to a journal in the output directory so an
+interrupted run picks up where it stopped, and failures are written to a
+per-file error report. URL inputs are downloaded concurrently into the
+output directory (through the shared HTTP cache) before they are converted.
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+
+import numpy as np
+
+from disk_cache import DEFAULT_DISK_CACHE_BYTES, get_disk_cache
+from dithering import DITHERERS, ORDERED_DITHERERS
+from downsampling import DOWNSAMPLERS
+from export import DEFAULT_COMPRESS_LEVEL, save_indexed
+from fetch import POOL_SIZE, get_fetcher, is_url, url_filename
+from palette_lut import load_palette, save_palette
+from loader import decode_target, load_to_canvas
+from pipeline import ConversionSettings, PixelArtPipeline, open_image
+from presets import parse_target, preset_targets, render_presets, target_path
+from profiling import Tracer, capture, span, tracing
+from quantizers import QUANTIZERS
+from tiled import TiledConverter
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif', '.webp')
+JOURNAL_NAME = '.pixlgen_batch.jsonl'
+ERROR_REPORT_NAME = 'batch_errors.csv'
+DOWNLOAD_DIR_NAME = '.pixlgen_downloads'
+
+# Environment variables read by the BLAS/OpenMP runtimes numpy and
+# scikit-learn link against
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                   'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+_thread_limiter = None
+
+
+def limit_worker_threads(threads):
+    """Cap BLAS/OpenMP threads in this process so workers don't oversubscribe"""
+    global _thread_limiter
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    # Keep a reference so the limits stay applied for the worker's lifetime
+    _thread_limiter = threadpool_limits(limits=threads)
+
+
+class BatchJob:
+    """One input file, its output path and the settings to convert it with"""
+
+    def __init__(self, input_path, output_path, settings):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.settings = settings
+        # Set when the input could not be fetched
+        self.error = None
+
+    def output_paths(self, targets=None):
+        """Files the job writes: output_path, or one per render target"""
+        if targets:
+            return [target_path(self.output_path, target) for target in targets]
+        return [self.output_path]
+
+    def key(self, palette=None, indexed=None, targets=None):
+        """Identity used by the resume journal; changes if the source or settings do"""
+        stat = os.stat(self.input_path)
+        extra = {'indexed': indexed} if indexed else {}
+        if targets:
+            extra['targets'] = [target.label for target in targets]
+        payload = json.dumps({
+            **extra,
+            'input': os.path.abspath(self.input_path),
+            'output': os.path.abspath(self.output_path),
+            'settings': self.settings.to_dict(),
+            'palette': palette,
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+        }, sort_keys=True)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _save_result(result, output_path, indexed):
+    with span('save'):
+        if indexed:
+            save_indexed(result.native, result.palette, output_path, **indexed)
+        else:
+            result.image.save(output_path)
+
+
+def _convert(input_path, output_path, settings, palette, memory_limit, indexed, targets=None,
+             disk_cache=None):
+    if targets:
+        for target, result in render_presets(input_path, settings, targets, palette):
+            _save_result(result, target_path(output_path, target), indexed)
+        return
+
+    if memory_limit:
+        img = open_image(input_path)
+        img.draft(None, decode_target(img.size, settings))
+        TiledConverter(settings, memory_limit, palette).convert(img, output_path)
+        return
+
+    cache = get_disk_cache(**disk_cache) if disk_cache is not None else None
+    canvas, _, _ = load_to_canvas(input_path, settings, cache=cache)
+    result = PixelArtPipeline(settings, palette=palette, cache=cache).convert(canvas)
+    _save_result(result, output_path, indexed)
+
+
+def convert_file(input_path, output_path, settings_dict, palette=None, memory_limit=None,
+                 profile_path=None, indexed=None, targets=None, disk_cache=None):
+    """Worker entry point: convert one file and write the result.
+
+    With a fixed palette (list of [r, g, b]) no palette is fitted; pixels
+    are mapped through the palette's cached lookup table. With a
+    memory_limit (bytes) the canvas is processed in bands and streamed to
+    disk instead of being built in memory. With profile_path the job runs
+    under cProfile and tracemalloc and its stats are written there. With
+    indexed (save_indexed keyword arguments: scale, compress_level) the
+    result is written as an indexed PNG/GIF at native resolution. With
+    targets (RenderTargets) the source is decoded once and rendered at
+    every target's canvas and pixel size with one shared palette, each
+    written next to output_path (see presets.py). With disk_cache
+    (get_disk_cache keyword arguments) loaded canvases and palette fits are
+    reused across runs and workers (see disk_cache.py).
+
+    Returns (seconds, spans, peak_bytes); peak_bytes is None unless profiled.
+    """
+    start = time.perf_counter()
+    settings = ConversionSettings.from_dict(settings_dict)
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    profiler = capture(memory=True) if profile_path else nullcontext()
+    with tracing(Tracer()) as tracer, profiler as captured:
+        _convert(input_path, output_path, settings, palette, memory_limit, indexed, targets,
+                 disk_cache)
+    peak_bytes = None
+    if profile_path:
+        captured.dump(profile_path)
+        peak_bytes = captured.peak_bytes
+    return time.perf_counter() - start, tracer.events, peak_bytes
+
+
+def _output_path(output_dir, input_path, root=None):
+    if root:
+        rel = os.path.relpath(input_path, root)
+    else:
+        rel = os.path.basename(input_path)
+    return os.path.join(output_dir, os.path.splitext(rel)[0] + '.png')
+
+
+def _source_name(input_path):
+    return url_filename(input_path) if is_url(input_path) else input_path
+
+
+def _is_image(path):
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def _coerce_setting(name, value):
+    field_type = ConversionSettings.__dataclass_fields__[name].type
+    if field_type in (bool, 'bool'):
+        return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+    if field_type in (int, 'int'):
+        return int(float(value))
+    if field_type in (float, 'float'):
+        return float(value)
+    return str(value).strip()
+
+
+def _manifest_jobs(manifest_path, output_dir, settings):
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            input_path = (row.get('input') or '').strip()
+            if not input_path:
+                continue
+            if not (os.path.isabs(input_path) or is_url(input_path)):
+                input_path = os.path.join(base_dir, input_path)
+            output_path = (row.get('output') or '').strip()
+            if output_path:
+                if not os.path.isabs(output_path):
+                    output_path = os.path.join(output_dir, output_path)
+            else:
+                output_path = _output_path(output_dir, _source_name(input_path))
+            overrides = {name: _coerce_setting(name, row[name])
+                         for name in ConversionSettings.__dataclass_fields__
+                         if (row.get(name) or '').strip()}
+            row_settings = ConversionSettings.from_dict({**settings.to_dict(), **overrides})
+            yield BatchJob(input_path, output_path, row_settings)
+
+
+def iter_jobs(inputs, output_dir, settings, recursive=False):
+    """Expand directories, globs and manifests into BatchJobs, lazily"""
+    for spec in inputs:
+        if is_url(spec):
+            yield BatchJob(spec, _output_path(output_dir, url_filename(spec)), settings)
+        elif os.path.isdir(spec):
+            if recursive:
+                for dirpath, dirnames, filenames in os.walk(spec):
+                    dirnames.sort()
+                    for name in sorted(filenames):
+                        path = os.path.join(dirpath, name)
+                        if _is_image(path):
+                            yield BatchJob(path, _output_path(output_dir, path, spec), settings)
+            else:
+                for name in sorted(os.listdir(spec)):
+                    path = os.path.join(spec, name)
+                    if os.path.isfile(path) and _is_image(path):
+                        yield BatchJob(path, _output_path(output_dir, path), settings)
+        elif spec.lower().endswith('.csv') and os.path.isfile(spec):
+            yield from _manifest_jobs(spec, output_dir, settings)
+        else:
+            matches = sorted(glob.glob(spec, recursive=recursive))
+            if not matches and os.path.isfile(spec):
+                matches = [spec]
+            for path in matches:
+                if os.path.isfile(path) and _is_image(path):
+                    yield BatchJob(path, _output_path(output_dir, path), settings)
+
+
+def _write_if_changed(path, body):
+    """Write body unless path already holds it, so its mtime (and journal key) stays put"""
+    if os.path.exists(path) and os.path.getsize(path) == len(body):
+        with open(path, 'rb') as f:
+            if f.read() == body:
+                return
+    with open(path, 'wb') as f:
+        f.write(body)
+
+
+def fetch_url_jobs(jobs, download_dir, workers=POOL_SIZE, fetcher=None):
+    """Pass local jobs straight through, then download URL jobs concurrently.
+
+    Downloaded jobs are yielded pointing at their local copy in
+    download_dir; failed downloads are yielded with job.error set.
+    """
+    remote = {}
+    for job in jobs:
+        if is_url(job.input_path):
+            remote.setdefault(job.input_path, []).append(job)
+        else:
+            yield job
+    if not remote:
+        return
+
+    fetcher = fetcher or get_fetcher()
+    os.makedirs(download_dir, exist_ok=True)
+    for url, body, error in fetcher.fetch_many(remote, workers=workers):
+        if error is None:
+            name = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12] + '_' + url_filename(url)
+            local_path = os.path.join(download_dir, name)
+            try:
+                _write_if_changed(local_path, body)
+            except OSError as e:
+                error = f"{type(e).__name__}: {e}"
+        for job in remote[url]:
+            if error is None:
+                job.input_path = local_path
+            else:
+                job.error = error
+            yield job
+
+
+def _load_journal(journal_path):
+    done = set()
+    if not os.path.exists(journal_path):
+        return done
+    with open(journal_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A partial last line from an interrupted run
+                continue
+            if entry.get('status') == 'ok':
+                done.add(entry['key'])
+    return done
+
+
+def run_batch(jobs, output_dir, workers=None, max_pending=None, threads_per_worker=1,
+              resume=True, progress=None, palette=None, memory_limit=None,
+              fetch_workers=POOL_SIZE, tracer=None, profile_dir=None, indexed=None,
+              targets=None, disk_cache=None):
+    """Run jobs on a process pool; returns a summary dict.
+
+    At most max_pending jobs are submitted at once so huge inputs never sit
+    in memory as futures. With resume, jobs recorded as done in the journal
+    (and whose output still exists) are skipped. A fixed palette is
+    applied to every job instead of fitting one per image. memory_limit
+    switches every job to tiled processing (see tiled.py); indexed (a dict
+    of scale and compress_level) writes indexed images instead (see
+    export.py). With targets (RenderTargets) every job is rendered at each
+    target's canvas and pixel size from one decode and one palette fit (see
+    presets.py). disk_cache (a dict of get_disk_cache arguments) lets the
+    regular pipeline reuse canvases and palette fits stored on disk by
+    earlier runs. URL inputs are downloaded on fetch_workers threads first.
+
+    Every job's timing spans are collected into tracer (a fresh Tracer by
+    default) and summed per stage in summary['stages']. With profile_dir,
+    each job writes a cProfile .prof file there and summary['peak_bytes']
+    holds the largest traced memory peak.
+    """
+    if palette is not None:
+        palette = np.asarray(palette, dtype=int).reshape(-1, 3).tolist()
+    if memory_limit and indexed:
+        raise ValueError("Tiled conversion writes RGB(A) PNGs; it can't be combined "
+                         "with indexed export")
+    if memory_limit and targets:
+        raise ValueError("Tiled conversion renders one canvas size; it can't be "
+                         "combined with render targets")
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+    os.makedirs(output_dir, exist_ok=True)
+
+    journal_path = os.path.join(output_dir, JOURNAL_NAME)
+    done = _load_journal(journal_path) if resume else set()
+
+    tracer = tracer if tracer is not None else Tracer()
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    summary = {'converted': 0, 'skipped': 0, 'failed': 0, 'errors': [], 'seconds': 0.0,
+               'stages': {}, 'peak_bytes': None}
+    start = time.perf_counter()
+
+    def record(journal, job, key, status, error=None, seconds=0.0):
+        entry = {'key': key, 'input': job.input_path, 'output': job.output_path,
+                 'status': status}
+        if error:
+            entry['error'] = error
+        journal.write(json.dumps(entry) + '\n')
+        journal.flush()
+        if status == 'ok':
+            summary['converted'] += 1
+        else:
+            summary['failed'] += 1
+            summary['errors'].append((job.input_path, error))
+        if progress:
+            progress(job, status, error, seconds)
+
+    with open(journal_path, 'a', encoding='utf-8') as journal, \
+            ProcessPoolExecutor(max_workers=workers, initializer=limit_worker_threads,
+                                initargs=(threads_per_worker,)) as executor:
+        pending = {}
+
+        def drain(return_when):
+            finished, _ = wait(pending, return_when=return_when)
+            for future in finished:
+                job, key = pending.pop(future)
+                try:
+                    seconds, spans, peak_bytes = future.result()
+                except Exception as e:
+                    record(journal, job, key, 'error', f"{type(e).__name__}: {e}")
+                else:
+                    tracer.extend(spans)
+                    if peak_bytes is not None:
+                        summary['peak_bytes'] = max(summary['peak_bytes'] or 0, peak_bytes)
+                    record(journal, job, key, 'ok', seconds=seconds)
+
+        download_dir = os.path.join(output_dir, DOWNLOAD_DIR_NAME)
+        for job in fetch_url_jobs(jobs, download_dir, workers=fetch_workers):
+            if job.error:
+                record(journal, job, None, 'error', job.error)
+                continue
+            try:
+                key = job.key(palette, indexed, targets)
+            except OSError as e:
+                record(journal, job, None, 'error', f"{type(e).__name__}: {e}")
+                continue
+            if key in done and all(map(os.path.exists, job.output_paths(targets))):
+                summary['skipped'] += 1
+                continue
+            profile_path = None
+            if profile_dir:
+                name = os.path.splitext(os.path.basename(job.output_path))[0]
+                profile_path = os.path.join(profile_dir, f"{name}_{key[:8]}.prof")
+            future = executor.submit(convert_file, job.input_path, job.output_path,
+                                     job.settings.to_dict(), palette, memory_limit,
+                                     profile_path, indexed, targets, disk_cache)
+            pending[future] = (job, key)
+            if len(pending) >= max_pending:
+                drain(FIRST_COMPLETED)
+        while pending:
+            drain(FIRST_COMPLETED)
+
+    summary['seconds'] = time.perf_counter() - start
+    summary['stages'] = tracer.totals()
+    report_path = os.path.join(output_dir, ERROR_REPORT_NAME)
+    if summary['errors']:
+        with open(report_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['input', 'error'])
+            writer.writerows(summary['errors'])
+    elif os.path.exists(report_path):
+        # Don't leave a stale report from an earlier run behind
+        os.remove(report_path)
+    return summary
+
+
+def _parse_canvas(value):
+    try:
+        w, h = value.lower().replace('×', 'x').split('x')
+        return int(w), int(h)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Canvas size must look like 96x96, got {value!r}")
+
+
+def add_input_arguments(parser):
+    """Positional inputs plus --recursive, shared by the batch-style commands"""
+    parser.add_argument('inputs', nargs='+',
+                        help="Directories, glob patterns or CSV manifests")
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help="Descend into subdirectories and allow ** in globs")
+
+
+def add_settings_arguments(parser):
+    """Conversion settings options mirroring the GUI settings panel"""
+    defaults = ConversionSettings()
+    settings = parser.add_argument_group('conversion settings')
+    settings.add_argument('--canvas', type=_parse_canvas,
+                          default=(defaults.canvas_width, defaults.canvas_height),
+                          help="Canvas size as WIDTHxHEIGHT (default: %(default)s)")
+    settings.add_argument('--pixel-size', type=int, default=defaults.pixel_size)
+    settings.add_argument('--colors', type=int, default=defaults.color_count)
+    settings.add_argument('--downsample', choices=list(DOWNSAMPLERS),
+                          default=defaults.downsample_mode,
+                          help="How each pixel_size block becomes one pixel: one sample "
+                               "or the block's mean, median or dominant colour "
+                               "(default: %(default)s)")
+    settings.add_argument('--brightness', type=float, default=defaults.brightness)
+    settings.add_argument('--contrast', type=float, default=defaults.contrast)
+    settings.add_argument('--quantizer', choices=sorted(QUANTIZERS), default=defaults.quantizer,
+                          help="Colour quantization engine (default: %(default)s)")
+    settings.add_argument('--fit-samples', type=int, default=defaults.fit_samples,
+                          help="Fit the palette to a sample of this many pixels when "
+                               "the image has more distinct colours than that, "
+                               "0 for no cap (default: %(default)s)")
+    settings.add_argument('--dither', choices=list(DITHERERS), default=defaults.dither,
+                          help="Dithering when mapping to the palette (default: %(default)s)")
+    settings.add_argument('--transparent', action='store_true',
+                          help="Keep a transparent background")
+    settings.add_argument('--no-proportional', action='store_true',
+                          help="Stretch to the canvas instead of fitting inside it")
+    return settings
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='pixlgen batch',
+        description="Convert many images to pixel art in parallel")
+    add_input_arguments(parser)
+    parser.add_argument('-o', '--output-dir', required=True,
+                        help="Directory to write the pixel art into")
+
+    settings = add_settings_arguments(parser)
+    palette = settings.add_mutually_exclusive_group()
+    palette.add_argument('--palette', metavar='FILE',
+                         help="Apply this palette (.json, .gpl, .act or hex list) "
+                              "instead of fitting one")
+    palette.add_argument('--shared-palette', action='store_true',
+                         help="Fit one palette across all inputs first, save it as "
+                              "palette.json in the output directory and apply it to every image")
+
+    pool = parser.add_argument_group('execution')
+    pool.add_argument('-j', '--workers', type=int, default=None,
+                      help="Worker processes (default: CPU count)")
+    pool.add_argument('--max-pending', type=int, default=None,
+                      help="Maximum jobs in flight (default: 2 x workers)")
+    pool.add_argument('--threads-per-worker', type=int, default=1,
+                      help="BLAS/OpenMP threads per worker (default: 1)")
+    pool.add_argument('--no-resume', action='store_true',
+                      help="Reconvert everything, ignoring the journal")
+    pool.add_argument('--fetch-workers', type=int, default=POOL_SIZE,
+                      help="Concurrent downloads for URL inputs (default: %(default)s)")
+    pool.add_argument('--tiled', action='store_true',
+                      help="Process each canvas in bands and stream it to disk, "
+                           "for canvases too large to hold in memory")
+    pool.add_argument('--memory-limit', type=int, default=256, metavar='MB',
+                      help="Memory ceiling per worker for --tiled (default: %(default)s MB)")
+    pool.add_argument('--no-disk-cache', action='store_true',
+                      help="Don't reuse or store canvases and palette fits in the on-disk "
+                           "cache (~/.cache/pixlgen/stages)")
+    pool.add_argument('--disk-cache-size', type=int,
+                      default=DEFAULT_DISK_CACHE_BYTES // 2**20, metavar='MB',
+                      help="Size limit of the on-disk cache (default: %(default)s MB)")
+    pool.add_argument('-q', '--quiet', action='store_true')
+
+    export = parser.add_argument_group('output')
+    export.add_argument('--indexed', action='store_true',
+                        help="Write indexed (palette-mode) images at native pixel resolution "
+                             "instead of upscaled RGB(A); .gif outputs in a manifest are "
+                             "written as GIF")
+    export.add_argument('--scale', type=int, default=1,
+                        help="Integer upscale for --indexed output (default: %(default)s)")
+    export.add_argument('--compress-level', type=int, default=DEFAULT_COMPRESS_LEVEL,
+                        choices=range(10), metavar='0-9',
+                        help="PNG compression level for --indexed (default: %(default)s)")
+    export.add_argument('--presets', nargs='*', metavar='WxH[:P]',
+                        help="Render every input at these canvas sizes (optionally with "
+                             "their own pixel size) from one decode and one palette fit, "
+                             "writing NAME_WxH_pxP.png; with no sizes, the GUI presets")
+
+    diagnostics = parser.add_argument_group('diagnostics')
+    diagnostics.add_argument('--trace', metavar='FILE',
+                             help="Write per-stage timing spans (.json: Chrome trace, "
+                                  "otherwise JSON lines)")
+    diagnostics.add_argument('--profile', metavar='DIR',
+                             help="Run each job under cProfile and tracemalloc, "
+                                  "writing .prof files into DIR")
+    return parser
+
+
+def settings_from_args(args):
+    return ConversionSettings(
+        pixel_size=args.pixel_size,
+        color_count=args.colors,
+        brightness=args.brightness,
+        contrast=args.contrast,
+        canvas_width=args.canvas[0],
+        canvas_height=args.canvas[1],
+        proportional_resize=not args.no_proportional,
+        transparent_background=args.transparent,
+        quantizer=args.quantizer,
+        fit_samples=args.fit_samples,
+        dither=args.dither,
+        downsample_mode=args.downsample,
+    )
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.indexed and args.tiled:
+        parser.error("--indexed can't be combined with --tiled")
+    if args.tiled and args.dither not in ORDERED_DITHERERS:
+        parser.error(f"--tiled supports ordered dithering only "
+                     f"({', '.join(ORDERED_DITHERERS)}), not {args.dither}")
+    if args.scale < 1:
+        parser.error("--scale must be at least 1")
+    targets = None
+    if args.presets is not None:
+        if args.tiled:
+            parser.error("--presets can't be combined with --tiled")
+        try:
+            targets = ([parse_target(spec, args.pixel_size) for spec in args.presets]
+                       or preset_targets([args.pixel_size]))
+        except ValueError as e:
+            parser.error(str(e))
+    indexed = ({'scale': args.scale, 'compress_level': args.compress_level}
+               if args.indexed else None)
+    settings = settings_from_args(args)
+    jobs = iter_jobs(args.inputs, args.output_dir, settings, recursive=args.recursive)
+
+    def progress(job, status, error, seconds):
+        if status == 'ok':
+            sizes = f", {len(targets)} sizes" if targets else ""
+            print(f"ok     {job.input_path} -> {job.output_path} ({seconds:.2f}s{sizes})")
+        else:
+            print(f"FAILED {job.input_path}: {error}", file=sys.stderr)
+
+    palette = load_palette(args.palette) if args.palette else None
+    if args.shared_palette:
+        from shared_palette import fit_shared_palette
+        jobs_for_fit = iter_jobs(args.inputs, args.output_dir, settings,
+                                 recursive=args.recursive)
+        paths = (job.input_path for job in
+                 fetch_url_jobs(jobs_for_fit, os.path.join(args.output_dir, DOWNLOAD_DIR_NAME),
+                                workers=args.fetch_workers)
+                 if not job.error)
+        palette = fit_shared_palette(paths, settings,
+                                     workers=args.workers or os.cpu_count() or 1)
+        os.makedirs(args.output_dir, exist_ok=True)
+        palette_path = os.path.join(args.output_dir, 'palette.json')
+        save_palette(palette_path, palette)
+        if not args.quiet:
+            print(f"Shared palette of {len(palette)} colours written to {palette_path}")
+    tracer = Tracer()
+    summary = run_batch(jobs, args.output_dir, workers=args.workers,
+                        max_pending=args.max_pending,
+                        threads_per_worker=args.threads_per_worker,
+                        resume=not args.no_resume,
+                        progress=None if args.quiet else progress,
+                        palette=palette,
+                        memory_limit=args.memory_limit * 2**20 if args.tiled else None,
+                        fetch_workers=args.fetch_workers,
+                        tracer=tracer, profile_dir=args.profile, indexed=indexed,
+                        targets=targets,
+                        disk_cache=(None if args.no_disk_cache
+                                    else {'max_bytes': args.disk_cache_size * 2**20}))
+
+    print(f"Converted {summary['converted']}, skipped {summary['skipped']}, "
+          f"failed {summary['failed']} in {summary['seconds']:.1f}s")
+    stage_total = sum(summary['stages'].values())
+    if stage_total:
+        print("Stage time (all workers): " + ", ".join(
+            f"{name} {seconds:.2f}s ({100 * seconds / stage_total:.0f}%)"
+            for name, seconds in sorted(summary['stages'].items(), key=lambda item: -item[1])))
+    if summary['peak_bytes'] is not None:
+        print(f"Peak traced memory per job: {summary['peak_bytes'] / 2**20:.1f} MB "
+              f"(profiles in {args.profile})")
+    if args.trace:
+        tracer.export(args.trace)
+        print(f"Trace written to {args.trace}")
+    if summary['failed']:
+        print(f"Error report: {os.path.join(args.output_dir, ERROR_REPORT_NAME)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""Synthetic source images shared by the benchmarks.
+
+Each generator is seeded, so every run (and every benchmark) measures the
+same pixels.
+"""
+import numpy as np
+from PIL import Image
+
+
+def synthetic_photo(width, height, seed=0):
+    """Smooth gradients plus a little noise, roughly like a photo"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:, :, 0] = 255 * x * np.ones_like(y)
+    img[:, :, 1] = 255 * (0.5 + 0.5 * np.sin(8 * y + 5 * x))
+    img[:, :, 2] = 255 * (1 - x) * y
+    # A little noise in one band keeps the encoders honest without huge files
+    img[:, :, 1] = np.clip(img[:, :, 1] + rng.integers(-8, 8, (height, width)), 0, 255)
+    return Image.fromarray(img)
+
+
+def synthetic_sprite(size, seed=0):
+    """Flat colours in blocks and rectangles, like a sprite sheet"""
+    rng = np.random.default_rng(seed)
+    colors = rng.integers(0, 256, (12, 3), dtype=np.uint8)
+    block = max(size // 24, 1)
+    cells = rng.integers(0, len(colors), (size // block + 1,) * 2)
+    img = colors[cells.repeat(block, axis=0).repeat(block, axis=1)[:size, :size]]
+    for _ in range(8):
+        x0, y0 = rng.integers(0, size, 2)
+        w, h = rng.integers(size // 16 + 1, size // 4 + 2, 2)
+        img[y0:y0 + h, x0:x0 + w] = colors[rng.integers(len(colors))]
+    return Image.fromarray(img)
+
+
+def synthetic_sparse(size, seed=0):
+    """A photo visible only inside a disc covering ~20% of the image"""
+    photo = np.asarray(synthetic_photo(size, size, seed))
+    y, x = np.ogrid[:size, :size]
+    radius = size * 0.25
+    inside = (x - size / 2) ** 2 + (y - size / 2) ** 2 <= radius ** 2
+    alpha = np.where(inside, 255, 0).astype(np.uint8)
+    return Image.fromarray(np.dstack([photo, alpha]), 'RGBA')
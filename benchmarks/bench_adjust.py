@@ -0,0 +1,74 @@
+"""Brightness/contrast adjustment: float32 array maths vs the uint8 lookup table.
+
+    python benchmarks/bench_adjust.py [--sizes 512 1024 2048 4096]
+
+Reports best-of-N time and the peak of Python/numpy allocations
+(tracemalloc) per call. Pillow's own output buffer (width x height x bands
+bytes) is allocated outside tracemalloc's view and is the same for both.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline import ConversionSettings, PixelArtPipeline  # noqa: E402
+
+
+def adjust_float32(image, brightness, contrast):
+    """The original per-pixel float32 implementation, kept for comparison"""
+    img_array = np.array(image)
+    rgb_array = img_array[:, :, :3].astype(np.float32)
+    rgb_array *= brightness
+    rgb_array = (rgb_array - 128) * contrast + 128
+    rgb_array = np.clip(rgb_array, 0, 255)
+    if image.mode == 'RGBA':
+        return Image.fromarray(np.dstack([rgb_array.astype(np.uint8), img_array[:, :, 3]]), 'RGBA')
+    return Image.fromarray(rgb_array.astype(np.uint8))
+
+
+def measure(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048, 4096])
+    parser.add_argument('--brightness', type=float, default=1.2)
+    parser.add_argument('--contrast', type=float, default=1.4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    pipeline = PixelArtPipeline(ConversionSettings(brightness=args.brightness,
+                                                   contrast=args.contrast))
+    rng = np.random.default_rng(0)
+
+    print("| mode | size | float32 (ms) | LUT (ms) | speedup | float32 peak (MB) | LUT peak (MB) |")
+    print("|---|---|---:|---:|---:|---:|---:|")
+    for mode, bands in (('RGB', 3), ('RGBA', 4)):
+        for size in args.sizes:
+            image = Image.fromarray(rng.integers(0, 256, (size, size, bands), dtype=np.uint8),
+                                    mode)
+            old_t, old_peak = measure(
+                lambda: adjust_float32(image, args.brightness, args.contrast), args.repeat)
+            new_t, new_peak = measure(lambda: pipeline.adjust(image), args.repeat)
+            print(f"| {mode} | {size}x{size} | {old_t * 1000:.1f} | {new_t * 1000:.1f} | "
+                  f"{old_t / new_t:.1f}x | {old_peak / 2**20:.1f} | {new_peak / 2**20:.2f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Full decoding vs reduced (draft / reduce) decoding of camera-sized sources.
+
+    python benchmarks/bench_decode.py [--megapixels 12 40] [--canvas 96x96]
+
+Writes synthetic JPEG, PNG and WebP photos to a temporary directory and
+loads each onto the canvas both ways, reporting decode time, total load
+time and the size of the decoded pixel buffer.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from PIL import features
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from _images import synthetic_photo  # noqa: E402
+from loader import load_to_canvas  # noqa: E402
+from pipeline import ConversionSettings  # noqa: E402
+
+
+def write_sources(directory, megapixels):
+    sources = []
+    for mp in megapixels:
+        height = int(round((mp * 1e6 / 1.5) ** 0.5))
+        width = int(height * 1.5)
+        photo = synthetic_photo(width, height)
+        for ext, options in (('jpg', {'quality': 90}), ('png', {'compress_level': 1}),
+                             ('webp', {'quality': 80})):
+            if ext == 'webp' and not features.check('webp'):
+                continue
+            path = os.path.join(directory, f"photo_{mp}mp.{ext}")
+            photo.save(path, **options)
+            sources.append((f"{ext.upper()} {width}x{height}", path))
+    return sources
+
+
+def measure(path, settings, reduced, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _, _, report = load_to_canvas(path, settings, reduced=reduced)
+        total = time.perf_counter() - start
+        if best is None or total < best[0]:
+            best = (total, report)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--megapixels', type=float, nargs='+', default=[12, 40])
+    parser.add_argument('--canvas', default='96x96')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    w, h = (int(v) for v in args.canvas.lower().split('x'))
+    settings = ConversionSettings(canvas_width=w, canvas_height=h)
+
+    print("| source | mode | decoded | decode (ms) | load (ms) | buffer MB |")
+    print("|---|---|---|---:|---:|---:|")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, path in write_sources(directory, args.megapixels):
+            for label, reduced in (("full", False), ("reduced", True)):
+                total, report = measure(path, settings, reduced, args.repeat)
+                print(f"| {name} | {label} | {report.decoded_size[0]}x{report.decoded_size[1]} | "
+                      f"{report.decode_seconds * 1000:.0f} | {total * 1000:.0f} | "
+                      f"{report.buffer_bytes / 2**20:.1f} |")
+
+
+if __name__ == "__main__":
+    main()
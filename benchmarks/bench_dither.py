@@ -0,0 +1,101 @@
+"""Time the dither modes of the palette-mapping stage at the canvas presets.
+
+    python benchmarks/bench_dither.py [--canvases 32 64 96 128 256]
+        [--pixel-sizes 2 4 8] [--colors 4 16] [--reference]
+
+For every preset canvas and pixel size a synthetic photo is downsampled to
+the pixel grid, a Wu palette is fitted once and each dither mode maps it
+(best of --repeat runs). "tone error" is the RMS RGB error after a 3x3 box
+blur of both input and output, a rough measure of how well the dithered
+pattern reproduces the original shading (lower is better). --reference
+adds the classic per-pixel Python Floyd-Steinberg loop for comparison.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from _images import synthetic_photo  # noqa: E402
+from dithering import DITHERERS, FLOYD_STEINBERG  # noqa: E402
+from quantizers import assign_labels, quantize_wu  # noqa: E402
+
+# The canvas preset buttons in the settings panel
+CANVAS_PRESETS = (32, 64, 96, 128, 256)
+
+
+def reference_floyd_steinberg(rgb, palette, mask=None, origin=(0, 0)):
+    """Textbook per-pixel loop, the baseline the vectorized version replaces"""
+    height, width = rgb.shape[:2]
+    work = rgb.astype(np.float32)
+    colors = np.asarray(palette, dtype=np.float32)
+    labels = np.zeros((height, width), dtype=np.intp)
+    for y in range(height):
+        for x in range(width):
+            value = np.clip(work[y, x], 0, 255)
+            nearest = ((colors - value) ** 2).sum(axis=1).argmin()
+            labels[y, x] = nearest
+            error = value - colors[nearest]
+            for dy, dx, weight in FLOYD_STEINBERG:
+                if 0 <= y + dy < height and 0 <= x + dx < width:
+                    work[y + dy, x + dx] += error * weight
+    return labels
+
+
+def box_blur(img):
+    padded = np.pad(img.astype(np.float64), ((1, 1), (1, 1), (0, 0)), mode='edge')
+    height, width = img.shape[:2]
+    return sum(padded[dy:dy + height, dx:dx + width]
+               for dy in range(3) for dx in range(3)) / 9
+
+
+def tone_error(rgb, mapped):
+    diff = box_blur(mapped) - box_blur(rgb)
+    return float(np.sqrt((diff ** 2).sum(axis=2).mean()))
+
+
+def mode_functions(reference):
+    modes = {name: function for name, (_, function) in DITHERERS.items()}
+    modes['none'] = lambda rgb, palette: assign_labels(
+        rgb.reshape(-1, 3), palette).reshape(rgb.shape[:2])
+    if reference:
+        modes['fs_per_pixel'] = reference_floyd_steinberg
+    return modes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--canvases', type=int, nargs='+', default=list(CANVAS_PRESETS))
+    parser.add_argument('--pixel-sizes', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--colors', type=int, nargs='+', default=[4, 16])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--reference', action='store_true',
+                        help="Also time a per-pixel Python Floyd-Steinberg loop")
+    args = parser.parse_args(argv)
+
+    modes = mode_functions(args.reference)
+    print("| canvas | pixel size | grid | colors | mode | time (ms) | tone error |")
+    print("|---|---:|---|---:|---|---:|---:|")
+    for canvas in args.canvases:
+        for pixel_size in args.pixel_sizes:
+            side = max(1, canvas // pixel_size)
+            rgb = np.asarray(synthetic_photo(side, side))
+            for n_colors in args.colors:
+                palette, _ = quantize_wu(rgb.reshape(-1, 3), n_colors)
+                for name, dither in modes.items():
+                    best = float('inf')
+                    for _ in range(args.repeat):
+                        start = time.perf_counter()
+                        labels = dither(rgb, palette)
+                        best = min(best, time.perf_counter() - start)
+                    error = tone_error(rgb, palette[labels])
+                    print(f"| {canvas}x{canvas} | {pixel_size} | {side}x{side} | {n_colors} "
+                          f"| {name} | {best * 1000:.2f} | {error:.1f} |", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""Time the block-reduction downsample modes against NEAREST.
+
+    python benchmarks/bench_downsample.py [--sizes 32 64 96 128 256 1024 4096]
+        [--pixel-sizes 2 4 8 16] [--kinds photo sprite sparse]
+
+For every canvas size and pixel size a synthetic canvas (see
+bench_pipeline.py) is reduced to the pixel grid by each mode of the
+downsample stage (best of --repeat runs). "block error" is the RMS RGB
+distance of every output pixel from the exact mean of its block, i.e. how
+far the pixel strays from what the block looks like on average (lower is
+smoother; ``mean`` is the reference). "colours" counts the distinct visible
+colours in the output: ``mode`` and ``nearest`` never invent new ones.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pipeline import KINDS, make_source  # noqa: E402
+from downsampling import DOWNSAMPLERS  # noqa: E402
+from pipeline import ConversionSettings, PixelArtPipeline  # noqa: E402
+
+# The canvas preset buttons in the settings panel, plus poster-ish sizes
+SIZES = (32, 64, 96, 128, 256, 1024, 4096)
+
+
+def block_means(pixels, pixel_size, shape):
+    """Exact (alpha-weighted) RGB mean of every pixel_size block of the grid"""
+    height, width = shape[:2]
+    area = pixels[:height * pixel_size, :width * pixel_size].astype(np.float64)
+    area = area.reshape(height, pixel_size, width, pixel_size, -1)
+    if area.shape[-1] == 3:
+        return area.mean(axis=(1, 3))
+    alpha = area[..., 3:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (area[..., :3] * alpha).sum(axis=(1, 3)) / alpha.sum(axis=(1, 3))
+
+
+def visible(small):
+    """RGB of the output pixels that are not transparent"""
+    small = np.asarray(small)
+    if small.shape[2] == 4:
+        return small[:, :, :3][small[:, :, 3] > 0]
+    return small.reshape(-1, 3)
+
+
+def block_error(pixels, pixel_size, small):
+    small = np.asarray(small)
+    diff = small[:, :, :3] - block_means(pixels, pixel_size, small.shape)
+    if small.shape[2] == 4:
+        diff = diff[small[:, :, 3] > 0]
+    return float(np.sqrt((diff ** 2).sum(axis=-1).mean())) if diff.size else 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--pixel-sizes', type=int, nargs='+', default=[2, 4, 8, 16])
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=['photo', 'sparse'])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print("| case | mode | time (ms) | vs nearest | block error | colours |")
+    print("|---|---|---:|---:|---:|---:|")
+    for kind in args.kinds:
+        for size in args.sizes:
+            canvas = make_source(kind, size)
+            pixels = np.asarray(canvas)
+            for pixel_size in args.pixel_sizes:
+                if pixel_size > size:
+                    continue
+                nearest = None
+                for mode in DOWNSAMPLERS:
+                    pipeline = PixelArtPipeline(ConversionSettings(
+                        pixel_size=pixel_size, downsample_mode=mode))
+                    best = float('inf')
+                    for _ in range(args.repeat):
+                        start = time.perf_counter()
+                        small = pipeline.downsample(canvas)
+                        best = min(best, time.perf_counter() - start)
+                    nearest = nearest or best
+                    colours = len(np.unique(visible(small), axis=0))
+                    print(f"| {kind}-{size}-px{pixel_size} | {mode} | {best * 1000:.2f} "
+                          f"| {best / nearest:.1f}x | {block_error(pixels, pixel_size, small):.1f} "
+                          f"| {colours} |", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
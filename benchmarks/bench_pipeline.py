@@ -0,0 +1,158 @@
+"""Per-stage and end-to-end timing of the conversion pipeline, with baselines.
+
+    python benchmarks/bench_pipeline.py [--sizes 96 256 1024 4096]
+        [--pixel-sizes 4 8 16] [--colors 8 32] [--kinds photo sprite sparse]
+        [--save-baseline benchmarks/baseline.json]
+        [--baseline benchmarks/baseline.json --threshold 0.25]
+
+Generates synthetic sources for every size: a photo (gradients and noise),
+a flat-colour sprite and an RGBA image that is mostly transparent. Each
+source is 25% larger than its canvas so the resize stage does real work.
+Every case runs resize_to_canvas plus convert under a Tracer; the median
+of --repeat runs is kept per stage, and the peak of Python/numpy
+allocations (tracemalloc, Pillow's own buffers are not included) is
+recorded from one extra run.
+
+--save-baseline writes the results as JSON. --baseline compares against
+such a file and exits with status 1 if any stage got slower than
+baseline x (1 + threshold) by more than --min-ms, or peak memory grew by
+more than the threshold. Baselines are machine specific: record one on
+the machine you compare on.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from _images import synthetic_photo, synthetic_sparse, synthetic_sprite  # noqa: E402
+from dithering import DITHERERS  # noqa: E402
+from downsampling import DOWNSAMPLERS  # noqa: E402
+from pipeline import ConversionSettings, PixelArtPipeline  # noqa: E402
+from profiling import Tracer, tracing  # noqa: E402
+
+STAGES = ('resize', 'downsample', 'adjust', 'fit', 'map', 'upscale', 'total')
+KINDS = ('photo', 'sprite', 'sparse')
+SOURCE_SCALE = 1.25
+
+
+def make_source(kind, size):
+    if kind == 'photo':
+        return synthetic_photo(size, size)
+    if kind == 'sprite':
+        return synthetic_sprite(size)
+    return synthetic_sparse(size)
+
+
+def run_case(source, settings):
+    pipeline = PixelArtPipeline(settings)
+    tracer = Tracer()
+    start = time.perf_counter()
+    with tracing(tracer):
+        pipeline.convert(pipeline.resize_to_canvas(source))
+    timings = tracer.totals()
+    timings['total'] = time.perf_counter() - start
+    return timings
+
+
+def measure(source, settings, repeat):
+    runs = [run_case(source, settings) for _ in range(repeat)]
+    stages = {stage: statistics.median(run.get(stage, 0.0) for run in runs)
+              for stage in STAGES}
+    tracemalloc.start()
+    run_case(source, settings)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'ms': {stage: seconds * 1000 for stage, seconds in stages.items()},
+            'peak_mb': peak / 2**20}
+
+
+def compare(results, baseline, threshold, min_ms):
+    """Regression messages for results that are worse than baseline"""
+    regressions = []
+    for case, result in results.items():
+        old = baseline.get('cases', {}).get(case)
+        if old is None:
+            continue
+        for stage, ms in result['ms'].items():
+            before = old['ms'].get(stage)
+            if before is not None and ms > before * (1 + threshold) and ms - before > min_ms:
+                regressions.append(f"{case} {stage}: {before:.1f} -> {ms:.1f} ms "
+                                   f"(+{100 * (ms / max(before, 1e-9) - 1):.0f}%)")
+        before = old.get('peak_mb')
+        if before and result['peak_mb'] > before * (1 + threshold) \
+                and result['peak_mb'] - before > 1:
+            regressions.append(f"{case} peak memory: {before:.1f} -> "
+                               f"{result['peak_mb']:.1f} MB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[96, 256, 1024, 4096])
+    parser.add_argument('--pixel-sizes', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--colors', type=int, nargs='+', default=[8, 32])
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS))
+    parser.add_argument('--quantizer', default=ConversionSettings().quantizer)
+    parser.add_argument('--dither', choices=list(DITHERERS), default=ConversionSettings().dither)
+    parser.add_argument('--downsample', choices=list(DOWNSAMPLERS),
+                        default=ConversionSettings().downsample_mode)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save-baseline', metavar='FILE')
+    parser.add_argument('--baseline', metavar='FILE')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="Allowed relative slowdown before a regression (default: 0.25)")
+    parser.add_argument('--min-ms', type=float, default=2.0,
+                        help="Ignore slowdowns smaller than this, to skip timer noise")
+    args = parser.parse_args(argv)
+
+    results = {}
+    print("| case | " + " | ".join(f"{stage} (ms)" for stage in STAGES) + " | peak (MB) |")
+    print("|---|" + "---:|" * (len(STAGES) + 1))
+    for kind in args.kinds:
+        for size in args.sizes:
+            source = make_source(kind, int(size * SOURCE_SCALE))
+            for pixel_size in args.pixel_sizes:
+                for colors in args.colors:
+                    settings = ConversionSettings(
+                        canvas_width=size, canvas_height=size, pixel_size=pixel_size,
+                        color_count=colors, quantizer=args.quantizer, dither=args.dither,
+                        downsample_mode=args.downsample,
+                        transparent_background=(kind == 'sparse'))
+                    case = f"{kind}-{size}-px{pixel_size}-c{colors}"
+                    result = measure(source, settings, args.repeat)
+                    results[case] = result
+                    print(f"| {case} | " + " | ".join(f"{result['ms'][stage]:.1f}"
+                                                      for stage in STAGES) +
+                          f" | {result['peak_mb']:.1f} |", flush=True)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump({'machine': platform.platform(), 'python': platform.python_version(),
+                       'quantizer': args.quantizer, 'cases': results}, f, indent=1)
+        print(f"\nBaseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('quantizer') != args.quantizer:
+            print(f"\nWarning: baseline used quantizer {baseline.get('quantizer')!r}, "
+                  f"this run {args.quantizer!r}")
+        regressions = compare(results, baseline, args.threshold, args.min_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for message in regressions:
+                print(f"  {message}")
+            return 1
+        print(f"\nNo regressions against {args.baseline} "
+              f"(threshold {args.threshold:.0%}, min {args.min_ms} ms)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""Compare the quantizer backends on wall time and colour error.
+
+    python benchmarks/bench_quantizers.py [--sizes 64 128 256] [--colors 4 16 64]
+
+Prints a markdown table with, per engine, the best-of-N fit time and the
+RMS RGB error between the input pixels and their palette colours.
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from _images import synthetic_photo, synthetic_sprite  # noqa: E402
+from quantizers import QUANTIZERS  # noqa: E402
+
+
+def rms_error(pixels, palette, labels):
+    diff = palette[labels].astype(np.float64) - pixels
+    return float(np.sqrt((diff ** 2).sum(axis=1).mean()))
+
+
+def bench(engines, sizes, colors, repeat):
+    rows = []
+    sources = (("photo", lambda size: synthetic_photo(size, size)),
+               ("sprite", synthetic_sprite))
+    for kind, make in sources:
+        for size in sizes:
+            pixels = np.asarray(make(size)).reshape(-1, 3)
+            for n_colors in colors:
+                for name in engines:
+                    quantize = QUANTIZERS[name][1]
+                    best = float('inf')
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        palette, labels = quantize(pixels, n_colors)
+                        best = min(best, time.perf_counter() - start)
+                    rows.append((kind, f"{size}x{size}", n_colors, name, best * 1000,
+                                 rms_error(pixels, palette, labels)))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 128, 256],
+                        help="Side length of the (already downsampled) input")
+    parser.add_argument('--colors', type=int, nargs='+', default=[4, 16, 64])
+    parser.add_argument('--engines', nargs='+', choices=list(QUANTIZERS),
+                        default=list(QUANTIZERS))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    # Duplicate points make KMeans warn about fewer distinct clusters
+    warnings.simplefilter('ignore')
+    rows = bench(args.engines, args.sizes, args.colors, args.repeat)
+
+    print("| input | size | colors | engine | time (ms) | RMS error |")
+    print("|---|---|---:|---|---:|---:|")
+    for kind, size, n_colors, name, ms, err in rows:
+        print(f"| {kind} | {size} | {n_colors} | {name} | {ms:.1f} | {err:.2f} |")
+
+
+if __name__ == "__main__":
+    main()
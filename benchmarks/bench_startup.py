@@ -0,0 +1,115 @@
+"""Startup time of the GUI and CLI entry points, in fresh interpreters.
+
+    python benchmarks/bench_startup.py [--repeat 5]
+        [--save-baseline startup.json] [--baseline startup.json --threshold 0.3]
+
+Each entry point is started --repeat times as a subprocess and the median
+wall time is reported, together with the heavy modules it imported:
+
+* ``import PixLGEN``: the GUI module without opening a window;
+* ``PixLGEN.py`` with PIXLGEN_EXIT_AFTER_STARTUP set: window shown, then
+  closed (skipped without a display);
+* ``PixLGEN.py batch|palette|serve --help``.
+
+Exits with status 1 if an entry point imports a module that should stay
+lazy (scikit-learn, requests), or, with --baseline, got slower than
+baseline x (1 + threshold) by more than --min-ms.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(REPO, 'PixLGEN.py')
+# Modules that must not be imported just to start up
+LAZY_MODULES = ('sklearn', 'requests')
+
+PROBE = ("import json, runpy, sys\n"
+         "sys.argv = {argv!r}\n"
+         "try:\n"
+         "    {body}\n"
+         "except SystemExit:\n"
+         "    pass\n"
+         "print('\\n' + json.dumps([m for m in {lazy!r} if m in sys.modules]))\n")
+
+
+def entry_points():
+    yield 'import PixLGEN', PROBE.format(argv=['PixLGEN'], body='import PixLGEN',
+                                         lazy=LAZY_MODULES), {}
+    if os.environ.get('DISPLAY') or sys.platform in ('win32', 'darwin'):
+        yield 'GUI window', PROBE.format(
+            argv=[SCRIPT], body=f"runpy.run_path({SCRIPT!r}, run_name='__main__')",
+            lazy=LAZY_MODULES), {'PIXLGEN_EXIT_AFTER_STARTUP': '1'}
+    for command in ('batch', 'palette', 'serve'):
+        yield f'{command} --help', PROBE.format(
+            argv=[SCRIPT, command, '--help'],
+            body=f"runpy.run_path({SCRIPT!r}, run_name='__main__')",
+            lazy=LAZY_MODULES), {}
+
+
+def run(code, env):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], cwd=REPO, capture_output=True,
+                            text=True, env={**os.environ, **env})
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else
+                           f"exit status {result.returncode}")
+    return elapsed, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save-baseline', metavar='FILE')
+    parser.add_argument('--baseline', metavar='FILE')
+    parser.add_argument('--threshold', type=float, default=0.3)
+    parser.add_argument('--min-ms', type=float, default=30.0,
+                        help="Ignore slowdowns smaller than this (process start noise)")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    # Bare interpreter start, for reference
+    bare = statistics.median(run("print('\\n[]')", {})[0] for _ in range(args.repeat))
+    results = {}
+    problems = []
+    print(f"Bare interpreter: {bare * 1000:.0f} ms\n")
+    print("| entry point | median (ms) | over bare (ms) | lazy modules imported |")
+    print("|---|---:|---:|---|")
+    for name, code, env in entry_points():
+        times, imported = [], []
+        for _ in range(args.repeat):
+            elapsed, imported = run(code, env)
+            times.append(elapsed)
+        ms = statistics.median(times) * 1000
+        results[name] = ms
+        print(f"| {name} | {ms:.0f} | {ms - bare * 1000:.0f} | {', '.join(imported) or '-'} |")
+        if imported:
+            problems.append(f"{name} imports {', '.join(imported)} at startup")
+        before = baseline.get(name)
+        if before is not None and ms > before * (1 + args.threshold) \
+                and ms - before > args.min_ms:
+            problems.append(f"{name}: {before:.0f} -> {ms:.0f} ms")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+        print(f"\nBaseline written to {args.save_baseline}")
+    if problems:
+        print(f"\n{len(problems)} startup regression(s):")
+        for message in problems:
+            print(f"  {message}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
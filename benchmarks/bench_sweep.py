@@ -0,0 +1,100 @@
+"""Time the background palette sweep against fitting each colour count cold.
+
+    python benchmarks/bench_sweep.py [--sizes 96 256] [--pixel-sizes 2 8]
+        [--engines kmeans wu ...] [--check 8 32 64]
+
+For every synthetic canvas (see bench_pipeline.py) and engine, a sweep
+fits all colour counts of the GUI slider into an empty StageCache. "cold
+fit" is one ordinary fit at the starting count, "slider" the mean time of a
+conversion at a swept count (map and upscale only) and "error vs cold" the
+mean ratio of the swept palettes' squared colour error to ordinary fits at
+the --check counts: 1.00 for the hierarchical engines, which give the same
+palettes, and close to it for the warm-started K-means chains.
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+from dataclasses import replace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pipeline import KINDS, make_source  # noqa: E402
+from palette_sweep import SWEEP_COUNTS, sweep_palettes  # noqa: E402
+from pipeline import ConversionSettings, PixelArtPipeline  # noqa: E402
+from quantizers import QUANTIZERS  # noqa: E402
+from stage_cache import StageCache, image_fingerprint  # noqa: E402
+
+
+def squared_error(pipeline, small_img, palette, labels):
+    pixels = pipeline.palette_pixels(small_img).astype(np.float64)
+    if not len(pixels):
+        return 0.0
+    return float(((pixels - np.asarray(palette)[labels]) ** 2).sum(axis=1).mean())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[96, 256])
+    parser.add_argument('--pixel-sizes', type=int, nargs='+', default=[2, 8])
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=['photo', 'sparse'])
+    parser.add_argument('--engines', nargs='+', choices=list(QUANTIZERS),
+                        default=list(QUANTIZERS))
+    parser.add_argument('--start', type=int, default=16, help="Colour count the sweep starts at")
+    parser.add_argument('--check', type=int, nargs='+', default=[8, 32, 64])
+    args = parser.parse_args(argv)
+
+    # Duplicate points make KMeans warn about fewer distinct clusters
+    warnings.simplefilter('ignore')
+    print("| case | engine | sweep (s) | per count (ms) | cold fit (ms) | slider (ms) "
+          "| error vs cold |")
+    print("|---|---|---:|---:|---:|---:|---:|")
+    for kind in args.kinds:
+        for size in args.sizes:
+            canvas = make_source(kind, size)
+            for pixel_size in args.pixel_sizes:
+                base = ConversionSettings(canvas_width=size, canvas_height=size,
+                                          pixel_size=pixel_size, color_count=args.start,
+                                          transparent_background=canvas.mode == 'RGBA')
+                for engine in args.engines:
+                    settings = replace(base, quantizer=engine)
+                    small_img = PixelArtPipeline(settings).reduce(canvas)
+
+                    start = time.perf_counter()
+                    PixelArtPipeline(settings).fit_palette(small_img)
+                    cold = time.perf_counter() - start
+
+                    cache = StageCache()
+                    start = time.perf_counter()
+                    fitted = sweep_palettes(PixelArtPipeline(settings, cache=cache), canvas)
+                    sweep = time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    for count in SWEEP_COUNTS:
+                        PixelArtPipeline(replace(settings, color_count=count),
+                                         cache=cache).convert(canvas)
+                    slider = (time.perf_counter() - start) / len(SWEEP_COUNTS)
+
+                    ratios = []
+                    source_key = image_fingerprint(canvas)
+                    for count in args.check:
+                        pipeline = PixelArtPipeline(replace(settings, color_count=count),
+                                                    cache=cache)
+                        keys, _ = pipeline.cached_keys(source_key)
+                        swept = cache.get(keys['fit'])
+                        reference = squared_error(pipeline, small_img,
+                                                  *pipeline.fit_palette(small_img))
+                        error = squared_error(pipeline, small_img, *swept)
+                        ratios.append(error / reference if reference else 1.0)
+
+                    print(f"| {kind}-{size}-px{pixel_size} | {engine} | {sweep:.2f} "
+                          f"| {sweep / max(fitted, 1) * 1000:.1f} | {cold * 1000:.1f} "
+                          f"| {slider * 1000:.2f} | {np.mean(ratios):.2f} |", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
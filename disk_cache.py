@@ -0,0 +1,243 @@
+"""Persistent, content-addressed cache of loaded canvases and palette fits.
+
+Reopening the same image in a later session (or re-running a batch over
+an unchanged folder) would otherwise decode, resize and cluster it again.
+Two kinds of results are kept on disk:
+
+* canvases, keyed by the hash of the source file's bytes plus the canvas
+  settings (see loader.load_to_canvas);
+* palette fits, keyed by the pipeline's 'fit' stage key, which already
+  names the canvas content and every setting the fit depends on (see
+  PixelArtPipeline.stage_keys).
+
+Each entry is a JSON file (the palette or image metadata) plus an optional
+``.npy`` array (the canvas pixels or the label map), which is opened
+memory-mapped so a hit costs little more than paging the file in.
+
+Several processes may share one directory: files are written to a
+temporary name and moved into place with os.replace, the array before the
+JSON, so a reader that finds the JSON finds a complete array. Anything
+missing or unreadable is treated as a miss. Hits touch the JSON file and
+entries are evicted least recently used first once the directory exceeds
+max_bytes, checked after every max_bytes / PRUNE_FRACTION bytes written.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from fetch import cache_root
+
+DEFAULT_DISK_CACHE_BYTES = 1024 * 1024 * 1024
+# Prune after this fraction of max_bytes has been written by one process
+PRUNE_FRACTION = 32
+# Temporary files older than this were left by a killed writer
+STALE_TMP_SECONDS = 3600
+# Stage cache keys (see PixelArtPipeline.stage_keys) that are kept on disk
+PERSISTED_STAGES = ('fit',)
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def default_disk_cache_dir():
+    return os.path.join(cache_root(), 'stages')
+
+
+def source_digest(source):
+    """Content hash of a file path, bytes or seekable file-like object"""
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    else:
+        position = source.tell()
+        for chunk in iter(lambda: source.read(1 << 20), b''):
+            digest.update(chunk)
+        source.seek(position)
+    return digest.hexdigest()
+
+
+def cache_key(*parts):
+    """Stable file name for a key made of strings, numbers, bools, bytes and tuples"""
+    return hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class DiskCache:
+    """Directory of JSON + .npy entries under a byte budget (see module docstring).
+
+    It also implements the StageCache interface (get, put, get_or_compute)
+    for the stages in PERSISTED_STAGES, so it can serve as a pipeline's
+    cache directly or as the backing store of a StageCache.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_DISK_CACHE_BYTES):
+        self.directory = directory or default_disk_cache_dir()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._written = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _paths(self, name):
+        base = os.path.join(self.directory, name)
+        return base + '.json', base + '.npy'
+
+    def _write(self, path, write):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def load(self, name):
+        """(array or None, meta) stored under name, or None on a miss"""
+        meta_path, array_path = self._paths(name)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            array = None
+            if meta.get('shape') is not None:
+                array = np.load(array_path, mmap_mode='r')
+                if list(array.shape) != meta['shape'] or array.dtype.str != meta['dtype']:
+                    # Replaced by another writer between the two reads
+                    self.misses += 1
+                    return None
+            os.utime(meta_path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return array, meta
+
+    def store(self, name, meta, array=None):
+        """Save meta (JSON-serializable dict) and an optional array under name"""
+        meta_path, array_path = self._paths(name)
+        meta = dict(meta, shape=None, dtype=None)
+        if array is not None:
+            array = np.ascontiguousarray(array)
+            meta.update(shape=list(array.shape), dtype=array.dtype.str)
+            # Array first: a JSON file always points at a complete array
+            self._write(array_path, lambda f: np.save(f, array, allow_pickle=False))
+        body = json.dumps(meta).encode('utf-8')
+        self._write(meta_path, lambda f: f.write(body))
+        self._written += len(body) + (array.nbytes if array is not None else 0)
+        if self._written * PRUNE_FRACTION >= self.max_bytes:
+            self.prune()
+
+    def load_image(self, name):
+        """(PIL image, meta) stored with store_image, or None"""
+        entry = self.load(name)
+        if entry is None or entry[0] is None:
+            return None
+        array, meta = entry
+        return Image.fromarray(np.asarray(array), meta['mode']), meta
+
+    def store_image(self, name, image, meta=None):
+        self.store(name, dict(meta or {}, mode=image.mode), np.asarray(image))
+
+    # StageCache interface, for the pipeline's persisted stages
+
+    @staticmethod
+    def persists(key):
+        return isinstance(key, tuple) and bool(key) and key[0] in PERSISTED_STAGES
+
+    def get(self, key, default=None):
+        if not self.persists(key):
+            return default
+        entry = self.load(cache_key(*key))
+        if entry is None or entry[0] is None:
+            return default
+        labels, meta = entry
+        return np.asarray(meta['palette'], dtype=int).reshape(-1, 3), labels
+
+    def put(self, key, value):
+        if not self.persists(key):
+            return
+        palette, labels = value
+        palette = np.asarray(palette, dtype=int).reshape(-1, 3)
+        # Label maps are stored as compactly as the palette allows
+        dtype = np.uint8 if len(palette) <= 256 else np.uint16
+        self.store(cache_key(*key), {'palette': palette.tolist()},
+                   np.asarray(labels).astype(dtype))
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, computing and storing it on a miss"""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is not sentinel:
+            return value
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def prune(self):
+        """Evict least recently used entries until the directory fits max_bytes"""
+        self._written = 0
+        entries = {}
+        total = 0
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                name, ext = os.path.splitext(entry.name)
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if ext == '.tmp':
+                    if now - stat.st_mtime > STALE_TMP_SECONDS:
+                        _remove(entry.path)
+                    continue
+                if ext not in ('.json', '.npy'):
+                    continue
+                mtime, size = entries.get(name, (0.0, 0))
+                # An entry is as recent as its JSON file, which hits touch
+                entries[name] = (stat.st_mtime if ext == '.json' else mtime,
+                                 size + stat.st_size)
+                total += stat.st_size
+        for name, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            # JSON first, so readers never find metadata without its array
+            for path in self._paths(name):
+                _remove(path)
+            total -= size
+
+    def clear(self):
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(('.json', '.npy')):
+                    _remove(entry.path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # Already gone (another process pruned it) or still mapped on Windows
+        pass
+
+
+def get_disk_cache(directory=None, max_bytes=DEFAULT_DISK_CACHE_BYTES):
+    """Process-wide DiskCache for directory, or None if it can't be created"""
+    directory = directory or default_disk_cache_dir()
+    with _caches_lock:
+        if (directory, max_bytes) not in _caches:
+            try:
+                _caches[directory, max_bytes] = DiskCache(directory, max_bytes)
+            except OSError:
+                # Read-only home directory: run without a disk cache
+                _caches[directory, max_bytes] = None
+        return _caches[directory, max_bytes]
@@ -0,0 +1,163 @@
+"""Dithering for the palette-mapping stage.
+
+Every ditherer takes an (H, W, 3) uint8 RGB array and a (k, 3) palette and
+returns an (H, W) array of palette indices, like a dithered version of
+assign_labels. An optional (H, W) boolean mask marks the pixels that count
+(opaque ones); the others never receive or pass on error.
+
+Ordered dithering (Bayer or blue noise) adds a tiled threshold map to every
+pixel and matches the result in one vectorized pass. The offset is scaled
+to the palette's typical spacing, so sparse palettes dither more than dense
+ones. ``origin`` gives the array's position in the full image, so bands of
+one image line up seamlessly.
+
+Error diffusion (Floyd-Steinberg, Atkinson) is inherently sequential, but a
+pixel only depends on pixels to its left and in rows above. All pixels on
+the same skewed line ``x + 2y = t`` are therefore independent. Each step
+processes one such line as a vector, which takes W + 2H numpy steps instead
+of W x H Python iterations. The output is equivalent to the classic
+left-to-right, top-to-bottom scan up to float rounding: error arriving
+from several neighbours is summed in a different order, so a pixel that
+is exactly between two palette colours can occasionally flip.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from quantizers import assign_labels
+
+BAYER_SIZE = 8
+BLUE_NOISE_SIZE = 64
+# High-pass/re-rank rounds used to shape white noise into blue noise
+BLUE_NOISE_ITERATIONS = 8
+BLUE_NOISE_SIGMA = 1.5
+
+# (dy, dx, weight) of the error passed from a pixel to its neighbours
+FLOYD_STEINBERG = ((0, 1, 7 / 16), (1, -1, 3 / 16), (1, 0, 5 / 16), (1, 1, 1 / 16))
+# Atkinson passes on only 6/8 of the error, which keeps contrast high
+ATKINSON = ((0, 1, 1 / 8), (0, 2, 1 / 8), (1, -1, 1 / 8), (1, 0, 1 / 8), (1, 1, 1 / 8),
+            (2, 0, 1 / 8))
+
+
+@lru_cache(maxsize=None)
+def bayer_matrix(size=BAYER_SIZE):
+    """size x size Bayer threshold map with values in [-0.5, 0.5) (don't modify)"""
+    if size < 2 or size & (size - 1):
+        raise ValueError(f"Bayer matrix size must be a power of two, got {size}")
+    m = np.zeros((1, 1), dtype=int)
+    while len(m) < size:
+        m = np.block([[4 * m, 4 * m + 2], [4 * m + 3, 4 * m + 1]])
+    return (m + 0.5) / m.size - 0.5
+
+
+@lru_cache(maxsize=None)
+def blue_noise(size=BLUE_NOISE_SIZE, seed=0):
+    """Tileable size x size blue-noise threshold map in [-0.5, 0.5) (don't modify).
+
+    White noise is repeatedly high-pass filtered (a Gaussian low-pass
+    subtracted in the frequency domain, so the map wraps around) and
+    re-ranked to a uniform distribution.
+    """
+    noise = np.random.default_rng(seed).random((size, size))
+    freq = np.fft.fftfreq(size)
+    radius_sq = freq[:, None] ** 2 + freq[None, :] ** 2
+    lowpass = np.exp(-2 * (np.pi * BLUE_NOISE_SIGMA) ** 2 * radius_sq)
+    ranks = np.empty(noise.size)
+    for _ in range(BLUE_NOISE_ITERATIONS):
+        noise = noise - np.fft.ifft2(np.fft.fft2(noise) * lowpass).real
+        ranks[np.argsort(noise, axis=None)] = np.arange(noise.size)
+        noise = ranks.reshape(size, size) / noise.size
+    return noise + 0.5 / noise.size - 0.5
+
+
+def palette_spread(palette):
+    """Median distance from each palette colour to its nearest neighbour"""
+    palette = np.asarray(palette, dtype=np.float64)
+    if len(palette) < 2:
+        return 0.0
+    dist = np.sqrt(((palette[:, None, :] - palette[None, :, :]) ** 2).sum(axis=2))
+    np.fill_diagonal(dist, np.inf)
+    return float(np.median(dist.min(axis=1)))
+
+
+def ordered_dither(rgb, palette, threshold_map, mask=None, origin=(0, 0)):
+    """Palette indices after adding a tiled threshold map (see module docstring)"""
+    height, width = rgb.shape[:2]
+    size_y, size_x = threshold_map.shape
+    y0, x0 = origin
+    rows = (np.arange(height) + y0) % size_y
+    cols = (np.arange(width) + x0) % size_x
+    offset = threshold_map[rows[:, None], cols[None, :]] * palette_spread(palette)
+    values = np.clip(rgb.astype(np.float32) + offset[:, :, None].astype(np.float32), 0, 255)
+    if mask is None:
+        return assign_labels(values.reshape(-1, 3), palette).reshape(height, width)
+    labels = np.zeros((height, width), dtype=np.intp)
+    labels[mask] = assign_labels(values[mask], palette)
+    return labels
+
+
+def diffuse_error(rgb, palette, kernel, mask=None):
+    """Palette indices by error diffusion with kernel, one skewed line at a time"""
+    height, width = rgb.shape[:2]
+    reach_y = max(dy for dy, _, _ in kernel)
+    reach_x = max(abs(dx) for _, dx, _ in kernel)
+    # Padding lets errors run off the edges without bounds checks
+    work = np.zeros((height + reach_y, width + 2 * reach_x, 3), dtype=np.float32)
+    work[:height, reach_x:reach_x + width] = rgb
+    colors = np.asarray(palette, dtype=np.float32)
+    colors_sq = (colors ** 2).sum(axis=1)
+    labels = np.zeros((height, width), dtype=np.intp)
+    all_rows = np.arange(height)
+
+    for t in range(width + 2 * (height - 1)):
+        # Rows whose pixel on the line x + 2y = t lies inside the image
+        ys = all_rows[max(0, (t - width + 2) // 2):min(height - 1, t // 2) + 1]
+        xs = t - 2 * ys
+        values = np.clip(work[ys, xs + reach_x], 0, 255)
+        nearest = (colors_sq - 2.0 * values @ colors.T).argmin(axis=1)
+        labels[ys, xs] = nearest
+        error = values - colors[nearest]
+        if mask is not None:
+            error[~mask[ys, xs]] = 0
+        # One term at a time: within a term the targets are distinct
+        for dy, dx, weight in kernel:
+            work[ys + dy, xs + dx + reach_x] += error * weight
+    return labels
+
+
+def dither_bayer(rgb, palette, mask=None, origin=(0, 0)):
+    return ordered_dither(rgb, palette, bayer_matrix(), mask, origin)
+
+
+def dither_blue_noise(rgb, palette, mask=None, origin=(0, 0)):
+    return ordered_dither(rgb, palette, blue_noise(), mask, origin)
+
+
+def dither_floyd_steinberg(rgb, palette, mask=None, origin=(0, 0)):
+    return diffuse_error(rgb, palette, FLOYD_STEINBERG, mask)
+
+
+def dither_atkinson(rgb, palette, mask=None, origin=(0, 0)):
+    return diffuse_error(rgb, palette, ATKINSON, mask)
+
+
+# Registry name -> (label shown in the GUI, function); None maps without dithering
+DITHERERS = {
+    'none': ("None", None),
+    'bayer': ("Ordered (Bayer 8×8)", dither_bayer),
+    'blue_noise': ("Ordered (blue noise)", dither_blue_noise),
+    'floyd_steinberg': ("Floyd–Steinberg", dither_floyd_steinberg),
+    'atkinson': ("Atkinson", dither_atkinson),
+}
+
+# Ditherers that only look at one pixel at a time, so bands can be dithered
+# independently (see tiled.py)
+ORDERED_DITHERERS = ('none', 'bayer', 'blue_noise')
+
+
+def get_ditherer(name):
+    """Look up a ditherer function by its registry name (None for 'none')"""
+    try:
+        return DITHERERS[name][1]
+    except KeyError:
+        raise ValueError(f"Unknown dither mode {name!r}; choose one of: {', '.join(DITHERERS)}")
@@ -0,0 +1,175 @@
+"""Block-reduction downsampling for the pixelation stage.
+
+NEAREST keeps one pixel per pixel_size block, which is fast but noisy. The
+reducers here look at the whole block instead. Each takes an (H, W, C)
+uint8 array (RGB or RGBA) and a block size that divides it exactly, and
+returns the (h, w, C) reduced array:
+
+* ``mean``: area average. Colour is weighted by alpha, so transparent
+  pixels don't darken edges.
+* ``median``: per-channel median of the opaque pixels.
+* ``mode``: the most frequent colour in the block (the lowest one on
+  ties), so no new colours are introduced.
+
+Blocks are regular pixel_size squares of a reshaped view: the mean sums
+strided slices of it, median and mode sort a (rows, cols, pixels_per_block)
+copy. reduce_blocks splits the image so that every part divides evenly; the
+last row and column of blocks take whatever is left over: it is larger than
+pixel_size when the grid is rounded down, as in the regular pipeline, and
+smaller when it is rounded up, as in tiled bands. An RGBA block stays
+opaque when at least half of its pixels are, and is reduced over those
+pixels only. For mean and median its alpha is then the mean alpha of those
+pixels.
+"""
+import numpy as np
+
+# Sort key of a transparent pixel in the mode reducer, above any RGBA key
+_TRANSPARENT_KEY = 1 << 32
+
+
+def _spans(length, block, count):
+    """(start, stop, block size, blocks) runs covering length with count blocks"""
+    last = length - (count - 1) * block
+    if last == block:
+        return [(0, length, block, count)]
+    spans = [(0, (count - 1) * block, block, count - 1)] if count > 1 else []
+    return spans + [((count - 1) * block, length, last, 1)]
+
+
+def _blocks(region, by, bx):
+    """(rows, cols, by * bx, C) copy of region split into by x bx blocks"""
+    h, w, c = region.shape
+    blocks = region.reshape(h // by, by, w // bx, bx, c).swapaxes(1, 2)
+    return blocks.reshape(h // by, w // bx, by * bx, c)
+
+
+def _block_sums(values, by, bx, dtype):
+    """Sum of every by x bx block of an (H, W, C) array, accumulated in dtype.
+
+    Adding strided slices (rows first, then columns) is several times
+    faster than sum(axis=...) over the reshaped block axes.
+    """
+    h, w, c = values.shape
+    rows = values.reshape(h // by, by, w, c)
+    acc = rows[:, 0].astype(dtype)
+    for i in range(1, by):
+        acc += rows[:, i]
+    cols = acc.reshape(h // by, w // bx, bx, c)
+    total = cols[:, :, 0].copy()
+    for j in range(1, bx):
+        total += cols[:, :, j]
+    return total
+
+
+def _opacity(blocks):
+    """Opaque-pixel mask of every block and whether each block stays opaque"""
+    opaque = blocks[..., 3] > 0
+    return opaque, 2 * opaque.sum(axis=2) >= opaque.shape[2]
+
+
+def _mean(region, by, bx):
+    n = by * bx
+    if region.shape[2] == 3:
+        # Integer sums are exact; adding n // 2 rounds half up
+        return ((_block_sums(region, by, bx, np.uint32) + n // 2) // n).astype(np.uint8)
+    # Alpha-weighted sums stay exact in 32 bits up to 256x256 blocks
+    dtype = np.uint32 if n * 255 * 255 < 2 ** 32 else np.uint64
+    alpha = region[..., 3:]
+    weighted = _block_sums(region[..., :3] * alpha.astype(dtype), by, bx, dtype)
+    weight = _block_sums(alpha, by, bx, dtype)[..., 0].astype(np.float64)
+    opaque = _block_sums(alpha > 0, by, bx, np.uint32)[..., 0]
+    out = np.zeros(weighted.shape[:2] + (4,), dtype=np.uint8)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rgb = weighted / weight[..., None]
+    out[..., :3] = np.rint(np.nan_to_num(rgb))
+    out[..., 3] = np.rint(weight / np.maximum(opaque, 1))
+    out[2 * opaque < n] = 0
+    return out
+
+
+def _median(region, by, bx):
+    # uint16 because numpy sorts short rows of uint8 much more slowly
+    blocks = _blocks(region, by, bx).astype(np.uint16)
+    n = blocks.shape[2]
+    if blocks.shape[3] == 3:
+        ordered = np.sort(blocks, axis=2)
+        return ((ordered[:, :, (n - 1) // 2] + ordered[:, :, n // 2] + 1) // 2).astype(np.uint8)
+    opaque, keep = _opacity(blocks)
+    # Transparent pixels sort last, so the median index only counts opaque ones
+    values = np.where(opaque[..., None], blocks[..., :3], np.uint16(256))
+    ordered = np.sort(values, axis=2)
+    count = np.maximum(opaque.sum(axis=2), 1)[..., None, None]
+    low = np.take_along_axis(ordered, (count - 1) // 2, axis=2)[:, :, 0]
+    high = np.take_along_axis(ordered, count // 2, axis=2)[:, :, 0]
+    out = np.zeros(blocks.shape[:2] + (4,), dtype=np.uint8)
+    out[..., :3] = np.minimum((low + high + 1) // 2, 255)
+    alpha = blocks[..., 3].astype(np.float64).sum(axis=2)
+    out[..., 3] = np.rint(alpha / count[..., 0, 0])
+    out[~keep] = 0
+    return out
+
+
+def _mode(region, by, bx):
+    blocks = _blocks(region, by, bx)
+    channels = blocks.shape[3]
+    # 32-bit keys sort faster; RGBA needs room for the transparent key
+    px = blocks.astype(np.int64 if channels == 4 else np.uint32)
+    keys = (px[..., 0] << 16) | (px[..., 1] << 8) | px[..., 2]
+    if channels == 4:
+        opaque, keep = _opacity(blocks)
+        # Transparent pixels sort last and never win
+        keys = np.where(opaque, (keys << 8) | px[..., 3], _TRANSPARENT_KEY)
+    ordered = np.sort(keys, axis=2)
+    # Length of the run of equal keys ending at every position
+    index = np.arange(ordered.shape[2])
+    changes = np.ones(ordered.shape, dtype=bool)
+    changes[:, :, 1:] = ordered[:, :, 1:] != ordered[:, :, :-1]
+    runs = index - np.maximum.accumulate(np.where(changes, index, 0), axis=2)
+    if channels == 4:
+        runs[ordered == _TRANSPARENT_KEY] = -1
+    best = np.take_along_axis(ordered, runs.argmax(axis=2)[..., None], axis=2)[..., 0]
+    out = np.zeros(blocks.shape[:2] + (channels,), dtype=np.uint8)
+    if channels == 4:
+        out[..., 3] = best & 255
+        best = best >> 8
+    out[..., 0] = (best >> 16) & 255
+    out[..., 1] = (best >> 8) & 255
+    out[..., 2] = best & 255
+    if channels == 4:
+        out[~keep] = 0
+    return out
+
+
+def reduce_blocks(array, block, grid_size, reducer):
+    """Reduce an (H, W, C) uint8 array to grid_size (w, h) with reducer per block"""
+    array = np.asarray(array)
+    height, width = array.shape[:2]
+    grid_w, grid_h = grid_size
+    out = np.empty((grid_h, grid_w, array.shape[2]), dtype=np.uint8)
+    row = 0
+    for y0, y1, by, rows in _spans(height, block, grid_h):
+        col = 0
+        for x0, x1, bx, cols in _spans(width, block, grid_w):
+            out[row:row + rows, col:col + cols] = reducer(array[y0:y1, x0:x1], by, bx)
+            col += cols
+        row += rows
+    return out
+
+
+# Registry name -> (label shown in the GUI, block reducer); None keeps one
+# pixel per block with Image.resize(NEAREST)
+DOWNSAMPLERS = {
+    'nearest': ("Nearest (one pixel)", None),
+    'mean': ("Average", _mean),
+    'median': ("Median", _median),
+    'mode': ("Dominant colour", _mode),
+}
+
+
+def get_downsampler(name):
+    """Look up a block reducer by its registry name (None for 'nearest')"""
+    try:
+        return DOWNSAMPLERS[name][1]
+    except KeyError:
+        raise ValueError(f"Unknown downsample mode {name!r}; "
+                         f"choose one of: {', '.join(DOWNSAMPLERS)}")
@@ -0,0 +1,110 @@
+"""Compact exports: indexed-colour images and palette files.
+
+Pixel art holds at most a few dozen colours in flat blocks, so instead of
+saving the upscaled RGB(A) canvas it can be written as a palette-mode
+(``P``) PNG or GIF at its native pixel resolution: one byte (or less) per
+pixel instead of three or four, and PNG/GIF bit depths of 1, 2, 4 or 8 chosen
+from the palette size. Fully transparent pixels share one extra palette
+entry marked as the transparency index; partially transparent pixels are
+written opaque. An integer scale factor enlarges the image with
+NEAREST without leaving palette mode.
+"""
+import os
+
+import numpy as np
+from PIL import Image
+
+from palette_lut import save_palette
+from quantizers import assign_labels
+
+MAX_INDEXED_COLORS = 256
+INDEXED_FORMATS = {'.png': 'PNG', '.gif': 'GIF'}
+PALETTE_FORMATS = ('.gpl', '.act', '.hex')
+DEFAULT_COMPRESS_LEVEL = 9
+
+
+def native_image(result, pixel_size=None):
+    """The palette-mapped image at pixel resolution for a ConversionResult"""
+    if result.native is not None:
+        return result.native
+    if not pixel_size:
+        raise ValueError("This result has no native image; pass pixel_size")
+    # Older results: sample the centre of every block of the upscaled image
+    image = result.image
+    size = (max(1, image.width // pixel_size), max(1, image.height // pixel_size))
+    return image.resize(size, Image.Resampling.NEAREST)
+
+
+def to_indexed(image, palette):
+    """Mode P copy of an image whose colours come from palette.
+
+    Every opaque pixel gets the index of its (nearest) palette colour;
+    pixels with alpha 0 get one extra index that is marked transparent.
+    """
+    palette = np.asarray(palette, dtype=int).reshape(-1, 3)
+    has_alpha = 'A' in image.getbands()
+    arr = np.asarray(image.convert('RGBA' if has_alpha else 'RGB'))
+    height, width = arr.shape[:2]
+    rgb = arr[:, :, :3].reshape(-1, 3)
+
+    transparent = arr[:, :, 3].reshape(-1) == 0 if has_alpha else None
+    n_entries = len(palette) + (1 if transparent is not None and transparent.any() else 0)
+    if n_entries > MAX_INDEXED_COLORS:
+        raise ValueError(f"Indexed images hold at most {MAX_INDEXED_COLORS} colours, "
+                         f"this one needs {n_entries}")
+
+    indices = np.zeros(len(rgb), dtype=np.uint8)
+    if len(palette):
+        # Only the distinct colours need a nearest-colour search
+        packed = (rgb[:, 0].astype(np.int32) << 16) | (rgb[:, 1].astype(np.int32) << 8) | rgb[:, 2]
+        distinct, inverse = np.unique(packed, return_inverse=True)
+        distinct_rgb = np.stack([distinct >> 16, (distinct >> 8) & 255, distinct & 255], axis=1)
+        indices = assign_labels(distinct_rgb, palette).astype(np.uint8)[inverse.reshape(-1)]
+
+    entries = palette.astype(np.uint8)
+    transparency = None
+    if n_entries > len(palette):
+        transparency = len(palette)
+        indices[transparent] = transparency
+        entries = np.vstack([entries, np.zeros((1, 3), dtype=np.uint8)])
+
+    indexed = Image.fromarray(indices.reshape(height, width), 'P')
+    indexed.putpalette(entries.reshape(-1).tolist())
+    if transparency is not None:
+        indexed.info['transparency'] = transparency
+    return indexed
+
+
+def save_indexed(image, palette, path, scale=1, compress_level=DEFAULT_COMPRESS_LEVEL):
+    """Write image as an indexed PNG or GIF, enlarged by an integer scale"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in INDEXED_FORMATS:
+        raise ValueError(f"Indexed export writes .png or .gif, not {ext or path}")
+    if scale < 1 or int(scale) != scale:
+        raise ValueError(f"Scale must be a positive integer, got {scale}")
+    indexed = to_indexed(image, palette)
+    if scale > 1:
+        transparency = indexed.info.get('transparency')
+        indexed = indexed.resize((indexed.width * scale, indexed.height * scale),
+                                 Image.Resampling.NEAREST)
+        if transparency is not None:
+            indexed.info['transparency'] = transparency
+
+    if INDEXED_FORMATS[ext] == 'PNG':
+        # optimize forces level 9, so only ask for it at the top level
+        options = {'compress_level': compress_level, 'optimize': compress_level >= 9}
+    else:
+        options = {'optimize': True}
+    indexed.save(path, format=INDEXED_FORMATS[ext], **options)
+    return indexed
+
+
+def save_palette_files(base_path, palette, formats=PALETTE_FORMATS, name='PixLGEN'):
+    """Write palette next to base_path in each format; returns the paths"""
+    root = os.path.splitext(base_path)[0]
+    paths = []
+    for ext in formats:
+        path = root + ext
+        save_palette(path, palette, name=name)
+        paths.append(path)
+    return paths
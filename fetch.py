@@ -0,0 +1,309 @@
+"""Fetching source images over HTTP.
+
+All downloads go through one pooled ``requests.Session`` (keep-alive and
+retries on connection errors), stream the body in chunks with a byte cap
+and reject non-image responses from their headers before reading the
+body. Responses that carry an ETag or Last-Modified header are kept in an
+on-disk cache and revalidated with If-None-Match / If-Modified-Since, so a
+repeated fetch of an unchanged image costs one 304 round trip.
+
+fetch_many downloads a list of URLs on a small thread pool for batch jobs.
+requests is only imported once the first session is made, so importing
+this module for is_url and friends stays cheap.
+"""
+import hashlib
+import json
+import os
+import posixpath
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit, unquote
+
+DEFAULT_TIMEOUT = (5, 15)
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+POOL_SIZE = 8
+# Generic types some servers send for images; anything else non-image is refused
+ACCEPTED_CONTENT_TYPES = ('application/octet-stream', 'binary/octet-stream')
+USER_AGENT = 'PixLGEN'
+
+_default_fetcher = None
+_default_lock = threading.Lock()
+
+
+class FetchError(Exception):
+    """A URL could not be downloaded as an image"""
+
+
+def is_url(value):
+    return isinstance(value, str) and value.lower().startswith(('http://', 'https://'))
+
+
+def url_filename(url):
+    """File name for a URL: the last path segment, or a hash if there is none"""
+    name = posixpath.basename(unquote(urlsplit(url).path))
+    if not name or name in ('.', '..'):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+    return name
+
+
+def cache_root():
+    """Directory all of PixLGEN's on-disk caches live under"""
+    return os.environ.get('PIXLGEN_CACHE_DIR') or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+        'pixlgen')
+
+
+def default_cache_dir():
+    return os.path.join(cache_root(), 'http')
+
+
+def make_session(pool_size=POOL_SIZE, retries=2):
+    """Session with a connection pool big enough for pool_size concurrent fetches"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    session = requests.Session()
+    retry = Retry(total=retries, connect=retries, read=retries, status=retries,
+                  backoff_factor=0.3, status_forcelist=(502, 503, 504),
+                  allowed_methods=('GET', 'HEAD'))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+class HTTPCache:
+    """Response bodies on disk, keyed by URL, with their validators.
+
+    Each entry is a body file plus a small JSON file holding the ETag,
+    Last-Modified and Content-Type. Entries are evicted least recently used
+    first once the bodies exceed max_bytes. Writes go through a temporary
+    file and os.replace, so concurrent readers never see a partial entry.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + '.json', base + '.body'
+
+    def lookup(self, url):
+        """Cached metadata dict for url, or None"""
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url or not os.path.exists(body_path):
+            return None
+        return meta
+
+    def validators(self, url):
+        """Conditional request headers for a cached url"""
+        meta = self.lookup(url)
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def read(self, url):
+        """Cached body of url; refreshes its LRU position"""
+        _, body_path = self._paths(url)
+        with open(body_path, 'rb') as f:
+            body = f.read()
+        os.utime(body_path)
+        return body
+
+    def _write(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def store(self, url, response_headers, body):
+        """Cache body if the response can be revalidated later"""
+        etag = response_headers.get('ETag')
+        last_modified = response_headers.get('Last-Modified')
+        if not (etag or last_modified) or len(body) > self.max_bytes:
+            return
+        meta_path, body_path = self._paths(url)
+        meta = {'url': url, 'etag': etag, 'last_modified': last_modified,
+                'content_type': response_headers.get('Content-Type')}
+        # Body first: a metadata file always points at a complete body
+        self._write(body_path, body)
+        self._write(meta_path, json.dumps(meta).encode('utf-8'))
+        self.prune()
+
+    def prune(self):
+        """Evict least recently used bodies until the cache fits max_bytes"""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.body'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            for victim in (path, path[:-len('.body')] + '.json'):
+                try:
+                    os.remove(victim)
+                except OSError:
+                    pass
+            total -= size
+
+    def discard(self, url):
+        """Drop url's entry, metadata first so it is never found without its body"""
+        for path in self._paths(url):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(('.body', '.json')):
+                    os.remove(entry.path)
+
+
+class Fetcher:
+    """Download images through a pooled session and an optional HTTP cache"""
+
+    def __init__(self, session=None, cache=None, max_bytes=DEFAULT_MAX_BYTES,
+                 timeout=DEFAULT_TIMEOUT):
+        self.session = session or make_session()
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+
+    def _check_headers(self, url, response):
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type and not (content_type.startswith('image/')
+                                 or content_type in ACCEPTED_CONTENT_TYPES):
+            raise FetchError(f"{url} is not an image (Content-Type: {content_type})")
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            raise FetchError(f"{url} is {int(length)} bytes, "
+                             f"over the {self.max_bytes} byte limit")
+
+    def fetch(self, url, progress=None):
+        """Body of url as bytes.
+
+        progress(received, total) is called after every chunk; total is None
+        when the server sends no Content-Length. An exception raised by
+        progress aborts the download.
+        """
+        from requests import HTTPError, RequestException
+        headers = self.cache.validators(url) if self.cache else {}
+        response = self._get(url, headers)
+        if response.status_code == 304 and self.cache:
+            with response:
+                try:
+                    return self.cache.read(url)
+                except OSError:
+                    # Evicted after the validators were read: refetch it in full, once
+                    self.cache.discard(url)
+            response = self._get(url, {})
+
+        with response:
+            try:
+                response.raise_for_status()
+            except HTTPError as e:
+                raise FetchError(str(e)) from e
+            self._check_headers(url, response)
+
+            length = response.headers.get('Content-Length')
+            total = int(length) if length and length.isdigit() else None
+            body = bytearray()
+            try:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    body += chunk
+                    if len(body) > self.max_bytes:
+                        raise FetchError(f"{url} exceeds the {self.max_bytes} byte limit")
+                    if progress:
+                        progress(len(body), total)
+            except RequestException as e:
+                raise FetchError(str(e)) from e
+
+        body = bytes(body)
+        if self.cache:
+            self.cache.store(url, response.headers, body)
+        return body
+
+    def _get(self, url, headers):
+        from requests import RequestException
+        try:
+            return self.session.get(url, stream=True, timeout=self.timeout, headers=headers)
+        except RequestException as e:
+            raise FetchError(str(e)) from e
+
+    def fetch_many(self, urls, workers=POOL_SIZE):
+        """Download urls concurrently; yields (url, body, error) as each finishes.
+
+        error is None on success, otherwise a message and body is None. At
+        most 2 x workers downloads are queued at once.
+        """
+        with ThreadPoolExecutor(max_workers=workers,
+                                thread_name_prefix='pixlgen-fetch') as executor:
+            pending = {}
+            urls = iter(urls)
+            exhausted = False
+            while pending or not exhausted:
+                while not exhausted and len(pending) < workers * 2:
+                    try:
+                        url = next(urls)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[executor.submit(self.fetch, url)] = url
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    url = pending.pop(future)
+                    try:
+                        yield url, future.result(), None
+                    except Exception as e:
+                        yield url, None, f"{type(e).__name__}: {e}"
+
+    def close(self):
+        self.session.close()
+
+
+def get_fetcher():
+    """Process-wide Fetcher using the default on-disk cache"""
+    global _default_fetcher
+    with _default_lock:
+        if _default_fetcher is None:
+            try:
+                cache = HTTPCache()
+            except OSError:
+                # Read-only home directory: fetch without caching
+                cache = None
+            _default_fetcher = Fetcher(cache=cache)
+        return _default_fetcher
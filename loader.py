@@ -0,0 +1,112 @@
+"""Load source images straight to canvas size with reduced decoding.
+
+A 40-megapixel photo only needs a few thousand pixels once it is on a
+96x96 canvas, so before decoding we ask the decoder for something close to
+the target instead of the full image:
+
+* JPEG: ``Image.draft`` makes libjpeg decode at 1/2, 1/4 or 1/8 scale;
+* everything else (PNG, WebP, ...): decoded in full, but shrunk with
+  ``Image.reduce`` by a whole factor before the final LANCZOS resample.
+
+Either way the final resample still starts from at least
+RESIZE_REDUCING_GAP times the target size, as Image.thumbnail does.
+
+With a DiskCache the finished canvas is stored under the source's content
+hash, so loading the same file again skips decoding altogether.
+"""
+import time
+from dataclasses import asdict, dataclass
+
+from disk_cache import cache_key, source_digest
+from pipeline import RESIZE_REDUCING_GAP, PixelArtPipeline, fit_within, open_image
+from profiling import span
+
+
+@dataclass
+class LoadReport:
+    """What loading one image cost"""
+    format: str
+    source_size: tuple
+    decoded_size: tuple
+    decode_seconds: float
+    resize_seconds: float
+    # width x height x bands of the decoded image: the size of its pixel
+    # buffer, not a measured peak (the decoder's own allocations are not seen)
+    buffer_bytes: int
+
+    @property
+    def full_bytes(self):
+        """Buffer size a full-resolution decode would have needed"""
+        bands = self.buffer_bytes // max(1, self.decoded_size[0] * self.decoded_size[1])
+        return self.source_size[0] * self.source_size[1] * bands
+
+    def summary(self):
+        return (f"decoded {self.decoded_size[0]}×{self.decoded_size[1]} "
+                f"in {self.decode_seconds * 1000:.0f} ms, "
+                f"decoded buffer {self.buffer_bytes / 2**20:.1f} MB "
+                f"(full decode {self.full_bytes / 2**20:.1f} MB)")
+
+
+def decode_target(image_size, settings):
+    """Smallest decode size that still leaves headroom for a quality resample"""
+    canvas = (settings.canvas_width, settings.canvas_height)
+    target = fit_within(image_size, canvas) if settings.proportional_resize else canvas
+    return (int(target[0] * RESIZE_REDUCING_GAP), int(target[1] * RESIZE_REDUCING_GAP))
+
+
+def canvas_key(digest, settings, reduced=True):
+    """Disk cache name of a canvas: source content plus the settings resizing uses"""
+    return cache_key('canvas', digest, settings.canvas_width, settings.canvas_height,
+                     settings.proportional_resize, settings.transparent_background, reduced)
+
+
+def load_to_canvas(source, settings, reduced=True, cache=None):
+    """Open source and resize it onto the canvas.
+
+    Returns (canvas, decoded, report): the canvas-sized image, the decoded
+    (possibly draft-reduced) source and a LoadReport. With reduced=False the
+    source is fully decoded, which is only useful for comparisons. With a
+    DiskCache a previously loaded canvas is returned without decoding;
+    decoded is then None and the report describes the original load.
+    """
+    if cache is not None:
+        with span('cache_lookup'):
+            key = canvas_key(source_digest(source), settings, reduced)
+            hit = cache.load_image(key)
+        if hit is not None:
+            canvas, meta = hit
+            report = dict(meta['report'])
+            if 'decoded_bytes' in report:
+                # Stored before the field was renamed
+                report['buffer_bytes'] = report.pop('decoded_bytes')
+            return canvas, None, LoadReport(**dict(
+                report, source_size=tuple(report['source_size']),
+                decoded_size=tuple(report['decoded_size'])))
+
+    img = open_image(source)
+    img_format = getattr(img, 'format', None) or 'Unknown'
+    source_size = img.size
+
+    start = time.perf_counter()
+    with span('decode', format=img_format):
+        if reduced:
+            # Only JPEG implements draft; it's a no-op for other formats
+            img.draft(None, decode_target(img.size, settings))
+        img.load()
+    decoded_at = time.perf_counter()
+
+    canvas = PixelArtPipeline(settings).resize_to_canvas(img)
+    done = time.perf_counter()
+
+    report = LoadReport(
+        format=img_format,
+        source_size=source_size,
+        decoded_size=img.size,
+        decode_seconds=decoded_at - start,
+        resize_seconds=done - decoded_at,
+        buffer_bytes=img.width * img.height * len(img.getbands()),
+    )
+    if cache is not None:
+        with span('cache_store'):
+            cache.store_image(key, canvas, {'report': asdict(report)})
+    return canvas, img, report
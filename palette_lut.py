@@ -0,0 +1,171 @@
+"""Fast re-application of a fixed palette through a quantized RGB cube.
+
+A PaletteLUT precomputes, for every cell of a (2**bits)^3 RGB cube, the
+index of the nearest palette colour to the cell centre. Mapping an image is
+then one shift/or per pixel plus a single gather, independent of the
+palette size. With the default 5 bits (32^3 cells, 32 KB of uint8 indices;
+int32 for palettes of more than 256 colours) each pixel is matched at
+8-level precision per channel, which is well below the spacing of a
+64-colour palette.
+
+LUTs are cached per palette, so the GUI and batch paths can ask for one
+every time without rebuilding it.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from quantizers import assign_labels
+
+DEFAULT_BITS = 5
+# Palettes whose LUT stays cached
+LUT_CACHE_SIZE = 32
+
+_lut_cache = OrderedDict()
+_lut_lock = threading.Lock()
+
+
+class PaletteLUT:
+    """Nearest-palette-index lookup table over a quantized RGB cube"""
+
+    def __init__(self, palette, bits=DEFAULT_BITS):
+        if not 1 <= bits <= 8:
+            raise ValueError(f"bits must be between 1 and 8, got {bits}")
+        self.palette = np.asarray(palette, dtype=int).reshape(-1, 3)
+        if len(self.palette) == 0:
+            raise ValueError("Cannot build a lookup table for an empty palette")
+        self.bits = bits
+        self.shift = 8 - bits
+
+        # Nearest palette entry for the centre of every cube cell
+        levels = (np.arange(1 << bits) << self.shift) + ((1 << self.shift) >> 1)
+        r, g, b = np.meshgrid(levels, levels, levels, indexing='ij')
+        centres = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=1)
+        index_type = np.uint8 if len(self.palette) <= 256 else np.int32
+        self.table = assign_labels(centres, self.palette).astype(index_type)
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+    def cell_index(self, pixels):
+        """Flat cube cell of each (N, 3) uint8 pixel"""
+        px = np.asarray(pixels, dtype=np.uint8)
+        shift, bits = self.shift, self.bits
+        r = (px[..., 0] >> shift).astype(np.intp)
+        g = (px[..., 1] >> shift).astype(np.intp)
+        b = (px[..., 2] >> shift).astype(np.intp)
+        return (r << (2 * bits)) | (g << bits) | b
+
+    def map_indices(self, pixels):
+        """Palette index of every pixel; works on (N, 3) or (H, W, 3) arrays"""
+        return self.table[self.cell_index(pixels)]
+
+    def map_colors(self, pixels):
+        """Palette colour of every pixel, as uint8 with the input's shape"""
+        return self.palette.astype(np.uint8)[self.map_indices(pixels)]
+
+    def map_array(self, img_array):
+        """Map an HxWx3 or HxWx4 uint8 array; transparent pixels are left alone"""
+        out = np.array(img_array, dtype=np.uint8)
+        if out.shape[2] == 4:
+            mask = out[:, :, 3] > 0
+            out[mask, :3] = self.map_colors(out[mask, :3])
+        else:
+            out[:] = self.map_colors(out)
+        return out
+
+
+def get_palette_lut(palette, bits=DEFAULT_BITS):
+    """Shared PaletteLUT for palette, built on first use and kept in a small LRU"""
+    palette = np.ascontiguousarray(np.asarray(palette, dtype=np.int64).reshape(-1, 3))
+    key = (palette.tobytes(), bits)
+    with _lut_lock:
+        lut = _lut_cache.get(key)
+        if lut is not None:
+            _lut_cache.move_to_end(key)
+            return lut
+    lut = PaletteLUT(palette, bits)
+    with _lut_lock:
+        _lut_cache[key] = lut
+        while len(_lut_cache) > LUT_CACHE_SIZE:
+            _lut_cache.popitem(last=False)
+    return lut
+
+
+def _read_act(path):
+    """Adobe Color Table: 256 RGB triples, optionally followed by a colour count"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < 768:
+        raise ValueError(f"{path} is not an ACT file ({len(data)} bytes)")
+    count = int.from_bytes(data[768:770], 'big') if len(data) >= 770 else 256
+    table = np.frombuffer(data[:768], dtype=np.uint8).reshape(256, 3)
+    return [tuple(int(c) for c in color) for color in table[:count or 256]]
+
+
+def _read_gpl(f):
+    """GIMP palette: header lines, then 'R G B [name]' rows"""
+    colors = []
+    for line in f:
+        parts = line.split()
+        if len(parts) >= 3 and all(p.isdigit() for p in parts[:3]):
+            colors.append(tuple(int(p) for p in parts[:3]))
+    return colors
+
+
+def load_palette(path):
+    """Read a palette from .json (list of [r, g, b]), .gpl, .act or a text file of hex colours"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.act':
+        colors = _read_act(path)
+        if not colors:
+            raise ValueError(f"No colours found in palette file {path}")
+        return np.array(colors, dtype=int)
+    with open(path, encoding='utf-8') as f:
+        if ext == '.json':
+            data = json.load(f)
+            if isinstance(data, dict):
+                data = data.get('palette', [])
+            colors = [tuple(int(c) for c in color[:3]) for color in data]
+        elif ext == '.gpl':
+            colors = _read_gpl(f)
+        else:
+            colors = []
+            for line in f:
+                line = line.strip().lstrip('#')
+                if not line or line.startswith(';'):
+                    continue
+                colors.append(tuple(int(line[i:i + 2], 16) for i in (0, 2, 4)))
+    if not colors:
+        raise ValueError(f"No colours found in palette file {path}")
+    return np.array(colors, dtype=int)
+
+
+def save_palette(path, palette, name='PixLGEN'):
+    """Write a palette as .json, .gpl (GIMP), .act (Adobe) or, for other
+    extensions, as one hex colour per line"""
+    palette = np.asarray(palette, dtype=int).reshape(-1, 3)
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.act':
+        if len(palette) > 256:
+            raise ValueError(f"ACT files hold at most 256 colours, got {len(palette)}")
+        table = np.zeros((256, 3), dtype=np.uint8)
+        table[:len(palette)] = palette
+        with open(path, 'wb') as f:
+            # Colour count, then 0xFFFF for "no transparent index"
+            f.write(table.tobytes() + len(palette).to_bytes(2, 'big') + b'\xff\xff')
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        if ext == '.json':
+            json.dump({'palette': palette.tolist()}, f)
+        elif ext == '.gpl':
+            f.write(f"GIMP Palette\nName: {name}\nColumns: 8\n#\n")
+            for r, g, b in palette:
+                f.write(f"{r:3d} {g:3d} {b:3d}\t#{r:02x}{g:02x}{b:02x}\n")
+        else:
+            for r, g, b in palette:
+                f.write(f"{r:02x}{g:02x}{b:02x}\n")
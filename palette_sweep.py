@@ -0,0 +1,223 @@
+"""Precompute palette fits for a range of colour counts in the background.
+
+Every position of the colour-count slider is a different 'fit' stage key,
+so moving it meant a new clustering run on the next Convert. sweep_palettes
+fits the other counts ahead of time and puts each (palette, labels) in the
+pipeline's StageCache under the key a conversion at that count looks up
+(see PixelArtPipeline.cached_keys; warm-started fits keep their own keys);
+the slider then only re-runs the map and upscale stages.
+
+Each count reuses the work done for its neighbours where the engine allows:
+
+* median cut and Wu split greedily, so a single run up to the largest count
+  passes through the palette of every smaller one (HIERARCHICAL_QUANTIZERS);
+* the K-means engines warm-start every count from the neighbouring count's
+  centres. Going up, the cluster with the largest squared error gets a new
+  centre at its farthest pixel; going down, the two centres that are
+  cheapest to merge (Ward's criterion) become their weighted mean. One
+  warm-started fit replaces ten cold restarts. Two chains run outwards from
+  the current count, so the nearest counts are ready first;
+* the remaining engines fit every count independently, nearest first.
+
+The K-means chains and the independent fits run on a small thread pool;
+NumPy and scikit-learn release the GIL while they work. Each fit is held
+to one OpenMP thread, so the pool's fits and the interactive conversions
+don't each start a thread per core.
+"""
+import contextlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+
+import numpy as np
+
+from pipeline import SETTING_RANGES, PixelArtPipeline, _no_progress
+from quantizers import (HIERARCHICAL_QUANTIZERS, WARM_START_QUANTIZERS, assign_labels,
+                        sample_pixels, unique_colors)
+from stage_cache import image_fingerprint
+
+# The range of the colour-count slider in the settings panel
+SWEEP_COUNTS = range(SETTING_RANGES['color_count'][0],
+                     SETTING_RANGES['color_count'][1] + 1)
+# Fits running at once; one core is left for the Tk thread and Convert
+SWEEP_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+
+def single_threaded():
+    """Context limiting OpenMP in the calling thread to one thread.
+
+    OpenMP thread counts are per calling thread, so this leaves other
+    threads' conversions alone; BLAS limits are process wide, but
+    scikit-learn already runs K-means with one BLAS thread. A no-op
+    without threadpoolctl (see batch.limit_worker_threads).
+    """
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return contextlib.nullcontext()
+    return threadpool_limits(limits=1, user_api='openmp')
+
+
+def run_single_threaded(job):
+    with single_threaded():
+        return job()
+
+
+def sweep_order(counts, start):
+    """Distinct counts ordered by distance from start (start, start + 1, start - 1, ...)"""
+    return sorted(set(counts) | {start}, key=lambda count: (abs(count - start), count < start))
+
+
+def grow_palette(pixels, palette, labels):
+    """palette plus a centre at the farthest pixel of its worst cluster, or None"""
+    error = ((pixels.astype(np.float64) - palette[labels]) ** 2).sum(axis=1)
+    worst = labels == np.bincount(labels, error, minlength=len(palette)).argmax()
+    if not error[worst].any():
+        # Every pixel sits on its centre already
+        return None
+    farthest = np.flatnonzero(worst)[error[worst].argmax()]
+    return np.vstack([palette, pixels[farthest]])
+
+
+def shrink_palette(pixels, palette, labels):
+    """palette with the two centres that are cheapest to merge replaced by their mean"""
+    counts = np.bincount(labels, minlength=len(palette)).astype(np.float64)
+    distance = ((palette[:, None] - palette[None]) ** 2).sum(axis=2)
+    pair_count = counts[:, None] + counts[None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Increase in squared error from merging each pair; 0 if either is unused
+        cost = np.nan_to_num(distance * counts[:, None] * counts[None] / pair_count)
+    cost[np.diag_indices(len(palette))] = np.inf
+    i, j = np.unravel_index(cost.argmin(), cost.shape)
+    if pair_count[i, j]:
+        merged = (palette[i] * counts[i] + palette[j] * counts[j]) / pair_count[i, j]
+    else:
+        merged = (palette[i] + palette[j]) / 2
+    return np.vstack([np.delete(palette, [i, j], axis=0), merged])
+
+
+def warm_start(pixels, palette, labels, count):
+    """Initial centres for a count-colour fit from a neighbouring fit, or None"""
+    if len(pixels) == 0 or len(palette) == 0:
+        return None
+    palette = np.asarray(palette, dtype=np.float64)
+    while len(palette) != count:
+        resize = grow_palette if len(palette) < count else shrink_palette
+        palette = resize(pixels, palette, labels)
+        if palette is None:
+            return None
+        labels = assign_labels(pixels, palette)
+    return palette
+
+
+def hierarchical_fits(quantizer, pixels, counts, max_samples=0):
+    """(count, (palette, labels)) for every count from one run of a greedy engine.
+
+    Matches quantize_colors: fitted on distinct colours (or a sample of at
+    most max_samples pixels), and when there are no more distinct colours
+    than the count they are the palette.
+    """
+    colors, weights, inverse = unique_colors(pixels)
+    fit_colors, fit_weights = colors, weights
+    if max_samples and len(colors) > max_samples:
+        fit_colors, fit_weights, _ = unique_colors(sample_pixels(pixels, max_samples))
+    fitted = [count for count in counts if count < len(fit_colors)]
+    levels = {}
+    if fitted:
+        levels = HIERARCHICAL_QUANTIZERS[quantizer](fit_colors, fitted, fit_weights)
+    for count in counts:
+        if len(colors) <= count:
+            yield count, (colors.astype(int), inverse)
+        elif len(fit_colors) <= count:
+            palette = fit_colors.astype(int)
+            yield count, (palette, assign_labels(colors, palette)[inverse])
+        else:
+            yield count, (levels[count], assign_labels(colors, levels[count])[inverse])
+
+
+def sweep_palettes(pipeline, image, counts=SWEEP_COUNTS, progress=None,
+                   workers=SWEEP_WORKERS):
+    """Fit the pipeline's palette at every colour count into its StageCache.
+
+    pipeline supplies the cache and every setting; its color_count is where
+    the sweep starts. image is the canvas (see resize_to_canvas). Counts
+    already cached are skipped. progress(fraction, message) is called
+    before each fit and may raise to stop the sweep. Returns the number of
+    counts fitted.
+    """
+    cache = pipeline.cache
+    if cache is None or pipeline.palette is not None:
+        raise ValueError("A palette sweep needs a stage cache and no fixed palette")
+    progress = progress or _no_progress
+    settings = pipeline.settings
+    source_key = image_fingerprint(image)
+    small_img = cache.get_or_compute(pipeline.stage_keys(source_key)['adjust'],
+                                     lambda: pipeline.reduce(image))
+    pixels = pipeline.palette_pixels(small_img)
+
+    def pipeline_for(count, init=None):
+        return PixelArtPipeline(replace(settings, color_count=count), cache=cache,
+                                init_palette=init)
+
+    def cached(count):
+        keys, _ = pipeline_for(count).cached_keys(source_key)
+        return cache.get(keys['fit'])
+
+    start = settings.color_count
+    order = sweep_order(counts, start)
+    pending = [count for count in order if cached(count) is None]
+    if not pending:
+        return 0
+
+    lock = threading.Lock()
+    done = [0]
+
+    def report(count):
+        with lock:
+            fraction = done[0] / len(pending)
+            done[0] += 1
+        progress(fraction, f"Fitting {count} colours")
+
+    def fit(count, init=None):
+        report(count)
+        count_pipeline = pipeline_for(count, init)
+        keys, init = count_pipeline.cached_keys(source_key)
+        return count_pipeline.cached_fit(small_img, keys, init)
+
+    if settings.quantizer in HIERARCHICAL_QUANTIZERS:
+        def run_levels():
+            levels = hierarchical_fits(settings.quantizer, pixels, pending,
+                                       settings.fit_samples)
+            for count in pending:
+                # Each level's labels are assigned lazily, so a cancel stops here
+                report(count)
+                _, value = next(levels)
+                cache.put(pipeline_for(count).stage_keys(source_key)['fit'], value)
+        jobs = [run_levels]
+    elif settings.quantizer in WARM_START_QUANTIZERS:
+        anchor = cached(start)
+        if anchor is None:
+            anchor = run_single_threaded(lambda: fit(start))
+
+        def chain(counts):
+            def run_chain():
+                palette, labels = anchor
+                for count in counts:
+                    value = cached(count)
+                    if value is None:
+                        value = fit(count, warm_start(pixels, palette, labels, count))
+                    palette, labels = value
+            return run_chain
+        jobs = [chain([count for count in order if count > start]),
+                chain([count for count in order if count < start])]
+    else:
+        jobs = [lambda count=count: fit(count) for count in pending]
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pixlgen-sweep")
+    try:
+        for future in [pool.submit(run_single_threaded, job) for job in jobs]:
+            future.result()
+    finally:
+        pool.shutdown(cancel_futures=True)
+    return len(pending)
@@ -0,0 +1,459 @@
+"""Headless pixel art conversion engine.
+
+Everything in here works on PIL images and numpy arrays only, so the
+conversion can run in worker processes, servers or benchmarks without a
+Tk root. The GUI in PixLGEN.py builds a ConversionSettings from its
+sliders and delegates to PixelArtPipeline.
+"""
+import hashlib
+import math
+from dataclasses import dataclass, field, asdict
+
+import numpy as np
+from PIL import Image
+
+from dithering import get_ditherer
+from downsampling import get_downsampler, reduce_blocks
+from quantizers import WARM_START_QUANTIZERS, assign_labels, quantize_colors, quantize_wu
+from palette_lut import get_palette_lut
+from profiling import traced
+from stage_cache import image_fingerprint
+
+# Shrink by whole factors (Image.reduce / JPEG draft) until within this
+# factor of the target, then finish with LANCZOS - same as Image.thumbnail
+RESIZE_REDUCING_GAP = 2.0
+
+# Pixels sampled for the palette fit of a live-preview draft
+DRAFT_SAMPLE_SIZE = 4096
+
+# (min, max) of the settings panel's spinboxes and sliders; settings that
+# arrive from outside the GUI are checked against them (see server.py)
+SETTING_RANGES = {
+    'canvas_width': (16, 512),
+    'canvas_height': (16, 512),
+    'pixel_size': (2, 20),
+    'color_count': (4, 64),
+    'brightness': (0.3, 2.0),
+    'contrast': (0.3, 2.0),
+}
+
+
+@dataclass(frozen=True)
+class ConversionSettings:
+    """All knobs of a conversion, mirroring the GUI settings panel"""
+    pixel_size: int = 8
+    color_count: int = 16
+    brightness: float = 1.0
+    contrast: float = 1.0
+    canvas_width: int = 96
+    canvas_height: int = 96
+    proportional_resize: bool = True
+    transparent_background: bool = False
+    quantizer: str = 'kmeans'
+    # Distinct-colour threshold for the palette fit (0 = no cap): above it the
+    # fit runs on a fixed random sample of this many pixels, and every pixel
+    # is assigned to its nearest colour afterwards
+    fit_samples: int = 20000
+    # Dithering applied when mapping pixels to the palette (see dithering.py)
+    dither: str = 'none'
+    # How each pixel_size block becomes one pixel (see downsampling.py)
+    downsample_mode: str = 'nearest'
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build settings from a dict, ignoring unknown keys"""
+        known = {name: data[name] for name in cls.__dataclass_fields__ if name in data}
+        return cls(**known)
+
+
+@dataclass
+class ConversionResult:
+    """Output of a conversion: the upscaled pixel art and its palette"""
+    image: Image.Image
+    palette: np.ndarray = field(default_factory=lambda: np.empty((0, 3), dtype=int))
+    # Stage cache key of the result, set when converted through a StageCache
+    cache_key: tuple = None
+    # The palette-mapped image at pixel resolution, before upscaling
+    native: Image.Image = None
+
+
+IDENTITY_LUT = np.arange(256, dtype=np.uint8)
+
+
+def adjustment_lut(brightness, contrast):
+    """256-entry uint8 table mapping a channel value through brightness then contrast.
+
+    Computed with the same float32 arithmetic the per-pixel version used,
+    so applying the table gives identical results.
+    """
+    values = np.arange(256, dtype=np.float32)
+    values *= brightness
+    values = (values - 128) * contrast + 128
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+
+def _no_progress(fraction, message=""):
+    pass
+
+
+def open_image(source):
+    """Open an image from a file path or file-like object.
+
+    WebP files that Pillow cannot decode fall back to the webp package.
+    """
+    if isinstance(source, str) and source.lower().endswith('.webp'):
+        try:
+            return Image.open(source)
+        except Exception as webp_error:
+            # Try using webp library as fallback
+            try:
+                import webp
+                # Convert WebP to PIL Image using webp library
+                return Image.fromarray(webp.load_image(source))
+            except ImportError:
+                raise Exception("WebP support not available. Try: pip install --upgrade Pillow")
+            except Exception:
+                raise Exception(f"WebP loading failed. Original error: {webp_error}")
+    return Image.open(source)
+
+
+def fit_within(size, bounds):
+    """Largest aspect-preserving size no bigger than bounds (never upscales).
+
+    Rounds the same way Image.thumbnail does.
+    """
+    width, height = size
+    x, y = bounds
+    if x >= width and y >= height:
+        return size
+
+    def round_aspect(number, key):
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    aspect = width / height
+    if x / y >= aspect:
+        x = round_aspect(y * aspect, key=lambda n: abs(aspect - n / y))
+    else:
+        y = round_aspect(x / aspect, key=lambda n: 0 if n == 0 else abs(aspect - x / n))
+    return (x, y)
+
+
+def as_image(source):
+    """Accept a PIL image or an HxWx3 / HxWx4 uint8 array"""
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, np.ndarray):
+        if source.ndim != 3 or source.shape[2] not in (3, 4):
+            raise ValueError(f"Expected an HxWx3 or HxWx4 array, got shape {source.shape}")
+        mode = 'RGBA' if source.shape[2] == 4 else 'RGB'
+        return Image.fromarray(source.astype(np.uint8, copy=False), mode)
+    raise TypeError(f"Unsupported image source: {type(source).__name__}")
+
+
+class PixelArtPipeline:
+    """Convert images to pixel art according to a ConversionSettings.
+
+    The individual stages (resize_to_canvas, downsample, adjust, quantize,
+    upscale) are public so they can be timed or reused on their own.
+    """
+
+    def __init__(self, settings=None, cache=None, palette=None, init_palette=None):
+        self.settings = settings or ConversionSettings()
+        # Optional StageCache; when set, convert() reuses unchanged stage outputs
+        self.cache = cache
+        # Optional fixed (k, 3) palette; when set, no palette is fitted and
+        # pixels are mapped through its cached PaletteLUT instead
+        self.palette = None if palette is None else np.asarray(palette, dtype=int).reshape(-1, 3)
+        # Optional previous palette to warm-start K-means style quantizers from.
+        # Ignored when its size doesn't match the colour count; a warm-started
+        # fit is cached under its own key (see stage_keys and cached_keys).
+        self.init_palette = init_palette
+
+    @traced('resize')
+    def resize_to_canvas(self, image):
+        """Resize image to fit canvas size with optional proportional scaling"""
+        s = self.settings
+        image = as_image(image)
+        canvas_w, canvas_h = s.canvas_width, s.canvas_height
+
+        if s.proportional_resize:
+            # Proportional resize - fit image within canvas bounds
+            size = fit_within(image.size, (canvas_w, canvas_h))
+            if size != image.size:
+                image = image.resize(size, Image.Resampling.LANCZOS,
+                                     reducing_gap=RESIZE_REDUCING_GAP)
+
+            x = (canvas_w - image.width) // 2
+            y = (canvas_h - image.height) // 2
+            # Create new image with canvas size and transparent/white background
+            if s.transparent_background:
+                new_image = Image.new('RGBA', (canvas_w, canvas_h), (0, 0, 0, 0))
+                if image.mode != 'RGBA':
+                    image = image.convert('RGBA')
+                new_image.paste(image, (x, y), image)
+            else:
+                new_image = Image.new('RGB', (canvas_w, canvas_h), (255, 255, 255))
+                if image.mode == 'RGBA':
+                    new_image.paste(image, (x, y), image)
+                else:
+                    new_image.paste(image.convert('RGB'), (x, y))
+            return new_image
+
+        # Non-proportional resize - stretch to exact canvas size
+        if s.transparent_background and image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        elif not s.transparent_background and image.mode != 'RGB':
+            image = image.convert('RGB')
+        return image.resize((canvas_w, canvas_h), Image.Resampling.LANCZOS,
+                            reducing_gap=RESIZE_REDUCING_GAP)
+
+    @traced('adjust')
+    def adjust(self, image):
+        """Apply brightness and contrast to the colour channels, keeping alpha"""
+        s = self.settings
+        lut = adjustment_lut(s.brightness, s.contrast)
+        if np.array_equal(lut, IDENTITY_LUT):
+            return image
+        # One table per band; alpha (if any) maps through the identity
+        table = np.concatenate([lut] * 3 + [IDENTITY_LUT] * (len(image.getbands()) - 3))
+        return image.point(table.tolist())
+
+    @traced('downsample')
+    def downsample(self, image):
+        """Shrink the image by pixel_size to create the pixel effect.
+
+        'nearest' keeps one pixel per block; the other modes reduce every
+        block as a whole.
+        """
+        s = self.settings
+        pixel_size = s.pixel_size
+        size = (max(1, image.width // pixel_size), max(1, image.height // pixel_size))
+        reducer = get_downsampler(s.downsample_mode)
+        if reducer is None:
+            return image.resize(size, Image.Resampling.NEAREST)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB')
+        return Image.fromarray(reduce_blocks(np.asarray(image), pixel_size, size, reducer),
+                               image.mode)
+
+    def warm_start_palette(self, init=None):
+        """init (default init_palette) if it can warm-start this fit, else None.
+
+        Only the K-means engines take one, and only with color_count centres.
+        """
+        s = self.settings
+        init = self.init_palette if init is None else init
+        if init is None or self.palette is not None or s.quantizer not in WARM_START_QUANTIZERS \
+                or len(init) != s.color_count:
+            return None
+        return init
+
+    @traced('fit')
+    def fit_palette(self, small_img, init=None):
+        """Fit the palette with the configured quantizer; returns (palette, labels).
+
+        For RGBA images only non-transparent pixels are clustered and labels
+        cover just those pixels. init overrides init_palette as the warm
+        start (see warm_start_palette).
+        """
+        s = self.settings
+        pixels = self.palette_pixels(small_img)
+        if len(pixels) == 0:
+            # All pixels are transparent
+            return np.empty((0, 3), dtype=int), np.empty(0, dtype=np.intp)
+        if self.palette is not None:
+            return self.palette, get_palette_lut(self.palette).map_indices(pixels)
+
+        init = self.warm_start_palette(init)
+        # Fitted on distinct colours, or skipped when there are few enough
+        return quantize_colors(s.quantizer, pixels, s.color_count, init=init,
+                               max_samples=s.fit_samples)
+
+    def palette_pixels(self, small_img):
+        """RGB rows the palette is fitted to: every pixel, or only opaque ones for RGBA"""
+        img_array = np.asarray(small_img)
+        if small_img.mode == 'RGBA':
+            return img_array[img_array[:, :, 3] > 0][:, :3]
+        return img_array.reshape(-1, 3)
+
+    @traced('map')
+    def apply_palette(self, small_img, palette, labels):
+        """Replace every pixel with its palette colour.
+
+        With a dither mode set, labels are recomputed by the ditherer.
+        """
+        img_array = np.array(small_img)
+        ditherer = get_ditherer(self.settings.dither)
+        if small_img.mode == 'RGBA':
+            mask = img_array[:, :, 3] > 0
+            box = small_img.getbbox()
+            if len(palette) and box:
+                if ditherer is not None:
+                    # Only the opaque bounding box needs dithering
+                    x0, y0, x1, y1 = box
+                    crop = (slice(y0, y1), slice(x0, x1))
+                    labels = ditherer(img_array[crop][:, :, :3], palette, mask[crop],
+                                      origin=(y0, x0))[mask[crop]]
+                img_array[mask, :3] = palette[labels]
+            return Image.fromarray(img_array, 'RGBA')
+        if ditherer is not None and len(palette):
+            labels = ditherer(img_array, palette)
+        new_img_array = palette[labels].reshape(img_array.shape)
+        return Image.fromarray(new_img_array.astype(np.uint8))
+
+    def reduce(self, image):
+        """Downsampled, colour-adjusted canvas: the pixels the palette is fitted to"""
+        return self.adjust(self.downsample(image))
+
+    def quantize(self, small_img):
+        """Reduce colours with the configured quantizer; returns (image, palette)"""
+        palette, labels = self.fit_palette(small_img)
+        return self.apply_palette(small_img, palette, labels), palette
+
+    @traced('upscale')
+    def upscale(self, image):
+        """Scale the quantized image back up to canvas size"""
+        s = self.settings
+        return image.resize((s.canvas_width, s.canvas_height), Image.Resampling.NEAREST)
+
+    def convert(self, image, progress=None):
+        """Convert a canvas-sized image (see resize_to_canvas) to pixel art.
+
+        progress(fraction, message) is called before each stage; it may
+        raise to abort the conversion between stages.
+        """
+        image = as_image(image)
+        progress = progress or _no_progress
+        if self.cache is not None:
+            return self._convert_cached(image, progress)
+        progress(0.0, "Downsampling")
+        small_img = self.downsample(image)
+        progress(0.1, "Adjusting colours")
+        small_img = self.adjust(small_img)
+        progress(0.2, "Fitting palette")
+        palette, labels = self.fit_palette(small_img)
+        progress(0.8, "Mapping palette")
+        pixel_img = self.apply_palette(small_img, palette, labels)
+        progress(0.9, "Upscaling")
+        result = ConversionResult(self.upscale(pixel_img), palette, native=pixel_img)
+        progress(1.0, "Done")
+        return result
+
+    def stage_keys(self, source_key, init=None):
+        """Cache key of every stage; each only includes the settings it depends on.
+
+        Adjusting is a per-pixel lookup and NEAREST downsampling only picks
+        pixels, so the two commute; downsampling first adjusts pixel_size^2
+        times fewer pixels. (The block modes adjust the reduced colours.)
+
+        A fit warm-started from init is keyed by a digest of those centres,
+        so it never stands in for a cold fit. 'init' is the key under which
+        the cache remembers that warm start (see cached_keys).
+        """
+        s = self.settings
+        downsample = ('downsample', source_key, s.pixel_size, s.downsample_mode)
+        adjust = ('adjust', downsample, s.brightness, s.contrast)
+        if self.palette is not None:
+            fit = ('fit', adjust, 'fixed', self.palette.tobytes())
+        else:
+            fit = ('fit', adjust, s.color_count, s.quantizer, s.fit_samples)
+        warm_start = ('init', fit)
+        if init is not None:
+            centres = np.asarray(init, dtype=np.float64).tobytes()
+            fit += ('init', hashlib.blake2b(centres, digest_size=16).hexdigest())
+        apply = ('map', fit, s.dither)
+        upscale = ('upscale', apply, s.canvas_width, s.canvas_height)
+        return {'adjust': adjust, 'downsample': downsample, 'fit': fit,
+                'map': apply, 'upscale': upscale, 'init': warm_start}
+
+    def cached_keys(self, source_key):
+        """(stage keys, warm start) of a conversion through the cache.
+
+        A cold fit already in the cache is used as is. Otherwise the fit
+        starts from the centres an earlier warm-started fit at these
+        settings began from, so that fit is found again, or else from
+        init_palette. The remembered centres live only in memory: the disk
+        cache persists 'fit' keys alone, so a later session fits cold.
+        """
+        keys = self.stage_keys(source_key)
+        if self.palette is not None or self.cache.get(keys['fit']) is not None:
+            return keys, None
+        init = self.cache.get(keys['init'])
+        if init is None:
+            init = self.warm_start_palette()
+        if init is None:
+            return keys, None
+        return self.stage_keys(source_key, init), init
+
+    def cached_fit(self, small_img, keys, init=None):
+        """Fit through the cache under keys from cached_keys, remembering a warm start"""
+        value = self.cache.get_or_compute(keys['fit'], lambda: self.fit_palette(small_img, init))
+        if init is not None:
+            self.cache.put(keys['init'], np.array(init, dtype=np.float64))
+        return value
+
+    def _cached_reduce(self, image, keys, progress):
+        cache = self.cache
+        small_img = cache.get(keys['adjust'])
+        if small_img is None:
+            progress(0.0, "Downsampling")
+            raw = cache.get_or_compute(keys['downsample'], lambda: self.downsample(image))
+            progress(0.1, "Adjusting colours")
+            small_img = cache.get_or_compute(keys['adjust'], lambda: self.adjust(raw))
+        return small_img
+
+    def _convert_cached(self, image, progress):
+        cache = self.cache
+        keys, init = self.cached_keys(image_fingerprint(image))
+        small_img = self._cached_reduce(image, keys, progress)
+        progress(0.2, "Fitting palette")
+        palette, labels = self.cached_fit(small_img, keys, init)
+        progress(0.8, "Mapping palette")
+        pixel_img = cache.get_or_compute(
+            keys['map'], lambda: self.apply_palette(small_img, palette, labels))
+        progress(0.9, "Upscaling")
+        upscaled = cache.get_or_compute(keys['upscale'], lambda: self.upscale(pixel_img))
+        progress(1.0, "Done")
+        return ConversionResult(upscaled, palette, keys['upscale'], native=pixel_img)
+
+    def run(self, image, progress=None):
+        """Resize an arbitrary source image to the canvas and convert it"""
+        return self.convert(self.resize_to_canvas(image), progress)
+
+    @traced('draft')
+    def draft(self, image, palette=None, max_samples=DRAFT_SAMPLE_SIZE):
+        """Cheap approximation of convert() for live previews.
+
+        Reapplies palette (or the pipeline's fixed palette) through its
+        cached PaletteLUT when there is one; otherwise fits a Wu palette to
+        at most max_samples evenly spaced pixels and maps every pixel to its
+        nearest colour. The result carries no cache key, unless the cache
+        already holds the real fit (e.g. from a palette sweep, see
+        palette_sweep.py), in which case the draft is the exact conversion.
+        """
+        image = as_image(image)
+        if self.cache is not None:
+            keys, _ = self.cached_keys(image_fingerprint(image))
+            if palette is None and self.palette is None \
+                    and self.cache.get(keys['fit']) is not None:
+                return self._convert_cached(image, _no_progress)
+            small_img = self._cached_reduce(image, keys, _no_progress)
+        else:
+            small_img = self.reduce(image)
+
+        if palette is None:
+            palette = self.palette
+        pixels = self.palette_pixels(small_img)
+        if len(pixels) == 0:
+            palette, labels = np.empty((0, 3), dtype=int), np.empty(0, dtype=np.intp)
+        elif palette is None or len(palette) == 0:
+            step = max(1, len(pixels) // max_samples)
+            palette, _ = quantize_wu(pixels[::step], self.settings.color_count)
+            labels = assign_labels(pixels, palette)
+        else:
+            labels = get_palette_lut(palette).map_indices(pixels)
+        pixel_img = self.apply_palette(small_img, np.asarray(palette), labels)
+        return ConversionResult(self.upscale(pixel_img), np.asarray(palette), native=pixel_img)
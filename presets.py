@@ -0,0 +1,114 @@
+"""Render one source at several canvas and pixel sizes in a single pass.
+
+Shipping an asset at every preset canvas size used to mean one load,
+resize and palette fit per size. render_presets instead:
+
+1. decodes the source once, at the resolution the largest target needs
+   (JPEG draft mode, see loader.py);
+2. converts the target with the most art pixels normally, which fits the
+   palette once;
+3. converts every other target with that palette as a fixed palette, so it
+   is mapped through the cached PaletteLUT and no clustering runs.
+
+Every extra size therefore only costs a resize from the decoded image and
+a table lookup, and all sizes share exactly the same colours.
+"""
+import os
+from dataclasses import dataclass, replace
+
+from loader import decode_target
+from pipeline import PixelArtPipeline, _no_progress, open_image
+from profiling import span
+
+# Canvas sizes offered by the preset buttons in the settings panel
+CANVAS_PRESETS = ((32, 32), (64, 64), (96, 96), (128, 128), (256, 256))
+
+
+@dataclass(frozen=True)
+class RenderTarget:
+    """One output of a multi-preset render"""
+    canvas_width: int
+    canvas_height: int
+    pixel_size: int
+
+    @property
+    def label(self):
+        return f"{self.canvas_width}x{self.canvas_height}_px{self.pixel_size}"
+
+    @property
+    def art_pixels(self):
+        """Pixels of the downsampled image the palette would be fitted to"""
+        return (max(1, self.canvas_width // self.pixel_size)
+                * max(1, self.canvas_height // self.pixel_size))
+
+    def apply(self, settings):
+        """settings with this target's canvas and pixel size"""
+        return replace(settings, canvas_width=self.canvas_width,
+                       canvas_height=self.canvas_height, pixel_size=self.pixel_size)
+
+
+def preset_targets(pixel_sizes, canvases=CANVAS_PRESETS):
+    """Every canvas at every pixel size, smallest canvas first"""
+    return [RenderTarget(w, h, p) for w, h in canvases for p in pixel_sizes]
+
+
+def parse_target(spec, pixel_size):
+    """RenderTarget from 'WxH' (with the given pixel size) or 'WxH:P'"""
+    try:
+        canvas, _, size = spec.lower().replace('×', 'x').partition(':')
+        w, h = canvas.split('x')
+        target = RenderTarget(int(w), int(h), int(size) if size else pixel_size)
+    except ValueError:
+        raise ValueError(f"Preset must look like 64x64 or 64x64:4, got {spec!r}")
+    if min(target.canvas_width, target.canvas_height, target.pixel_size) < 1:
+        raise ValueError(f"Preset sizes must be positive, got {spec!r}")
+    return target
+
+
+def target_path(output_path, target):
+    """output_path with the target's label added: sprite.png -> sprite_64x64_px4.png"""
+    root, ext = os.path.splitext(output_path)
+    return f"{root}_{target.label}{ext or '.png'}"
+
+
+def render_presets(source, settings, targets, palette=None, progress=None):
+    """Decode source once and convert it for every target with one palette.
+
+    source is a path or file-like object, settings supplies everything but
+    the canvas and pixel size, and palette (optional) is a fixed palette
+    used for every target instead of fitting one. progress(fraction,
+    message) is called before each target. Returns a list of
+    (target, ConversionResult) in the order of targets.
+    """
+    targets = list(dict.fromkeys(targets))
+    if not targets:
+        raise ValueError("No render targets given")
+    progress = progress or _no_progress
+
+    progress(0.0, "Decoding image")
+    img = open_image(source)
+    with span('decode', format=getattr(img, 'format', None) or 'Unknown'):
+        # Draft large enough for every target in both dimensions, since the
+        # widest and the tallest may differ; no-op except for JPEG
+        sizes = [decode_target(img.size, t.apply(settings)) for t in targets]
+        img.draft(None, (max(w for w, _ in sizes), max(h for _, h in sizes)))
+        img.load()
+
+    results = {}
+    if palette is None:
+        # The largest target sees the most detail; its ordinary fit is the shared palette
+        fit_target = max(targets, key=lambda t: t.art_pixels)
+        progress(0.1, f"Fitting palette at {fit_target.label}")
+        pipeline = PixelArtPipeline(fit_target.apply(settings))
+        results[fit_target] = pipeline.convert(pipeline.resize_to_canvas(img))
+        # An all-transparent canvas fits nothing; let the other targets fit their own
+        if len(results[fit_target].palette):
+            palette = results[fit_target].palette
+
+    remaining = [t for t in targets if t not in results]
+    for i, target in enumerate(remaining):
+        progress(0.5 + 0.5 * i / len(remaining), f"Rendering {target.label}")
+        pipeline = PixelArtPipeline(target.apply(settings), palette=palette)
+        results[target] = pipeline.convert(pipeline.resize_to_canvas(img))
+    progress(1.0, "Done")
+    return [(target, results[target]) for target in targets]
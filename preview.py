@@ -0,0 +1,126 @@
+"""Cached preview rendering for the Tk canvases.
+
+A PreviewRenderer owns one canvas image item. For a given image and canvas
+size it scales the image once, composites it onto a checkerboard (for
+images with transparency) in Pillow and hands Tk a single PhotoImage,
+instead of one canvas rectangle per checker square. The result is reused
+until the image or the canvas size changes; <Configure> events are
+throttled so dragging the window edge redraws at most every few frames.
+"""
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageTk
+
+from pipeline import fit_within
+from profiling import span
+
+CHECKER_SQUARE = 10
+CHECKER_COLORS = ((0xF0, 0xF0, 0xF0), (0xE0, 0xE0, 0xE0))
+# Minimum time between redraws while the canvas is being resized
+CONFIGURE_THROTTLE_MS = 50
+# Canvas sizes whose PhotoImage is kept for the current image
+PHOTO_CACHE_SIZE = 4
+# Size used before the canvas has been laid out
+FALLBACK_SIZE = (400, 400)
+
+
+@lru_cache(maxsize=8)
+def checkerboard(width, height, square=CHECKER_SQUARE):
+    """RGBA checkerboard image of the given size (cached; don't modify)"""
+    ys = (np.arange(height) // square)[:, None]
+    xs = (np.arange(width) // square)[None, :]
+    light, dark = (np.array(c + (255,), dtype=np.uint8) for c in CHECKER_COLORS)
+    board = np.where(((xs + ys) % 2)[:, :, None].astype(bool), dark, light)
+    return Image.fromarray(board, 'RGBA')
+
+
+class PreviewRenderer:
+    """Draws one image centred on a Tk canvas through a cached PhotoImage"""
+
+    def __init__(self, canvas, resample=Image.Resampling.LANCZOS):
+        self.canvas = canvas
+        self.resample = resample
+        self.image = None
+        self._photos = OrderedDict()
+        self._item = None
+        self._shown = None
+        self._pending = None
+        canvas.bind('<Configure>', self._on_configure, add='+')
+
+    def canvas_size(self):
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if width <= 1 or height <= 1:
+            # Canvas not yet rendered
+            return FALLBACK_SIZE
+        return width, height
+
+    def show(self, image):
+        """Display image; passing the same image object again is free"""
+        if image is not self.image:
+            self.image = image
+            self._photos.clear()
+        self.render()
+
+    def clear(self):
+        self.image = None
+        self._photos.clear()
+        self._shown = None
+        if self._item is not None:
+            self.canvas.delete(self._item)
+            self._item = None
+
+    def compose(self, size):
+        """The composited preview for a canvas of size, as a PIL image"""
+        with span('preview_resize'):
+            width, height = size
+            scaled = self.image
+            target = fit_within(scaled.size, size)
+            if target != scaled.size:
+                scaled = scaled.resize(target, self.resample)
+        if 'A' not in scaled.getbands():
+            return scaled
+        with span('preview_composite'):
+            # Transparent images get a checkerboard behind the whole canvas
+            composite = checkerboard(width, height).copy()
+            offset = ((width - scaled.width) // 2, (height - scaled.height) // 2)
+            composite.alpha_composite(scaled.convert('RGBA'), offset)
+            return composite.convert('RGB')
+
+    def render(self):
+        """Draw the current image at the current canvas size, reusing caches"""
+        if self.image is None:
+            return
+        size = self.canvas_size()
+        photo = self._photos.get(size)
+        if photo is None:
+            composed = self.compose(size)
+            with span('photoimage'):
+                photo = ImageTk.PhotoImage(composed)
+            self._photos[size] = photo
+            while len(self._photos) > PHOTO_CACHE_SIZE:
+                self._photos.popitem(last=False)
+        else:
+            self._photos.move_to_end(size)
+        if (photo, size) == self._shown:
+            return
+
+        with span('draw'):
+            x = (size[0] - photo.width()) // 2
+            y = (size[1] - photo.height()) // 2
+            if self._item is None:
+                self._item = self.canvas.create_image(x, y, anchor="nw", image=photo,
+                                                      tags="image")
+            else:
+                self.canvas.coords(self._item, x, y)
+                self.canvas.itemconfigure(self._item, image=photo)
+        self._shown = (photo, size)
+
+    def _on_configure(self, event):
+        if self.image is not None and self._pending is None:
+            self._pending = self.canvas.after(CONFIGURE_THROTTLE_MS, self._redraw)
+
+    def _redraw(self):
+        self._pending = None
+        self.render()
@@ -0,0 +1,173 @@
+"""Named timing spans and optional cProfile/tracemalloc capture.
+
+Stages wrap themselves in ``span(name)``. Spans only cost anything while a
+Tracer is active in the current thread (``with tracing(tracer):``), so the
+pipeline can stay instrumented permanently. A Tracer collects one event per
+span and exports them as JSON lines or in the Chrome trace format
+(load the file in chrome://tracing or https://ui.perfetto.dev).
+
+capture() runs a block under cProfile and/or tracemalloc for deeper dives.
+
+Setting PIXLGEN_TRACE=path.jsonl makes the GUI append every conversion's
+spans to that file.
+"""
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+TRACE_ENV_VAR = 'PIXLGEN_TRACE'
+
+_active = contextvars.ContextVar('pixlgen_tracer', default=None)
+
+
+class Tracer:
+    """Collects timing spans; safe to share between threads"""
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def record(self, name, start, duration, **args):
+        event = {'name': name, 'start': start, 'duration': duration,
+                 'pid': os.getpid(), 'tid': threading.get_ident()}
+        if args:
+            event['args'] = args
+        with self._lock:
+            self.events.append(event)
+
+    def extend(self, events):
+        """Add events recorded elsewhere (e.g. returned by a worker process)"""
+        with self._lock:
+            self.events.extend(events)
+
+    def totals(self):
+        """Total seconds per span name, in first-seen order"""
+        totals = {}
+        for event in self.events:
+            totals[event['name']] = totals.get(event['name'], 0.0) + event['duration']
+        return totals
+
+    def summary(self, limit=6):
+        """Short 'name 12 ms' list of the slowest stages, for status lines"""
+        totals = sorted(self.totals().items(), key=lambda item: -item[1])[:limit]
+        return ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in totals)
+
+    def export_jsonl(self, path, append=False):
+        with open(path, 'a' if append else 'w', encoding='utf-8') as f:
+            for event in self.events:
+                f.write(json.dumps(event) + '\n')
+
+    def export_chrome(self, path):
+        """Chrome trace 'complete' events, timestamps in microseconds"""
+        trace = [{'name': e['name'], 'ph': 'X', 'ts': e['start'] * 1e6,
+                  'dur': e['duration'] * 1e6, 'pid': e['pid'], 'tid': e['tid'],
+                  'args': e.get('args', {})} for e in self.events]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+    def export(self, path):
+        """Chrome trace for .json, JSON lines otherwise"""
+        if path.lower().endswith('.json'):
+            self.export_chrome(path)
+        else:
+            self.export_jsonl(path)
+
+
+@contextmanager
+def tracing(tracer):
+    """Make tracer receive the spans recorded in this thread"""
+    token = _active.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _active.reset(token)
+
+
+def current_tracer():
+    return _active.get()
+
+
+@contextmanager
+def span(name, **args):
+    """Time the block as a span of the active tracer, if there is one"""
+    tracer = _active.get()
+    if tracer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        # time.time() anchors the start so traces from several processes line up
+        duration = time.perf_counter() - start
+        tracer.record(name, time.time() - duration, duration, **args)
+
+
+def traced(name):
+    """Decorator: record every call of the function as a span"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _active.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class Capture:
+    """Result of capture(): cProfile stats and/or tracemalloc peak"""
+
+    def __init__(self):
+        self.profile = None
+        self.peak_bytes = None
+        self.top_allocations = []
+
+    def stats(self, sort='cumulative', limit=25):
+        """Printable top of the cProfile stats"""
+        if self.profile is None:
+            return ""
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def dump(self, path):
+        """Write the cProfile stats for pstats / snakeviz"""
+        if self.profile is not None:
+            self.profile.dump_stats(path)
+
+
+@contextmanager
+def capture(cpu=True, memory=False, top=10):
+    """Run the block under cProfile (cpu) and/or tracemalloc (memory)"""
+    result = Capture()
+    started_tracemalloc = memory and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    if memory:
+        tracemalloc.reset_peak()
+    if cpu:
+        result.profile = cProfile.Profile()
+        result.profile.enable()
+    try:
+        yield result
+    finally:
+        if cpu:
+            result.profile.disable()
+        if memory:
+            result.peak_bytes = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot()
+            result.top_allocations = [str(stat) for stat in
+                                      snapshot.statistics('lineno')[:top]]
+            if started_tracemalloc:
+                tracemalloc.stop()
+
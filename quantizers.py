@@ -0,0 +1,380 @@
+"""Colour quantization backends.
+
+Every backend takes an (N, 3) uint8 array of RGB pixels and the number of
+colours wanted, and returns ``(palette, labels)``: a (k, 3) int palette with
+k <= n_colors and an (N,) array giving each pixel's palette index.
+
+KMeans (the original ten-restart fit) is kept as the quality reference; the
+other engines trade a little colour error for a lot of speed. The K-means
+engines also accept ``init=palette`` to warm-start from a previous result, and
+all but Pillow accept ``sample_weight``, so they can be fitted on distinct
+colours with their pixel counts (see quantize_colors). Median cut and Wu
+split greedily, so one run also yields the palette for every smaller colour
+count (see HIERARCHICAL_QUANTIZERS). Use benchmarks/bench_quantizers.py to
+compare them on your own images.
+"""
+import numpy as np
+from PIL import Image
+
+# Rows processed at once when assigning pixels to their nearest colour
+ASSIGN_CHUNK = 65536
+
+
+def _to_palette(centers):
+    return np.clip(np.asarray(centers, dtype=np.float64), 0, 255).astype(int)
+
+
+def assign_labels(pixels, palette):
+    """Index of the nearest palette colour for every pixel (squared RGB distance)"""
+    pixels = np.asarray(pixels)
+    palette = np.asarray(palette, dtype=np.float32)
+    labels = np.empty(len(pixels), dtype=np.intp)
+    # |p - c|^2 = |p|^2 - 2 p.c + |c|^2; |p|^2 is constant per row so it is dropped
+    pal_sq = (palette ** 2).sum(axis=1)
+    for start in range(0, len(pixels), ASSIGN_CHUNK):
+        chunk = pixels[start:start + ASSIGN_CHUNK].astype(np.float32)
+        dist = pal_sq - 2.0 * chunk @ palette.T
+        labels[start:start + ASSIGN_CHUNK] = dist.argmin(axis=1)
+    return labels
+
+
+def unique_colors(pixels):
+    """Distinct colours of (N, 3) uint8 pixels; returns (colors, counts, inverse).
+
+    colors[inverse] reproduces pixels.
+    """
+    px = np.asarray(pixels, dtype=np.uint8).reshape(-1, 3)
+    packed = (px[:, 0].astype(np.int32) << 16) | (px[:, 1].astype(np.int32) << 8) | px[:, 2]
+    keys, inverse, counts = np.unique(packed, return_inverse=True, return_counts=True)
+    colors = np.stack([keys >> 16, (keys >> 8) & 255, keys & 255], axis=1).astype(np.uint8)
+    return colors, counts, inverse.ravel()
+
+
+def quantize_kmeans(pixels, n_colors, init=None, sample_weight=None):
+    """scikit-learn KMeans with ten restarts - slow but the quality reference.
+
+    Given init (a previous palette) it runs a single fit from those centres.
+    """
+    from sklearn.cluster import KMeans
+    if init is not None:
+        kmeans = KMeans(n_clusters=len(init), init=np.asarray(init, dtype=np.float64),
+                        n_init=1)
+    else:
+        kmeans = KMeans(n_clusters=min(n_colors, len(pixels)), random_state=42, n_init=10)
+    kmeans.fit(pixels, sample_weight=sample_weight)
+    return _to_palette(kmeans.cluster_centers_), kmeans.labels_
+
+
+def quantize_minibatch(pixels, n_colors, init=None, sample_weight=None):
+    """MiniBatchKMeans: K-means on small random batches, optionally warm-started"""
+    from sklearn.cluster import MiniBatchKMeans
+    if init is not None:
+        kmeans = MiniBatchKMeans(n_clusters=len(init), init=np.asarray(init, dtype=np.float64),
+                                 random_state=42, n_init=1, batch_size=2048)
+    else:
+        kmeans = MiniBatchKMeans(n_clusters=min(n_colors, len(pixels)), random_state=42,
+                                 n_init=3, batch_size=2048)
+    kmeans.fit(pixels, sample_weight=sample_weight)
+    return _to_palette(kmeans.cluster_centers_), kmeans.labels_
+
+
+def _levels(splits, levels, palette):
+    """{count: palette(boxes)} for every count in levels, from one greedy run.
+
+    Greedy splitting never revisits a split, so the boxes for n colours are
+    the state the run passes through on its way to any larger count. splits
+    yields the (mutable) box list after each split; a count the run stops
+    short of gets the final boxes.
+    """
+    wanted = set(levels)
+    palettes = {}
+    for boxes in splits:
+        if len(boxes) in wanted:
+            palettes[len(boxes)] = palette(boxes)
+    for count in wanted - palettes.keys():
+        palettes[count] = palette(boxes)
+    return palettes
+
+
+def _median_cut_splits(pixels, weights, n_colors):
+    """Yield median cut's boxes (index arrays) after each split, up to n_colors"""
+    boxes = [np.arange(len(pixels))]
+    yield boxes
+    while len(boxes) < n_colors:
+        # Pick the box with the largest channel range that can still be split
+        best, best_range, best_channel = None, 0, 0
+        for i, idx in enumerate(boxes):
+            if len(idx) < 2:
+                continue
+            box = pixels[idx]
+            ranges = box.max(axis=0).astype(int) - box.min(axis=0)
+            channel = int(ranges.argmax())
+            if ranges[channel] > best_range:
+                best, best_range, best_channel = i, ranges[channel], channel
+        if best is None:
+            break
+        idx = boxes.pop(best)
+        values = pixels[idx, best_channel]
+        order = np.argsort(values, kind='stable')
+        # Split where half the (weighted) pixels fall on either side
+        cumulative = np.cumsum(weights[idx[order]])
+        half = int(np.searchsorted(cumulative, cumulative[-1] / 2, side='right'))
+        half = min(max(half, 1), len(idx) - 1)
+        boxes.append(idx[order[:half]])
+        boxes.append(idx[order[half:]])
+        yield boxes
+
+
+def median_cut_levels(pixels, levels, sample_weight=None):
+    """Median cut palettes for several colour counts from one run; {count: palette}"""
+    pixels = np.asarray(pixels)
+    weights = np.ones(len(pixels)) if sample_weight is None else np.asarray(sample_weight,
+                                                                             dtype=np.float64)
+
+    def palette(boxes):
+        return _to_palette([np.average(pixels[idx], axis=0, weights=weights[idx])
+                            for idx in boxes])
+    return _levels(_median_cut_splits(pixels, weights, max(levels)), levels, palette)
+
+
+def quantize_median_cut(pixels, n_colors, sample_weight=None):
+    """Heckbert median cut: split the box with the widest channel at its median"""
+    palette = median_cut_levels(pixels, [n_colors], sample_weight)[n_colors]
+    return palette, assign_labels(pixels, palette)
+
+
+def _interleave_bits(pixels, depth):
+    """Octree node code of each pixel at the given depth (1 = root's children)"""
+    px = pixels.astype(np.int64)
+    codes = np.zeros(len(px), dtype=np.int64)
+    for level in range(depth):
+        shift = 7 - level
+        bits = (((px[:, 0] >> shift) & 1) << 2) | (((px[:, 1] >> shift) & 1) << 1) \
+            | ((px[:, 2] >> shift) & 1)
+        codes = (codes << 3) | bits
+    return codes
+
+
+def quantize_octree(pixels, n_colors, depth=6, sample_weight=None):
+    """Gervautz-Purgathofer octree: fold the smallest deepest nodes into their parents"""
+    pixels = np.asarray(pixels)
+    weights = np.ones(len(pixels)) if sample_weight is None else np.asarray(sample_weight,
+                                                                             dtype=np.float64)
+    keys, inverse = np.unique(_interleave_bits(pixels, depth), return_inverse=True)
+    inverse = inverse.ravel()
+    sums = np.stack([np.bincount(inverse, pixels[:, c] * weights, minlength=len(keys))
+                     for c in range(3)], axis=1)
+    counts = np.bincount(inverse, weights, minlength=len(keys))
+
+    while len(keys) > n_colors and depth > 0:
+        parents, pinv = np.unique(keys >> 3, return_inverse=True)
+        children = np.bincount(pinv, minlength=len(parents))
+        excess = len(keys) - n_colors
+        if (children - 1).sum() <= excess:
+            # Folding the whole level is not enough (or exactly enough)
+            keys = parents
+            counts = np.bincount(pinv, counts, minlength=len(parents))
+            sums = np.stack([np.bincount(pinv, sums[:, c], minlength=len(parents))
+                             for c in range(3)], axis=1)
+            depth -= 1
+            continue
+        # Fold only the least populated parents, just enough to hit n_colors.
+        # The last one is folded partially, merging only its smallest children.
+        pcounts = np.bincount(pinv, counts, minlength=len(parents))
+        order = np.argsort(pcounts, kind='stable')
+        order = order[children[order] > 1]
+        reductions = np.cumsum(children[order] - 1)
+        k = int(np.searchsorted(reductions, excess)) + 1
+        fold_map = np.full(len(parents), -1)
+        fold_map[order[:k - 1]] = np.arange(k - 1)
+        group = fold_map[pinv]
+        needed = excess - (reductions[k - 2] if k > 1 else 0)
+        last = np.flatnonzero(pinv == order[k - 1])
+        last = last[np.argsort(counts[last], kind='stable')][:needed + 1]
+        group[last] = k - 1
+        merged = group >= 0
+        merged_counts = np.bincount(group[merged], counts[merged], minlength=k)
+        merged_sums = np.stack([np.bincount(group[merged], sums[merged, c], minlength=k)
+                                for c in range(3)], axis=1)
+        counts = np.concatenate([counts[~merged], merged_counts])
+        sums = np.concatenate([sums[~merged], merged_sums])
+        break
+
+    palette = _to_palette(sums / counts[:, None])
+    return palette, assign_labels(pixels, palette)
+
+
+def _wu_moments(pixels, weights=None):
+    """Cumulative 33^3 histogram moments used by Wu's quantizer"""
+    idx = (pixels.astype(np.int64) >> 3) + 1
+    flat = (idx[:, 0] * 33 + idx[:, 1]) * 33 + idx[:, 2]
+    px = pixels.astype(np.float64)
+    w = np.ones(len(px)) if weights is None else np.asarray(weights, dtype=np.float64)
+    size = 33 ** 3
+    wt = np.bincount(flat, w, minlength=size)
+    mr = np.bincount(flat, px[:, 0] * w, minlength=size)
+    mg = np.bincount(flat, px[:, 1] * w, minlength=size)
+    mb = np.bincount(flat, px[:, 2] * w, minlength=size)
+    m2 = np.bincount(flat, (px ** 2).sum(axis=1) * w, minlength=size)
+    moments = np.stack([wt, mr, mg, mb, m2], axis=-1).astype(np.float64)
+    moments = moments.reshape(33, 33, 33, 5)
+    for axis in range(3):
+        np.cumsum(moments, axis=axis, out=moments)
+    return moments
+
+
+def _wu_volume(m, box):
+    """Sum of moments m (last axis = moment) inside box (r0, r1] x (g0, g1] x (b0, b1]"""
+    r0, r1, g0, g1, b0, b1 = box
+    return (m[r1, g1, b1] - m[r1, g1, b0] - m[r1, g0, b1] + m[r1, g0, b0]
+            - m[r0, g1, b1] + m[r0, g1, b0] + m[r0, g0, b1] - m[r0, g0, b0])
+
+
+def _wu_variance(m, box):
+    wt, r, g, b, m2 = _wu_volume(m, box)
+    if wt <= 0:
+        return 0.0
+    return m2 - (r * r + g * g + b * b) / wt
+
+
+def _wu_best_cut(m, box):
+    """Best (score, axis, position) to split box, maximising variance reduction"""
+    whole = _wu_volume(m, box)[..., :4]
+    best = (-1.0, None, None)
+    for axis in range(3):
+        lo, hi = box[2 * axis], box[2 * axis + 1]
+        if hi - lo < 2:
+            continue
+        positions = np.arange(lo + 1, hi)
+        # Moments of the lower half (lo, pos] for every candidate position at once
+        sub = list(box)
+        sub[2 * axis + 1] = positions
+        lower = _wu_volume(m, sub)[..., :4]
+        upper = whole - lower
+        valid = (lower[:, 0] > 0) & (upper[:, 0] > 0)
+        if not valid.any():
+            continue
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = ((lower[:, 1:] ** 2).sum(axis=1) / lower[:, 0]
+                     + (upper[:, 1:] ** 2).sum(axis=1) / upper[:, 0])
+        score[~valid] = -1.0
+        i = int(score.argmax())
+        if score[i] > best[0]:
+            best = (score[i], axis, int(positions[i]))
+    return best
+
+
+def _wu_splits(m, n_colors):
+    """Yield Wu's boxes after each split, up to n_colors"""
+    boxes = [[0, 32, 0, 32, 0, 32]]
+    variances = [_wu_variance(m, boxes[0])]
+    yield boxes
+    while len(boxes) < n_colors:
+        i = int(np.argmax(variances))
+        if variances[i] <= 0:
+            break
+        score, axis, pos = _wu_best_cut(m, boxes[i])
+        if axis is None:
+            variances[i] = 0.0
+            continue
+        box = boxes[i]
+        other = list(box)
+        box[2 * axis + 1] = pos
+        other[2 * axis] = pos
+        boxes.append(other)
+        variances[i] = _wu_variance(m, box)
+        variances.append(_wu_variance(m, other))
+        yield boxes
+
+
+def wu_levels(pixels, levels, sample_weight=None):
+    """Wu palettes for several colour counts from one run; {count: palette}"""
+    m = _wu_moments(np.asarray(pixels), sample_weight)
+
+    def palette(boxes):
+        centers = []
+        for box in boxes:
+            wt, r, g, b = _wu_volume(m, box)[..., :4]
+            if wt > 0:
+                centers.append((r / wt, g / wt, b / wt))
+        return _to_palette(centers)
+    return _levels(_wu_splits(m, max(levels)), levels, palette)
+
+
+def quantize_wu(pixels, n_colors, sample_weight=None):
+    """Xiaolin Wu's greedy variance-minimising box splitting"""
+    palette = wu_levels(pixels, [n_colors], sample_weight)[n_colors]
+    return palette, assign_labels(pixels, palette)
+
+
+def quantize_pillow(pixels, n_colors):
+    """Pillow's native Image.quantize (median cut in C)"""
+    pixels = np.asarray(pixels, dtype=np.uint8)
+    img = Image.fromarray(pixels.reshape(-1, 1, 3), 'RGB')
+    quantized = img.quantize(colors=min(n_colors, 256))
+    raw_labels = np.asarray(quantized, dtype=np.intp).ravel()
+    full_palette = np.array(quantized.getpalette()[:768], dtype=int).reshape(-1, 3)
+    # Drop unused palette slots and renumber labels to match
+    used, labels = np.unique(raw_labels, return_inverse=True)
+    return full_palette[used], labels.ravel()
+
+
+# name -> (label shown in the GUI, function)
+QUANTIZERS = {
+    'kmeans': ("K-means (reference)", quantize_kmeans),
+    'minibatch': ("Mini-batch K-means", quantize_minibatch),
+    'median_cut': ("Median cut", quantize_median_cut),
+    'octree': ("Octree", quantize_octree),
+    'wu': ("Wu", quantize_wu),
+    'pillow': ("Pillow quantize", quantize_pillow),
+}
+
+
+# Engines whose function accepts init=previous_palette to warm-start the fit
+WARM_START_QUANTIZERS = ('kmeans', 'minibatch')
+# Engines whose function accepts sample_weight (per-pixel counts)
+WEIGHTED_QUANTIZERS = ('kmeans', 'minibatch', 'median_cut', 'octree', 'wu')
+# Greedy splitting engines: name -> levels(pixels, counts, sample_weight) giving
+# the palette for every count from a single run
+HIERARCHICAL_QUANTIZERS = {'median_cut': median_cut_levels, 'wu': wu_levels}
+
+
+def sample_pixels(pixels, max_samples, seed=0):
+    """Deterministic random subset of at most max_samples rows (all rows if 0)"""
+    if not max_samples or len(pixels) <= max_samples:
+        return pixels
+    rng = np.random.default_rng(seed)
+    return pixels[np.sort(rng.choice(len(pixels), max_samples, replace=False))]
+
+
+def get_quantizer(name):
+    """Look up a quantizer function by its registry name"""
+    try:
+        return QUANTIZERS[name][1]
+    except KeyError:
+        raise ValueError(f"Unknown quantizer {name!r}; choose one of: {', '.join(QUANTIZERS)}")
+
+
+def quantize_colors(name, pixels, n_colors, init=None, max_samples=0):
+    """Fit a palette to (N, 3) pixels with the named engine; returns (palette, labels).
+
+    Pixels are collapsed to their distinct colours first. If there are no
+    more of those than n_colors they are the palette and nothing is fitted.
+    Otherwise weighted engines are fitted on the distinct colours with their
+    counts, which gives the same clusters as fitting every pixel; when there
+    are more than max_samples (0 = no cap) distinct colours the fit runs on
+    a random subset of pixels instead and every pixel is assigned after.
+    """
+    colors, counts, inverse = unique_colors(pixels)
+    if len(colors) <= n_colors:
+        return colors.astype(int), inverse
+    if max_samples and len(colors) > max_samples:
+        palette, _ = quantize_colors(name, sample_pixels(pixels, max_samples), n_colors, init)
+        return palette, assign_labels(pixels, palette)
+
+    quantize = get_quantizer(name)
+    options = {} if init is None else {'init': init}
+    if name in WEIGHTED_QUANTIZERS:
+        palette, labels = quantize(colors, n_colors, sample_weight=counts, **options)
+        return palette, np.asarray(labels)[inverse]
+    return quantize(np.asarray(pixels), n_colors, **options)
@@ -0,0 +1,433 @@
+"""Local HTTP conversion service.
+
+Usage:
+    python PixLGEN.py serve [--host 127.0.0.1] [--port 8080] [-j WORKERS]
+
+Endpoints:
+
+* ``POST /convert`` with the raw image bytes as the body and any
+  ConversionSettings field as a query parameter
+  (``/convert?pixel_size=4&color_count=8``). Returns JSON with the palette
+  and the pixel art as a base64 PNG, or the PNG itself (palette in the
+  ``X-PixLGEN-Palette`` header) when the request sends ``Accept: image/png``.
+* ``GET /metrics``: queue depth, in-flight batches, request counters,
+  throughput and per-stage latency as JSON.
+* ``GET /health``.
+
+Settings outside the GUI's slider and spinbox ranges are rejected with 400.
+Requests wait in a bounded queue; when it is full the server answers 503
+with Retry-After instead of queueing more work. A dispatcher thread hands
+the queue to a process pool, at most one batch per worker at a time, and
+starts a fresh pool if a worker process dies.
+Small uploads with identical settings that arrive within the batching
+window are coalesced into one batch, so they share one round trip to a
+worker and one pipeline set-up.
+"""
+import argparse
+import base64
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qsl, urlsplit
+
+from batch import _coerce_setting, limit_worker_threads
+from loader import load_to_canvas
+from pipeline import SETTING_RANGES, ConversionSettings, PixelArtPipeline
+from profiling import Tracer, span, tracing
+
+DEFAULT_PORT = 8080
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_BATCH_SIZE = 8
+DEFAULT_BATCH_WINDOW_MS = 10
+# Uploads at or below this size may be coalesced into a batch
+SMALL_REQUEST_BYTES = 1024 * 1024
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+REQUEST_TIMEOUT = 120
+# Latency samples kept per stage for the percentiles in /metrics
+LATENCY_WINDOW = 1024
+THROUGHPUT_WINDOW = 60.0
+
+
+def convert_images(images, settings_dict):
+    """Worker entry point: convert a batch of encoded images with one settings.
+
+    Returns one (png_bytes, palette, timings) tuple or exception message
+    string per image, so one bad upload does not fail the whole batch.
+    """
+    settings = ConversionSettings.from_dict(settings_dict)
+    pipeline = PixelArtPipeline(settings)
+    results = []
+    for data in images:
+        try:
+            with tracing(Tracer()) as tracer:
+                canvas, _, _ = load_to_canvas(BytesIO(data), settings)
+                result = pipeline.convert(canvas)
+                out = BytesIO()
+                with span('encode'):
+                    result.image.save(out, format='PNG')
+            results.append((out.getvalue(), [list(map(int, c)) for c in result.palette],
+                            tracer.totals()))
+        except Exception as e:
+            results.append(f"{type(e).__name__}: {e}")
+    return results
+
+
+class Overloaded(Exception):
+    """The request queue is full"""
+
+
+class _Request:
+    def __init__(self, data, settings):
+        self.data = data
+        self.settings = settings
+        self.key = tuple(sorted(settings.to_dict().items()))
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class Metrics:
+    """Thread-safe counters and latency windows reported by /metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {'requests': 0, 'completed': 0, 'failed': 0, 'rejected': 0,
+                         'batches': 0, 'batched_requests': 0, 'worker_restarts': 0}
+        self.latency = {}
+        self._completions = deque()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+            if name == 'completed':
+                now = time.time()
+                self._completions.extend([now] * amount)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.latency.setdefault(stage, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            now = time.time()
+            while self._completions and self._completions[0] < now - THROUGHPUT_WINDOW:
+                self._completions.popleft()
+            window = min(THROUGHPUT_WINDOW, now - self.started) or 1.0
+            stages = {}
+            for stage, samples in self.latency.items():
+                ordered = sorted(samples)
+                stages[stage] = {
+                    'count': len(ordered),
+                    'mean_ms': 1000 * sum(ordered) / len(ordered),
+                    'p50_ms': 1000 * ordered[len(ordered) // 2],
+                    'p95_ms': 1000 * ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    'max_ms': 1000 * ordered[-1],
+                }
+            return {
+                'uptime_seconds': now - self.started,
+                **self.counters,
+                'throughput_per_second': len(self._completions) / window,
+                'stages': stages,
+            }
+
+
+class ConversionService:
+    """Bounded request queue feeding a process pool in coalesced batches"""
+
+    def __init__(self, workers=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE, batch_window_ms=DEFAULT_BATCH_WINDOW_MS):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_window = batch_window_ms / 1000
+        self.metrics = Metrics()
+        self.queue_size = queue_size
+        self._queue = queue.Queue()
+        # Requests taken off the queue while collecting a batch
+        self._held = deque()
+        # Waiting requests, queued or held; a slot is freed once a request is
+        # handed to a worker, so held requests still count against the limit
+        self._waiting = threading.BoundedSemaphore(queue_size)
+        # One batch per worker in flight; the rest waits in the bounded queue
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+        self._stopping = threading.Event()
+        self._dispatcher = threading.Thread(target=self._dispatch, name='pixlgen-dispatch',
+                                            daemon=True)
+        self._dispatcher.start()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=limit_worker_threads,
+                                   initargs=(1,))
+
+    def _submit(self, batch):
+        images, settings = [r.data for r in batch], batch[0].settings.to_dict()
+        try:
+            return self._executor.submit(convert_images, images, settings)
+        except BrokenProcessPool:
+            # A worker died (killed for memory, say) and took the pool with
+            # it; its batches have failed, later ones get a fresh pool
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._new_executor()
+            self.metrics.count('worker_restarts')
+            return self._executor.submit(convert_images, images, settings)
+
+    def submit(self, data, settings):
+        """Queue one conversion; returns a Future, or raises Overloaded"""
+        self.metrics.count('requests')
+        if not self._waiting.acquire(blocking=False):
+            self.metrics.count('rejected')
+            raise Overloaded()
+        request = _Request(data, settings)
+        self._queue.put(request)
+        return request.future
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() + len(self._held)
+
+    def _next(self, timeout=None):
+        if self._held:
+            return self._held.popleft()
+        return self._queue.get(timeout=timeout)
+
+    def _collect_batch(self, first):
+        """first plus held, then queued, small requests with the same settings"""
+        batch = [first]
+        if len(first.data) > SMALL_REQUEST_BYTES:
+            return batch
+
+        def matches(request):
+            return request.key == first.key and len(request.data) <= SMALL_REQUEST_BYTES
+
+        # Held requests arrived before anything still queued
+        for request in [r for r in self._held if matches(r)][:self.batch_size - 1]:
+            self._held.remove(request)
+            batch.append(request)
+        deadline = time.perf_counter() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if matches(request):
+                batch.append(request)
+            else:
+                # Behind the older held requests, so they stay in arrival order
+                self._held.append(request)
+        return batch
+
+    def _dispatch(self):
+        while not self._stopping.is_set():
+            self._slots.acquire()
+            try:
+                first = self._next(timeout=0.5)
+            except queue.Empty:
+                self._slots.release()
+                continue
+            batch = self._collect_batch(first)
+            now = time.perf_counter()
+            for request in batch:
+                self._waiting.release()
+                self.metrics.observe('queue_wait', now - request.enqueued)
+            self.metrics.count('batches')
+            self.metrics.count('batched_requests', len(batch))
+            with self._lock:
+                self._in_flight += 1
+            try:
+                future = self._submit(batch)
+            except RuntimeError as e:
+                # Executor shut down
+                self._finish(batch, None, e)
+                continue
+            future.add_done_callback(lambda f, batch=batch: self._finish(batch, f))
+
+    def _finish(self, batch, future, error=None):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+        if error is None:
+            try:
+                results = future.result()
+            except Exception as e:
+                error = e
+        for i, request in enumerate(batch):
+            result = error if error is not None else results[i]
+            if isinstance(result, tuple):
+                for stage, seconds in result[2].items():
+                    self.metrics.observe(stage, seconds)
+                self.metrics.observe('total', time.perf_counter() - request.enqueued)
+                self.metrics.count('completed')
+                request.future.set_result(result)
+            else:
+                self.metrics.count('failed')
+                request.future.set_exception(
+                    result if isinstance(result, Exception) else ValueError(result))
+
+    def metrics_snapshot(self):
+        return {'queue_depth': self.queue_depth, 'queue_capacity': self.queue_size,
+                'in_flight_batches': self._in_flight, 'workers': self.workers,
+                **self.metrics.snapshot()}
+
+    def shutdown(self):
+        self._stopping.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_settings(query):
+    """ConversionSettings from URL query parameters; ValueError on bad input"""
+    fields = ConversionSettings.__dataclass_fields__
+    overrides = {}
+    for name, value in parse_qsl(query):
+        if name not in fields:
+            raise ValueError(f"Unknown setting {name!r}")
+        overrides[name] = _coerce_setting(name, value)
+    settings = ConversionSettings(**overrides)
+    for name, (low, high) in SETTING_RANGES.items():
+        value = getattr(settings, name)
+        if not low <= value <= high:
+            raise ValueError(f"{name} must be between {low} and {high}, got {value}")
+    return settings
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    server_version = 'PixLGEN'
+    # Set on the handler subclass built by make_server
+    service = None
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, headers=None):
+        self._send(status, {'error': message}, headers=headers)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/metrics':
+            self._send(200, self.service.metrics_snapshot())
+        elif path == '/health':
+            self._send(200, {'status': 'ok'})
+        else:
+            self._error(404, f"No such endpoint {path}")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/convert':
+            self._error(404, f"No such endpoint {url.path}")
+            return
+        try:
+            settings = parse_settings(url.query)
+        except (ValueError, TypeError) as e:
+            self._error(400, str(e))
+            return
+        length = self.headers.get('Content-Length')
+        if not length or not length.isdigit() or int(length) == 0:
+            self._error(411, "Send the image as the request body with a Content-Length")
+            return
+        if int(length) > MAX_UPLOAD_BYTES:
+            self._error(413, f"Uploads are limited to {MAX_UPLOAD_BYTES} bytes")
+            return
+        data = self.rfile.read(int(length))
+
+        try:
+            future = self.service.submit(data, settings)
+        except Overloaded:
+            self._error(503, "Server busy, retry later", headers={'Retry-After': '1'})
+            return
+        try:
+            png, palette, timings = future.result(timeout=REQUEST_TIMEOUT)
+        except FutureTimeout:
+            self._error(504, "Conversion timed out")
+            return
+        except ValueError as e:
+            # The upload itself could not be converted
+            self._error(422, str(e))
+            return
+        except Exception as e:
+            self._error(500, f"{type(e).__name__}: {e}")
+            return
+
+        if 'image/png' in self.headers.get('Accept', ''):
+            self._send(200, png, 'image/png',
+                       headers={'X-PixLGEN-Palette': json.dumps(palette)})
+        else:
+            self._send(200, {
+                'palette': palette,
+                'image_png_base64': base64.b64encode(png).decode('ascii'),
+                'timings_ms': {stage: 1000 * s for stage, s in timings.items()},
+            })
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(host='127.0.0.1', port=DEFAULT_PORT, service=None, quiet=False):
+    """ThreadingHTTPServer bound to host:port and serving service"""
+    handler = type('BoundConversionHandler', (ConversionHandler,),
+                   {'service': service or ConversionService()})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.quiet = quiet
+    return httpd
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='pixlgen serve',
+        description="Serve pixel art conversion over HTTP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="Worker processes (default: CPU count)")
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="Requests waiting before new ones get 503 (default: %(default)s)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Most small requests coalesced into one batch "
+                             "(default: %(default)s)")
+    parser.add_argument('--batch-window-ms', type=float, default=DEFAULT_BATCH_WINDOW_MS,
+                        help="How long to wait for more matching requests "
+                             "(default: %(default)s ms)")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Don't log requests")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    service = ConversionService(workers=args.workers, queue_size=args.queue_size,
+                                batch_size=args.batch_size,
+                                batch_window_ms=args.batch_window_ms)
+    httpd = make_server(args.host, args.port, service, quiet=args.quiet)
+    print(f"Serving on http://{args.host}:{httpd.server_port} "
+          f"with {service.workers} workers")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
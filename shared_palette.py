@@ -0,0 +1,218 @@
+"""Fit one palette across a whole set of images.
+
+Pixels are streamed image by image through the same resize, adjust and
+downsample stages a conversion uses, so at most one decoded image (per
+worker) is in memory at a time. Two strategies are available:
+
+* ``reservoir`` keeps a uniform random sample of every pixel seen
+  (Algorithm R) and fits the configured quantizer on it once at the end;
+* ``partial_fit`` updates a MiniBatchKMeans incrementally per image.
+
+The palette is written to a file and then applied to every image through
+its PaletteLUT, so N per-image clustering jobs become one.
+
+Usage:
+    python PixLGEN.py palette INPUT [INPUT ...] -o palette.json [settings]
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from palette_lut import save_palette
+from loader import load_to_canvas
+from pipeline import ConversionSettings, PixelArtPipeline
+from quantizers import quantize_colors
+
+DEFAULT_SAMPLE_SIZE = 200_000
+FIT_METHODS = ('reservoir', 'partial_fit')
+
+
+class ReservoirSampler:
+    """Uniform fixed-size sample of a stream of (N, 3) pixel batches"""
+
+    def __init__(self, capacity=DEFAULT_SAMPLE_SIZE, seed=0):
+        self.capacity = capacity
+        self.seen = 0
+        self.rng = np.random.default_rng(seed)
+        self._buffer = np.empty((capacity, 3), dtype=np.uint8)
+
+    def add(self, pixels):
+        pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1, 3)
+        # Fill the reservoir first
+        free = min(self.capacity - min(self.seen, self.capacity), len(pixels))
+        if free:
+            self._buffer[self.seen:self.seen + free] = pixels[:free]
+            self.seen += free
+            pixels = pixels[free:]
+        if not len(pixels):
+            return
+        # Algorithm R, vectorized: item t replaces slot randint(0, t) if it is
+        # inside the reservoir; later items overwrite earlier ones
+        positions = self.seen + np.arange(len(pixels))
+        slots = (self.rng.random(len(pixels)) * (positions + 1)).astype(np.int64)
+        keep = slots < self.capacity
+        self._buffer[slots[keep]] = pixels[keep]
+        self.seen += len(pixels)
+
+    @property
+    def sample(self):
+        return self._buffer[:min(self.seen, self.capacity)]
+
+
+class IncrementalKMeans:
+    """MiniBatchKMeans.partial_fit fed one image at a time"""
+
+    def __init__(self, n_colors, batch_size=4096, seed=42):
+        from sklearn.cluster import MiniBatchKMeans
+        self.n_colors = n_colors
+        self.kmeans = MiniBatchKMeans(n_clusters=n_colors, random_state=seed,
+                                      batch_size=batch_size, n_init=3)
+        self._pending = []
+        self._pending_count = 0
+        self.seen = 0
+
+    def add(self, pixels):
+        pixels = np.asarray(pixels, dtype=np.uint8).reshape(-1, 3)
+        self.seen += len(pixels)
+        self._pending.append(pixels)
+        self._pending_count += len(pixels)
+        # The first partial_fit needs at least n_colors samples
+        if self._pending_count >= max(self.n_colors, 1024):
+            self._flush()
+
+    def _flush(self):
+        if self._pending_count:
+            self.kmeans.partial_fit(np.concatenate(self._pending).astype(np.float64))
+            self._pending, self._pending_count = [], 0
+
+    def palette(self):
+        if not hasattr(self.kmeans, 'cluster_centers_'):
+            # Too few pixels ever arrived for a first partial_fit; fit them directly
+            palette, _ = quantize_colors('minibatch', np.concatenate(self._pending),
+                                         self.n_colors)
+            return palette
+        self._flush()
+        return np.clip(self.kmeans.cluster_centers_, 0, 255).astype(int)
+
+
+def image_pixels(path, settings_dict):
+    """Pixels of one image as the palette fit stage would see them"""
+    settings = ConversionSettings.from_dict(settings_dict)
+    pipeline = PixelArtPipeline(settings)
+    canvas, _, _ = load_to_canvas(path, settings)
+    return np.ascontiguousarray(pipeline.palette_pixels(
+        pipeline.reduce(canvas)))
+
+
+def iter_image_pixels(paths, settings, workers=1, errors=None):
+    """Yield each image's pixels, decoding on up to workers processes.
+
+    Unreadable images are skipped and appended to errors as (path, message).
+    """
+    settings_dict = settings.to_dict()
+    if workers <= 1:
+        for path in paths:
+            try:
+                yield image_pixels(path, settings_dict)
+            except Exception as e:
+                if errors is not None:
+                    errors.append((path, f"{type(e).__name__}: {e}"))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        paths = iter(paths)
+        exhausted = False
+        while pending or not exhausted:
+            # Keep a bounded window of decodes in flight
+            while not exhausted and len(pending) < workers * 2:
+                try:
+                    path = next(paths)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(image_pixels, path, settings_dict)] = path
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path = pending.pop(future)
+                try:
+                    yield future.result()
+                except Exception as e:
+                    if errors is not None:
+                        errors.append((path, f"{type(e).__name__}: {e}"))
+
+
+def fit_shared_palette(paths, settings, method='reservoir', sample_size=DEFAULT_SAMPLE_SIZE,
+                       workers=1, errors=None, seed=0):
+    """Fit a settings.color_count palette across every image in paths"""
+    if method == 'reservoir':
+        sampler = ReservoirSampler(sample_size, seed=seed)
+    elif method == 'partial_fit':
+        sampler = IncrementalKMeans(settings.color_count)
+    else:
+        raise ValueError(f"Unknown fit method {method!r}; choose one of: {', '.join(FIT_METHODS)}")
+
+    for pixels in iter_image_pixels(paths, settings, workers=workers, errors=errors):
+        if len(pixels):
+            sampler.add(pixels)
+    if sampler.seen == 0:
+        raise ValueError("No opaque pixels found in any input image")
+
+    if method == 'partial_fit':
+        return sampler.palette()
+    palette, _ = quantize_colors(settings.quantizer, sampler.sample, settings.color_count)
+    return palette
+
+
+def build_parser():
+    import batch
+    parser = argparse.ArgumentParser(
+        prog='pixlgen palette',
+        description="Fit one shared palette across many images")
+    batch.add_input_arguments(parser)
+    parser.add_argument('-o', '--output', required=True,
+                        help="Palette file to write (.json, or hex list for other extensions)")
+    batch.add_settings_arguments(parser)
+    fit = parser.add_argument_group('fitting')
+    fit.add_argument('--method', choices=FIT_METHODS, default='reservoir')
+    fit.add_argument('--sample-size', type=int, default=DEFAULT_SAMPLE_SIZE,
+                     help="Pixels kept by the reservoir sampler (default: %(default)s)")
+    fit.add_argument('-j', '--workers', type=int, default=None,
+                     help="Decoding processes (default: CPU count)")
+    return parser
+
+
+def main(argv=None):
+    import batch
+    args = build_parser().parse_args(argv)
+    settings = batch.settings_from_args(args)
+    errors = []
+    # URL inputs are downloaded next to the palette file, as batch does next to its output
+    download_dir = os.path.join(os.path.dirname(os.path.abspath(args.output)),
+                                batch.DOWNLOAD_DIR_NAME)
+    jobs = batch.fetch_url_jobs(batch.iter_jobs(args.inputs, '.', settings,
+                                                recursive=args.recursive), download_dir)
+
+    def paths():
+        for job in jobs:
+            if job.error:
+                errors.append((job.input_path, job.error))
+            else:
+                yield job.input_path
+    palette = fit_shared_palette(paths(), settings, method=args.method,
+                                 sample_size=args.sample_size,
+                                 workers=args.workers or os.cpu_count() or 1, errors=errors)
+    save_palette(args.output, palette)
+    for path, error in errors:
+        print(f"SKIPPED {path}: {error}", file=sys.stderr)
+    print(f"Wrote {len(palette)} colours to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
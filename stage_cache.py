@@ -0,0 +1,115 @@
+"""Bounded in-memory LRU for intermediate pipeline stage outputs.
+
+PixelArtPipeline keys every stage by the source fingerprint plus only the
+settings that stage depends on, so re-running a conversion after moving
+one slider recomputes just the stages downstream of that slider. A backing
+cache (a DiskCache) can keep some stages across sessions as well.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+
+def image_fingerprint(image):
+    """Content hash identifying a PIL image (mode, size and pixels)"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.mode}:{image.width}x{image.height}:".encode('ascii'))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def estimate_nbytes(value):
+    """Approximate memory held by a cached stage output"""
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_nbytes(v) for v in value)
+    return 64
+
+
+def _freeze(value):
+    """Make cached arrays read-only so callers can't corrupt shared entries"""
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            _freeze(v)
+
+
+class StageCache:
+    """Thread-safe LRU mapping stage keys to outputs under a byte budget.
+
+    An optional backing cache with the same get/put interface is consulted
+    on a miss and written through on put.
+    """
+
+    def __init__(self, max_bytes=128 * 1024 * 1024, backing=None):
+        self.max_bytes = max_bytes
+        self.backing = backing
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            self.misses += 1
+        if self.backing is None:
+            return default
+        sentinel = object()
+        value = self.backing.get(key, sentinel)
+        if value is sentinel:
+            return default
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        if self.backing is not None:
+            self.backing.put(key, value)
+        self._remember(key, value)
+
+    def _remember(self, key, value):
+        size = estimate_nbytes(value)
+        if size > self.max_bytes:
+            # Would evict everything else and still not fit
+            return
+        _freeze(value)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, computing and storing it on a miss"""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is not sentinel:
+            return value
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
@@ -0,0 +1,139 @@
+"""Background task runner for the Tk GUI.
+
+Work runs on a small thread pool; results, errors and progress updates
+come back to the Tk main thread by polling with ``root.after``, so no Tk
+call ever happens off the main thread. Each task belongs to a channel
+(e.g. "load" or "convert"); submitting a new task cancels whatever is in
+flight on the channels it supersedes, and results of superseded tasks are
+dropped instead of being delivered late.
+"""
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TaskCancelled(Exception):
+    """Raised inside a task once it has been cancelled or superseded"""
+
+
+class CancelToken:
+    """Cooperative cancellation flag handed to every task"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        """Raise TaskCancelled if the task should stop"""
+        if self._event.is_set():
+            raise TaskCancelled()
+
+
+class _Task:
+    def __init__(self, channel, token, on_done, on_error, on_progress):
+        self.channel = channel
+        self.token = token
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.future = None
+
+
+class TaskRunner:
+    """Run callables off the Tk thread and deliver their outcome back on it"""
+
+    def __init__(self, root, max_workers=2, poll_ms=30):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="pixlgen-task")
+        self._active = {}
+        self._progress = queue.Queue()
+        self._polling = False
+
+    def submit(self, channel, fn, on_done, on_error=None, on_progress=None, supersedes=()):
+        """Run fn(token, progress) in the background.
+
+        progress(fraction, message) may be called from the worker; it also
+        raises TaskCancelled once the task is cancelled. on_done(result),
+        on_error(exception) and on_progress(fraction, message) run on the
+        Tk thread. Any in-flight task on channel or on the channels listed
+        in supersedes is cancelled first.
+        """
+        for name in (channel, *supersedes):
+            self.cancel(name)
+
+        token = CancelToken()
+        task = _Task(channel, token, on_done, on_error, on_progress)
+
+        def progress(fraction, message=""):
+            token.check()
+            self._progress.put((task, fraction, message))
+
+        def run():
+            token.check()
+            return fn(token, progress)
+
+        task.future = self._executor.submit(run)
+        self._active[channel] = task
+        self._schedule_poll()
+        return token
+
+    def cancel(self, channel=None):
+        """Cancel the task on channel, or every task when channel is None"""
+        channels = list(self._active) if channel is None else [channel]
+        for name in channels:
+            task = self._active.pop(name, None)
+            if task is not None:
+                task.token.cancel()
+                task.future.cancel()
+
+    def busy(self, channel=None, ignore=()):
+        """Whether a task runs on channel, or on any channel not in ignore"""
+        if channel is None:
+            return any(name not in ignore for name in self._active)
+        return channel in self._active
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _schedule_poll(self):
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.poll_ms, self._poll)
+
+    def _poll(self):
+        self._polling = False
+
+        # Progress from tasks that are still current
+        while True:
+            try:
+                task, fraction, message = self._progress.get_nowait()
+            except queue.Empty:
+                break
+            if self._active.get(task.channel) is task and task.on_progress:
+                task.on_progress(fraction, message)
+
+        for channel, task in list(self._active.items()):
+            if not task.future.done():
+                continue
+            del self._active[channel]
+            try:
+                result = task.future.result()
+            except TaskCancelled:
+                continue
+            except Exception as e:
+                if task.on_error:
+                    task.on_error(e)
+                continue
+            task.on_done(result)
+
+        if self._active:
+            self._schedule_poll()
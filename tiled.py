@@ -0,0 +1,287 @@
+"""Tiled, memory-bounded conversion for poster-sized canvases.
+
+The regular pipeline holds several full-canvas copies at once (the resized
+canvas, the adjusted image, the upscaled result). For canvases bigger than
+that budget the canvas is instead processed in horizontal bands whose
+height is chosen from a memory ceiling:
+
+1. each band of the canvas is resampled straight from the source
+   (``Image.resize(box=...)`` keeps LANCZOS seamless across band edges),
+   reduced to one pixel per pixel_size block (see downsampling.py) and
+   adjusted; a reservoir sample of those pixels is kept for the palette fit;
+2. the palette is fitted once on that sample (or a fixed palette is used);
+3. the bands are produced again, mapped to their nearest palette colours
+   (through the LUT for a fixed palette, or an ordered ditherer, which
+   lines up across bands, exactly as PixelArtPipeline maps them), expanded
+   back to pixel_size blocks and appended to a streaming PNG writer.
+
+Only the decoded source plus one band live in memory, so the output can be
+far larger than RAM. Blocks are exact pixel_size squares (the last row and
+column may be partial), which matches the regular pipeline whenever the
+canvas is a multiple of pixel_size and the palette sample holds every
+downsampled pixel. (The K-means engines label pixels by their unrounded
+centres, so there a fraction of a percent of boundary pixels can differ.)
+"""
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from dithering import ORDERED_DITHERERS, get_ditherer
+from downsampling import get_downsampler, reduce_blocks
+from palette_lut import get_palette_lut
+from pipeline import ConversionSettings, PixelArtPipeline, fit_within, _no_progress
+from profiling import span, traced
+from quantizers import assign_labels, quantize_colors
+from shared_palette import ReservoirSampler
+
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+# Full-width canvas buffers alive per band: source resample, adjusted band,
+# upscaled output and the PNG scanline buffer
+BAND_COPIES = 4
+# Small (downsampled) pixels kept for the palette fit when fit_samples is unset
+PALETTE_SAMPLE_SIZE = 200_000
+
+
+class PNGStreamWriter:
+    """Write an 8-bit RGB/RGBA PNG row band by row band"""
+
+    def __init__(self, path, width, height, mode, compress_level=6, chunk_size=1 << 16):
+        if mode not in ('RGB', 'RGBA'):
+            raise ValueError(f"PNGStreamWriter supports RGB and RGBA, not {mode}")
+        self.width = width
+        self.height = height
+        self.channels = len(mode)
+        self.rows_written = 0
+        self.chunk_size = chunk_size
+        self._file = open(path, 'wb')
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = []
+        self._pending_bytes = 0
+
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        color_type = 6 if mode == 'RGBA' else 2
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(kind)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    def _emit(self, data):
+        if data:
+            self._pending.append(data)
+            self._pending_bytes += len(data)
+        if self._pending_bytes >= self.chunk_size:
+            self._flush_idat()
+
+    def _flush_idat(self):
+        if self._pending:
+            self._chunk(b'IDAT', b''.join(self._pending))
+            self._pending, self._pending_bytes = [], 0
+
+    def write_rows(self, rows):
+        """Append an (n, width, channels) uint8 array of rows"""
+        rows = np.ascontiguousarray(rows, dtype=np.uint8)
+        if rows.shape[1:] != (self.width, self.channels):
+            raise ValueError(f"Expected rows of shape (n, {self.width}, {self.channels}), "
+                             f"got {rows.shape}")
+        if self.rows_written + len(rows) > self.height:
+            raise ValueError("More rows written than the image height")
+        # Filter type 0 (None) byte in front of every scanline
+        scanlines = np.zeros((len(rows), 1 + self.width * self.channels), dtype=np.uint8)
+        scanlines[:, 1:] = rows.reshape(len(rows), -1)
+        self._emit(self._compressor.compress(scanlines.tobytes()))
+        self.rows_written += len(rows)
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"Wrote {self.rows_written} of {self.height} rows")
+            self._emit(self._compressor.flush())
+            self._flush_idat()
+            self._chunk(b'IEND', b'')
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+
+class TiledConverter:
+    """Convert a source image onto a very large canvas in bounded bands"""
+
+    def __init__(self, settings=None, memory_limit=DEFAULT_MEMORY_LIMIT, palette=None):
+        self.settings = settings or ConversionSettings()
+        if self.settings.dither not in ORDERED_DITHERERS:
+            # Error diffusion would have to carry its error across band edges
+            raise ValueError(f"Tiled conversion supports ordered dithering only, "
+                             f"not {self.settings.dither!r}")
+        self.memory_limit = memory_limit
+        self.palette = None if palette is None else np.asarray(palette, dtype=int).reshape(-1, 3)
+        self.pipeline = PixelArtPipeline(self.settings)
+
+    @property
+    def output_mode(self):
+        return 'RGBA' if self.settings.transparent_background else 'RGB'
+
+    def band_height(self):
+        """Canvas rows per band: a multiple of pixel_size within the memory limit"""
+        s = self.settings
+        row_bytes = s.canvas_width * 4 * BAND_COPIES
+        rows = max(1, self.memory_limit // row_bytes)
+        return max(s.pixel_size, rows - rows % s.pixel_size)
+
+    def _placement(self, source):
+        """Where the resized source sits on the canvas: (x, y, width, height)"""
+        s = self.settings
+        if not s.proportional_resize:
+            return 0, 0, s.canvas_width, s.canvas_height
+        size = fit_within(source.size, (s.canvas_width, s.canvas_height))
+        return ((s.canvas_width - size[0]) // 2, (s.canvas_height - size[1]) // 2) + size
+
+    def _prepare_source(self, source):
+        s = self.settings
+        if s.transparent_background:
+            return source if source.mode == 'RGBA' else source.convert('RGBA')
+        if s.proportional_resize and source.mode == 'RGBA':
+            # Composited onto white band by band
+            return source
+        return source if source.mode == 'RGB' else source.convert('RGB')
+
+    @traced('resize')
+    def canvas_band(self, source, placement, y0, y1):
+        """Rows y0:y1 of the canvas that resize_to_canvas would produce"""
+        s = self.settings
+        px, py, pw, ph = placement
+        if s.transparent_background:
+            band = Image.new('RGBA', (s.canvas_width, y1 - y0), (0, 0, 0, 0))
+        else:
+            band = Image.new('RGB', (s.canvas_width, y1 - y0), (255, 255, 255))
+
+        top, bottom = max(y0, py), min(y1, py + ph)
+        if top < bottom:
+            # Source rows covering canvas rows top:bottom of the placed image
+            scale = source.height / ph
+            box = (0, (top - py) * scale, source.width, (bottom - py) * scale)
+            part = source.resize((pw, bottom - top), Image.Resampling.LANCZOS, box=box)
+            if part.mode == 'RGBA':
+                band.paste(part, (px, top - y0), part)
+            else:
+                band.paste(part, (px, top - y0))
+        return band
+
+    def small_band(self, band):
+        """Reduce a canvas band to one pixel per pixel_size block, then adjust it"""
+        s = self.settings
+        p = s.pixel_size
+        pixels = np.asarray(band)
+        reducer = get_downsampler(s.downsample_mode)
+        with span('downsample'):
+            if reducer is None:
+                rows = np.minimum(np.arange(0, band.height, p) + p // 2, band.height - 1)
+                cols = np.minimum(np.arange(0, band.width, p) + p // 2, band.width - 1)
+                small = pixels[rows][:, cols]
+            else:
+                grid = (-(-band.width // p), -(-band.height // p))
+                small = reduce_blocks(pixels, p, grid, reducer)
+        return np.asarray(self.pipeline.adjust(Image.fromarray(small, band.mode)))
+
+    def iter_small_bands(self, source, progress, start, span):
+        s = self.settings
+        placement = self._placement(source)
+        step = self.band_height()
+        for y0 in range(0, s.canvas_height, step):
+            y1 = min(y0 + step, s.canvas_height)
+            progress(start + span * y0 / s.canvas_height, "Processing tiles")
+            yield y0, y1, self.small_band(self.canvas_band(source, placement, y0, y1))
+
+    def fit_palette(self, source, progress=_no_progress):
+        """Pass 1: sample the downsampled canvas and fit the palette on it"""
+        s = self.settings
+        sampler = ReservoirSampler(s.fit_samples or PALETTE_SAMPLE_SIZE)
+        for _, _, small in self.iter_small_bands(source, progress, 0.0, 0.5):
+            pixels = small.reshape(-1, small.shape[2])
+            if pixels.shape[1] == 4:
+                pixels = pixels[pixels[:, 3] > 0]
+            sampler.add(pixels[:, :3])
+        if sampler.seen == 0:
+            return np.empty((0, 3), dtype=int)
+        with span('fit'):
+            palette, _ = quantize_colors(s.quantizer, sampler.sample, s.color_count)
+        return palette
+
+    @traced('map')
+    def map_band(self, small, palette, lut=None):
+        """Replace every visible pixel of a downsampled band with its palette colour.
+
+        Labels are the exact nearest colours, as for a fitted palette in
+        PixelArtPipeline, or come from lut for a fixed palette.
+        """
+        out = np.array(small, dtype=np.uint8)
+        mask = out[:, :, 3] > 0 if out.shape[2] == 4 else np.ones(out.shape[:2], dtype=bool)
+        pixels = out[mask, :3]
+        labels = lut.map_indices(pixels) if lut is not None else assign_labels(pixels, palette)
+        out[mask, :3] = np.asarray(palette, dtype=np.uint8)[labels]
+        return out
+
+    @traced('map')
+    def dither_band(self, small, palette, row):
+        """Map a downsampled band through the ordered ditherer; row is its first row"""
+        out = np.array(small, dtype=np.uint8)
+        mask = out[:, :, 3] > 0 if out.shape[2] == 4 else None
+        labels = get_ditherer(self.settings.dither)(out[:, :, :3], palette, mask,
+                                                    origin=(row, 0))
+        colors = np.asarray(palette, dtype=np.uint8)[labels]
+        if mask is None:
+            out[:, :, :3] = colors
+        else:
+            out[mask, :3] = colors[mask]
+        return out
+
+    def convert(self, source, output_path, progress=None):
+        """Convert source onto the canvas and stream it to output_path (PNG).
+
+        Returns the palette used.
+        """
+        if not str(output_path).lower().endswith('.png'):
+            raise ValueError(f"Tiled output must be a .png file, got {output_path}")
+        progress = progress or _no_progress
+        s = self.settings
+        source = self._prepare_source(source)
+        palette = self.palette
+        if palette is None:
+            palette = self.fit_palette(source, progress)
+        # A fixed palette is mapped through its LUT, as in PixelArtPipeline
+        lut = get_palette_lut(palette) if self.palette is not None and len(palette) else None
+
+        p = s.pixel_size
+        with PNGStreamWriter(output_path, s.canvas_width, s.canvas_height,
+                             self.output_mode) as writer:
+            for y0, y1, small in self.iter_small_bands(source, progress, 0.5, 0.5):
+                if len(palette) and s.dither != 'none':
+                    small = self.dither_band(small, palette, y0 // p)
+                elif len(palette):
+                    small = self.map_band(small, palette, lut)
+                with span('upscale'):
+                    band = np.repeat(np.repeat(small, p, axis=0), p, axis=1)
+                with span('save'):
+                    writer.write_rows(band[:y1 - y0, :s.canvas_width])
+        progress(1.0, "Done")
+        return palette
+
+
+def convert_tiled(source, output_path, settings, memory_limit=DEFAULT_MEMORY_LIMIT,
+                  palette=None, progress=None):
+    """Convenience wrapper around TiledConverter.convert"""
+    return TiledConverter(settings, memory_limit, palette).convert(source, output_path, progress)